@@ -71,6 +71,7 @@ module COBRApyBasedFBA {
         string fba_type;
         string fva_type;
         bool simulate_ko;
+        bool simulate_double_ko;
         bool all_reversible;
 
         float fraction_of_optimum_pfba;
@@ -87,6 +88,13 @@ module COBRApyBasedFBA {
         float max_s_uptake;
         float max_o_uptake;
         float default_max_uptake;
+
+        int fva_processes;
+        int fva_chunk_size;
+        int ko_processes;
+        float double_ko_time_budget;
+        bool fva_pruning;
+        float time_budget_seconds;
     } RunFBAPipelineParams;
     
     typedef structure {
@@ -100,4 +108,34 @@ module COBRApyBasedFBA {
     */
     funcdef run_fba_pipeline(RunFBAPipelineParams params) returns (RunFBAPipelineResults results) authentication required;
 
+    /*
+        Media, knockouts and bounds of one condition in a batch run.
+        Other parameters are taken from the batch's shared params.
+    */
+    typedef structure {
+        media_id media_id;
+        fba_id fba_output_id;
+        list<feature_id> feature_ko_list;
+        list<reaction_id> reaction_ko_list;
+        list<CustomBounds> custom_bound_list;
+    } FBACondition;
+
+    typedef structure {
+        RunFBAPipelineParams params;
+        list<FBACondition> conditions;
+        int batch_processes;
+    } RunFBAPipelineBatchParams;
+
+    typedef structure {
+        list<ws_fba_id> new_fba_refs;
+        string report_name;
+        ws_report_id report_ref;
+    } RunFBAPipelineBatchResults;
+    /*
+        Run flux balance analysis on one model under several conditions
+        and return the IDs of the FBA objects with results. The model is
+        downloaded and converted once and shared by all conditions.
+    */
+    funcdef run_fba_pipeline_batch(RunFBAPipelineBatchParams params) returns (RunFBAPipelineBatchResults results) authentication required;
+
 };
@@ -3,14 +3,18 @@
 # The header block is where all import statments should live
 import logging
 import os
+import time
 import uuid
 from pprint import pformat
 
 from installed_clients.KBaseReportClient import KBaseReport
 from installed_clients.DataFileUtilClient import DataFileUtil
+from installed_clients import baseclient
 from COBRApyBasedFBA.fba_pipeline import FBAPipeline
-from COBRApyBasedFBA.report import build_report
-from cobrakbase.core.converters import KBaseFBAModelToCobraBuilder
+from COBRApyBasedFBA.report import build_report, build_batch_report
+from COBRApyBasedFBA.model_cache import ModelCache, ObjectCache, SnapshotCache
+from COBRApyBasedFBA.workspace_objects import WorkspaceObjects, OBJECT_DATA_PREFIX
+from COBRApyBasedFBA.fbamodel import FBAMODEL_PATHS, build_model, stream_model, ijson
 import cobrakbase
 #END_HEADER
 
@@ -36,6 +40,88 @@ class COBRApyBasedFBA:
 
     #BEGIN_CLASS_HEADER
     # Class variables and functions can be defined in this block
+    @staticmethod
+    def _prepare_params(params):
+        # TODO: temp fix. fix cobrakbase
+        if params['target_reaction'] == 'bio1':
+          params['target_reaction'] += '_biomass'
+
+        # Requires media and fbamodel to be in the same workspace.
+        params['fbamodel_workspace'] = params['workspace']
+        params['media_workspace'] = params['workspace']
+
+    def _fetch_model_and_media(self, store, model_ref, media_refs):
+        """Return (model, genome_ref) for the FBAModel at model_ref, built
+           without media, which each run applies with
+           FBAPipeline.apply_media, its versioned reference and
+           (media_json, info) of each ref in media_refs. Converted models
+           are cached on disk by versioned reference, so repeat runs skip
+           both the download and the conversion whatever their media.
+           Versioned refs are looked up as they are, any others resolved
+           first in one get_object_info3 call. On a miss the FBAModel,
+           limited to FBAMODEL_PATHS, is downloaded with the media in a
+           single get_objects2 call through the object cache. A model
+           resolved to a size too large to cache is instead streamed in
+           its own call and, with ijson installed, converted as it is
+           parsed."""
+        resolved = store.resolve_infos([model_ref] + list(media_refs))
+        model_ref, model_info = resolved[0]
+        media_specs = [{'ref': ref} for ref, _ in resolved[1:]]
+        key = ModelCache.key(model_ref, getattr(cobrakbase, '__version__', ''))
+        cached = self.model_cache.get(key)
+        if cached is not None:
+            return cached, model_ref, store.get_objects(media_specs)
+
+        if ijson is not None and model_info is not None and not store.cacheable(model_info):
+            with store.open_object(model_ref, FBAMODEL_PATHS) as f:
+                model, fbamodel_json = stream_model(f, prefix=OBJECT_DATA_PREFIX)
+            media_objects = store.get_objects(media_specs)
+        else:
+            objects = store.get_objects([{'ref': model_ref, 'included': FBAMODEL_PATHS}] +
+                                        media_specs)
+            (fbamodel_json, _), media_objects = objects[0], objects[1:]
+            model = build_model(fbamodel_json)
+        cached = model, fbamodel_json.get('genome_ref', '')
+
+        self.model_cache.put(key, cached)
+        return cached, model_ref, media_objects
+
+    def _model_snapshot(self, model_ref, model):
+        """Return the ModelSnapshot of model, the FBAModel at the versioned
+           model_ref, from the snapshot cache, writing it there first on a
+           miss. Pipelines read null spaces from its arrays, and worker
+           processes map the same file instead of copying it."""
+        key = SnapshotCache.key(model_ref, getattr(cobrakbase, '__version__', ''))
+        snapshot = self.snapshot_cache.get(key)
+        if snapshot is None:
+            self.snapshot_cache.put(key, model)
+            snapshot = self.snapshot_cache.get(key)
+        return snapshot
+
+    def _save_html_report(self, ctx, html, workspace, objects_created):
+        html_report_folder = os.path.join(self.shared_folder, str(uuid.uuid4()))
+        os.makedirs(html_report_folder, exist_ok=True)
+        with open(os.path.join(html_report_folder, 'view.html'), 'w') as f:
+            f.write(html)
+
+        report_shock_id = self.dfu.file_to_shock({'file_path': html_report_folder,
+                                                  'pack': 'zip'})['shock_id']
+        html_output = {
+            'name' : 'view.html',
+            'shock_id': report_shock_id
+        }
+
+        report_params = {
+            'objects_created': objects_created,
+            'workspace_name': workspace,
+            'html_links': [html_output],
+            'direct_html_link_index': 0,
+            'html_window_height': 500,
+            'report_object_name': 'COBRApyBasedFBA_report_' + str(uuid.uuid4())
+        }
+
+        report = KBaseReport(self.callback_url, token=ctx['token'])
+        return report.create_extended_report(report_params)
     #END_CLASS_HEADER
 
     # config contains contents of config file in a hash or None if it couldn't
@@ -47,9 +133,22 @@ class COBRApyBasedFBA:
         # saved in the constructor.
         self.callback_url = os.environ['SDK_CALLBACK_URL']
         self.shared_folder = config['scratch']
+        # Connections kept open to each service by the service clients
+        baseclient.POOL_SIZE = int(config.get('http-pool-size', baseclient.POOL_SIZE))
         self.dfu = DataFileUtil(self.callback_url)
         self.config = config
 
+        # Cache of converted models, bounded to model-cache-max-bytes
+        self.model_cache = ModelCache(os.path.join(self.shared_folder, 'model_cache'),
+                                      int(config.get('model-cache-max-bytes', 2 * 1024 ** 3)))
+        # Cache of downloaded workspace objects, bounded to object-cache-max-bytes
+        self.object_cache = ObjectCache(os.path.join(self.shared_folder, 'object_cache'),
+                                        int(config.get('object-cache-max-bytes', 2 * 1024 ** 3)))
+        # Snapshots of converted models, bounded to snapshot-cache-max-bytes
+        self.snapshot_cache = SnapshotCache(
+            os.path.join(self.shared_folder, 'snapshot_cache'),
+            int(config.get('snapshot-cache-max-bytes', 1024 ** 3)))
+
         logging.basicConfig(format='%(created)s %(levelname)s: %(message)s',
                             level=logging.INFO)
         #END_CONSTRUCTOR
@@ -73,6 +172,7 @@ class COBRApyBasedFBA:
            parameter "solver" of String, parameter "minimize_objective" of
            type "bool" (A binary boolean), parameter "fba_type" of String,
            parameter "fva_type" of String, parameter "simulate_ko" of type
+           "bool" (A binary boolean), parameter "simulate_double_ko" of type
            "bool" (A binary boolean), parameter "all_reversible" of type
            "bool" (A binary boolean), parameter "fraction_of_optimum_pfba" of
            Double, parameter "fraction_of_optimum_fva" of Double, parameter
@@ -87,7 +187,12 @@ class COBRApyBasedFBA:
            "custom_ub" of Double, parameter "max_c_uptake" of Double,
            parameter "max_n_uptake" of Double, parameter "max_p_uptake" of
            Double, parameter "max_s_uptake" of Double, parameter
-           "max_o_uptake" of Double, parameter "default_max_uptake" of Double
+           "max_o_uptake" of Double, parameter "default_max_uptake" of
+           Double, parameter "fva_processes" of Long, parameter
+           "fva_chunk_size" of Long, parameter "ko_processes" of Long,
+           parameter "double_ko_time_budget" of Double, parameter
+           "fva_pruning" of type "bool" (A binary boolean), parameter
+           "time_budget_seconds" of Double
         :returns: instance of type "RunFBAPipelineResults" -> structure:
            parameter "new_fba_ref" of type "ws_fba_id" (The workspace ID for
            a FBA data object. @id ws KBaseFBA.FBA), parameter "objective" of
@@ -98,33 +203,29 @@ class COBRApyBasedFBA:
         # ctx is the context object
         # return variables are: results
         #BEGIN run_fba_pipeline
+        # time_budget_seconds counts from here, fetching included
+        start = time.monotonic()
 
-        # TODO: temp fix. fix cobrakbase
-        if params['target_reaction'] == 'bio1':
-          params['target_reaction'] += '_biomass'
-
-        # Requires media and fbamodel to be in the same workspace.
-        params['fbamodel_workspace'] = params['workspace']
-        params['media_workspace'] = params['workspace']
+        self._prepare_params(params)
         workspace_id = int(params['fbamodel_id'].split('/')[0])
 
-        kbase = cobrakbase.KBaseAPI(ctx['token'], config=self.config)
-        ref = kbase.get_object_info_from_ref(params['fbamodel_id'])
-        fbamodel_json = kbase.get_object(ref.id, ref.workspace_id)
-        fbamodel = cobrakbase.core.model.KBaseFBAModel(fbamodel_json)
-        
-        # Retrieve media
-        ref = kbase.get_object_info_from_ref(params['media_id'])
-        media_json = kbase.get_object(ref.id, ref.workspace_id)
+        # Model from the cache or downloaded with the media in one round trip
+        store = WorkspaceObjects(self.config['workspace-url'], ctx['token'], self.object_cache)
+        (model, genome_ref), model_ref, [(media_json, _)] = self._fetch_model_and_media(
+            store, params['fbamodel_id'], [params['media_id']])
         media = cobrakbase.core.KBaseBiochemMedia(media_json)
 
         # TODO: add extra compounds to media with params['media_supplement_list']
         #       see what these params look like
 
-        builder = KBaseFBAModelToCobraBuilder(fbamodel)
-        model = builder.with_media(media).build()
+        snapshot = self._model_snapshot(model_ref, model)
 
         pipeline = FBAPipeline.fromKBaseParams(params)
+        pipeline.apply_media(model, media)
+        pipeline.genome_ref = genome_ref
+        pipeline.nullspace_cache = self.model_cache
+        pipeline.snapshot = snapshot
+        pipeline.budget_start = start
         # Result is fba type object
         result, fva_sol, fba_sol, essential_genes = pipeline.run(model, media)
 
@@ -139,32 +240,13 @@ class COBRApyBasedFBA:
         }
         self.dfu.save_objects(save_object_params)
 
-        html_report_folder = os.path.join(self.shared_folder, 'subfolder')
-        os.makedirs(html_report_folder, exist_ok=True)
-        with open(os.path.join(html_report_folder, 'view.html'), 'w') as f:
-            f.write(build_report(pipeline, model, fba_sol, fva_sol, essential_genes,
-                                 result['fbamodel_ref'], result['media_ref']))
-
-        report_shock_id = self.dfu.file_to_shock({'file_path': html_report_folder,
-                                                  'pack': 'zip'})['shock_id']
-        html_output = {
-            'name' : 'view.html',
-            'shock_id': report_shock_id
-        }
+        html = build_report(pipeline, model, fba_sol, fva_sol, essential_genes,
+                            result['fbamodel_ref'], result['media_ref'])
 
         # Step 5 - Build a Report and return
-        report_params = {
-            'objects_created': [{'ref': f"{params['workspace']}/{params['fba_output_id']}",
-                                 'description': 'FBA'}],
-            'workspace_name': params['workspace'],
-            'html_links': [html_output],
-            'direct_html_link_index': 0,
-            'html_window_height': 500,
-            'report_object_name': 'COBRApyBasedFBA_report_' + str(uuid.uuid4())
-        }
-
-        report = KBaseReport(self.callback_url, token=ctx['token'])
-        report_info = report.create_extended_report(report_params)
+        objects_created = [{'ref': f"{params['workspace']}/{params['fba_output_id']}",
+                            'description': 'FBA'}]
+        report_info = self._save_html_report(ctx, html, params['workspace'], objects_created)
 
         # Contruct the output to send back
         results = {
@@ -184,12 +266,98 @@ class COBRApyBasedFBA:
                              'results is not type dict as required.')
         # return the results
         return [results]
+
+    def run_fba_pipeline_batch(self, ctx, params):
+        """
+        Run flux balance analysis on one model under several conditions
+        and return the IDs of the FBA objects with results. The model is
+        downloaded and converted once and shared by all conditions.
+        :param params: instance of type "RunFBAPipelineBatchParams" ->
+           structure: parameter "params" of type "RunFBAPipelineParams"
+           (see run_fba_pipeline), parameter "conditions" of list of type
+           "FBACondition" -> structure: parameter "media_id" of type
+           "media_id" (A string representing a Media id.), parameter
+           "fba_output_id" of type "fba_id" (A string representing a FBA
+           id.), parameter "feature_ko_list" of list of type "feature_id"
+           (A string representing a feature id.), parameter
+           "reaction_ko_list" of list of type "reaction_id" (A string
+           representing a reaction id.), parameter "custom_bound_list" of
+           list of type "CustomBounds" -> structure: parameter
+           "custom_reaction_id" of type "reaction_id" (A string
+           representing a reaction id.), parameter "custom_lb" of Double,
+           parameter "custom_ub" of Double, parameter "batch_processes" of
+           Long
+        :returns: instance of type "RunFBAPipelineBatchResults" ->
+           structure: parameter "new_fba_refs" of list of type "ws_fba_id"
+           (The workspace ID for a FBA data object. @id ws KBaseFBA.FBA),
+           parameter "report_name" of String, parameter "report_ref" of
+           type "ws_report_id" (The workspace ID for a Report object @id ws
+           KBaseReport.Report)
+        """
+        # ctx is the context object
+        # return variables are: results
+        #BEGIN run_fba_pipeline_batch
+        base_params = params['params']
+        self._prepare_params(base_params)
+        workspace_id = int(base_params['fbamodel_id'].split('/')[0])
+
+        # Model from the cache or downloaded with every media in one round trip
+        store = WorkspaceObjects(self.config['workspace-url'], ctx['token'], self.object_cache)
+        params_list = [dict(base_params, **condition) for condition in params['conditions']]
+        media_ids = list(dict.fromkeys(condition['media_id'] for condition in params_list))
+        # The model is converted once, each condition applies its own media
+        (model, genome_ref), model_ref, media_objects = self._fetch_model_and_media(
+            store, base_params['fbamodel_id'], media_ids)
+        medias = {media_id: cobrakbase.core.KBaseBiochemMedia(media_json)
+                  for media_id, (media_json, _) in zip(media_ids, media_objects)}
+        snapshot = self._model_snapshot(model_ref, model)
+
+        conditions = []
+        for condition_params in params_list:
+            pipeline = FBAPipeline.fromKBaseParams(condition_params)
+            pipeline.genome_ref = genome_ref
+            pipeline.nullspace_cache = self.model_cache
+            pipeline.snapshot = snapshot
+            conditions.append((pipeline, medias[condition_params['media_id']]))
+
+        batch = FBAPipeline.run_many(model, conditions, params.get('batch_processes'))
+
+        # Save one FBA object per condition in a single call
+        self.dfu.save_objects({
+            'id': workspace_id,
+            'objects': [{'type': 'KBaseFBA.FBA',
+                         'data': result,
+                         'name': result['id']} for _, result, _ in batch]
+        })
+
+        new_fba_refs = [f"{base_params['workspace']}/{result['id']}" for _, result, _ in batch]
+        html = build_batch_report(batch, batch[0][1]['fbamodel_ref'] if batch else '')
+        objects_created = [{'ref': ref, 'description': 'FBA'} for ref in new_fba_refs]
+        report_info = self._save_html_report(ctx, html, base_params['workspace'],
+                                             objects_created)
+
+        results = {
+            'new_fba_refs': new_fba_refs,
+            'report_name': report_info['name'],
+            'report_ref': report_info['ref']
+        }
+        #END run_fba_pipeline_batch
+
+        # At some point might do deeper type checking...
+        if not isinstance(results, dict):
+            raise ValueError('Method run_fba_pipeline_batch return value ' +
+                             'results is not type dict as required.')
+        # return the results
+        return [results]
     def status(self, ctx):
         #BEGIN_STATUS
         returnVal = {'state': "OK",
                      'message': "",
                      'version': self.VERSION,
                      'git_url': self.GIT_URL,
-                     'git_commit_hash': self.GIT_COMMIT_HASH}
+                     'git_commit_hash': self.GIT_COMMIT_HASH,
+                     'model_cache': self.model_cache.stats(),
+                     'object_cache': self.object_cache.stats(),
+                     'snapshot_cache': self.snapshot_cache.stats()}
         #END_STATUS
         return [returnVal]
@@ -342,6 +342,10 @@ class Application(object):
                              name='COBRApyBasedFBA.run_fba_pipeline',
                              types=[dict])
         self.method_authentication['COBRApyBasedFBA.run_fba_pipeline'] = 'required'  # noqa
+        self.rpc_service.add(impl_COBRApyBasedFBA.run_fba_pipeline_batch,
+                             name='COBRApyBasedFBA.run_fba_pipeline_batch',
+                             types=[dict])
+        self.method_authentication['COBRApyBasedFBA.run_fba_pipeline_batch'] = 'required'  # noqa
         self.rpc_service.add(impl_COBRApyBasedFBA.status,
                              name='COBRApyBasedFBA.status',
                              types=[dict])
@@ -1,8 +1,576 @@
+import copy
 import math
+import queue
+import time
+import itertools
+import functools
+import multiprocessing
+import numpy as np
 import cobra
 import cobrakbase
-from cobrakbase.modelseed.utils import atom_count
+import pandas as pd
+from optlang.symbolics import Zero
+from cobra.util.array import create_stoichiometric_matrix, nullspace
+from cobra.util.context import get_context
+from cobra.util.solver import check_solver_status, interface_to_str, linear_reaction_coefficients
 from cobrakbase.core.kbase_fba_builder import KBaseFBABuilder
+from COBRApyBasedFBA.gpr import CompiledGPR
+from COBRApyBasedFBA.highs import HighsLP
+from COBRApyBasedFBA.nullspace import internal_nullspace
+from COBRApyBasedFBA.report import report_data
+from COBRApyBasedFBA.solver_profile import (SolverProfile, analysis_type, installed_solvers,
+                                            size_class)
+from COBRApyBasedFBA.uptake import uptake_constraints
+
+
+class _WorkerState:
+    """State of the chunk functions of a map: the model they solve and
+       what they find from it on first use. A worker process gets its
+       own from the pool initializer, a map run in this process creates
+       one for itself, so nested maps never share state."""
+
+    def __init__(self, model):
+        # Model the chunks are solved on, a cobra.Model or a HighsLP.
+        # Every worker receives its own copy of the model, and therefore
+        # of the solver problem, once through the pool initializer
+        # instead of once per task.
+        self.model = model
+
+        # Compiled gene-reaction rules of model, built on first use.
+        self.gpr = None
+
+        # Running (minimum, maximum) flux of each reaction over the LP
+        # solutions seen during pruned FVA, None when not pruning.
+        self.fva_seen = None
+
+        # Solver columns, (forward, reverse) solver variables and (lower,
+        # upper) bounds of each reaction of model, and indices of its
+        # boundary reactions, found on first use by FVA.
+        self.fva_columns = None
+        self.fva_variables = None
+        self.fva_bounds = None
+        self.fva_boundary = None
+
+        # Copy of model restricted to loopless fluxes, built on first use
+        # by Loopless FVA when its MILPs are solved.
+        self.fva_milp = None
+
+# State of this worker process, set by the pool initializer
+_worker = None
+
+def _init_worker(model):
+    global _worker
+    _worker = _WorkerState(model)
+    # Parallelism comes from the pool, each worker solves one LP at a time
+    if isinstance(model, cobra.Model) and 'coinor_cbc' in model.solver.interface.__name__:
+        model.solver.configuration.threads = 1
+
+def _call_chunk(args):
+    """Apply func to chunk with the state of this worker process."""
+    func, chunk = args
+    return func(_worker, chunk)
+
+def _flux_columns(model):
+    """Return the solver columns of the forward and reverse variable
+       of each reaction of model, as two arrays in reaction order."""
+    columns = {var.name: i for i, var in enumerate(model.solver.variables)}
+    return (np.array([columns[rct.id] for rct in model.reactions]),
+            np.array([columns[rct.reverse_id] for rct in model.reactions]))
+
+def _solver_fluxes(model, columns):
+    """Return the net flux of each reaction in the current solution."""
+    # The private accessor skips building the name keyed dict of
+    # primal_values, which costs as much as an LP on genome scale models
+    primals = np.array(model.solver._get_primal_values())
+    return primals[columns[0]] - primals[columns[1]]
+
+def _observe_fluxes(state, fluxes=None):
+    """Widen the running flux ranges in state.fva_seen with fluxes, by
+       default those of the current solution."""
+    if fluxes is None:
+        fluxes = _solver_fluxes(state.model, state.fva_columns)
+    np.minimum(state.fva_seen[0], fluxes, out=state.fva_seen[0])
+    np.maximum(state.fva_seen[1], fluxes, out=state.fva_seen[1])
+
+def _set_flux_bounds(variables, lb, ub):
+    """Bound the flux of the (forward, reverse) solver variables of a
+       reaction to [lb, ub], leaving the reaction's own bounds and any
+       model context untouched."""
+    forward, reverse = variables
+    forward.set_bounds(max(lb, 0), max(ub, 0))
+    reverse.set_bounds(max(-ub, 0), max(-lb, 0))
+
+def _loopless_milp(state, milp_idx):
+    """Return a copy of state.model with a zero objective whose
+       feasible fluxes are loopless, by the constraints of cobra's
+       add_loopless on the reactions at milp_idx, those that can be part
+       of a loop.
+       A loop of a flux vector respects reaction directions, so it only
+       runs through such reactions and constraining them is exact."""
+    milp = state.model.copy()
+    milp.objective = Zero
+    reactions = milp.reactions
+    basis = nullspace(create_stoichiometric_matrix(milp)[:, milp_idx])
+    max_bound = max(max(abs(b) for b in rct.bounds) for rct in reactions)
+
+    # Binary a_i gives the direction of reaction i and delta_g_i has the
+    # opposite sign, so no flux can run around a loop
+    delta_g, to_add = [], []
+    for i in milp_idx:
+        rct = reactions[i]
+        indicator = milp.problem.Variable(f'indicator_{rct.id}', type='binary')
+        delta_g.append(milp.problem.Variable(f'delta_g_{rct.id}'))
+        to_add += [indicator, delta_g[-1],
+                   milp.problem.Constraint(rct.flux_expression - max_bound * indicator,
+                                           lb=-max_bound, ub=0, name=f'on_off_{rct.id}'),
+                   milp.problem.Constraint(delta_g[-1] + (max_bound + 1) * indicator,
+                                           lb=1, ub=max_bound, name=f'delta_g_range_{rct.id}')]
+    milp.add_cons_vars(to_add)
+
+    constraints = [milp.problem.Constraint(Zero, lb=0, ub=0, name=f'nullspace_constraint_{k}')
+                   for k in range(basis.shape[1])]
+    milp.add_cons_vars(constraints)
+    # Coefficients can only be set once the constraints are in the problem
+    milp.solver.update()
+    for constraint, column in zip(constraints, basis.T):
+        constraint.set_linear_coefficients({var: coef for var, coef in zip(delta_g, column)
+                                            if abs(coef) > FBAPipeline.ZERO_FLUX})
+    return milp
+
+def _loopless_milp_value(state, rct_idx, direction, milp_idx, deadline=None):
+    """Return the loopless extreme of the reaction at rct_idx of
+       state.model in direction, solved on state.fva_milp built with
+       milp_idx, or None if the MILP is not solved to optimality. The
+       MILP gets LOOPLESS_MILP_TIMEOUT seconds, or what is left until the
+       time.monotonic deadline, and is not solved past it."""
+    timeout = FBAPipeline.LOOPLESS_MILP_TIMEOUT
+    if deadline is not None:
+        timeout = min(timeout, deadline - time.monotonic())
+        if timeout <= 0:
+            return None
+    if state.fva_milp is None:
+        state.fva_milp = _loopless_milp(state, milp_idx)
+    state.fva_milp.solver.configuration.timeout = timeout
+
+    rct = state.fva_milp.reactions[rct_idx]
+    objective = state.fva_milp.solver.objective
+    objective.set_linear_coefficients({rct.forward_variable: 1, rct.reverse_variable: -1})
+    objective.direction = direction
+    state.fva_milp.slim_optimize()
+    value = None
+    if state.fva_milp.solver.status == 'optimal':
+        value = objective.value
+        if state.fva_seen is not None:
+            # The column accessor of _solver_fluxes gives glpk's LP rather
+            # than MIP values, so fluxes are read variable by variable
+            _observe_fluxes(state, np.array([r.forward_variable.primal - r.reverse_variable.primal
+                                             for r in state.fva_milp.reactions]))
+    objective.set_linear_coefficients({rct.forward_variable: 0, rct.reverse_variable: 0})
+    return value
+
+def _loopless_fva_value(state, rct, current, loop_idx, milp_idx=None, deadline=None):
+    """Return (value, approximate) where value is a loopless extreme of
+       rct in state.model given current, its
+       extreme in the current FVA solution. Loops are removed from the
+       solution with CycleFreeFlux as in cobra's loopless_fva_iter, but
+       by editing solver bounds and coefficients directly since its model
+       context resets dominate the time of each call. Only the reactions
+       at loop_idx, the indices of the internal null space support, are
+       relaxed. With boundary fluxes fixed, the flux of every other
+       internal reaction can not change.
+
+       An extreme kept by loop removal is attained by a loopless flux
+       vector, and is exact. Otherwise the loops the extreme depends on
+       are closed, rct is optimized again and the new extreme checked the
+       same way, until one is kept or no loop is left to close, in which
+       case the flux of rct in the last loopless solution is taken. If the
+       solver fails on a loop removal LP, that flux, or the plain extreme
+       when there is none yet, is taken unconfirmed. Such an
+       extreme is loopless but may fall short of the exact one, which is
+       solved as a MILP on the reactions at milp_idx if given, see
+       _loopless_milp_value for deadline. approximate tells whether the
+       extreme is such an unconfirmed one."""
+    if rct.boundary:
+        return current, False
+
+    model, variables = state.model, state.fva_variables
+    cutoff = model.tolerance
+    objective = model.solver.objective
+    direction = objective.direction
+    rct_idx = model.reactions.index(rct)
+    rct_coefs = {rct.forward_variable: 1, rct.reverse_variable: -1}
+    lower, upper = state.fva_bounds[0].copy(), state.fva_bounds[1].copy()
+    changed = np.concatenate([state.fva_boundary, loop_idx, [rct_idx]])
+
+    value = current
+    closed = set()
+    while True:
+        # Keep boundary fluxes and minimize loop flux without sign changes
+        fluxes = _solver_fluxes(model, state.fva_columns)
+        cycle_free = {}
+        for i in state.fva_boundary:
+            _set_flux_bounds(variables[i], fluxes[i], fluxes[i])
+        for i in loop_idx:
+            # Fluxes may pass bounds by the solver's tolerance
+            flux = min(max(fluxes[i], lower[i]), upper[i])
+            if flux >= 0:
+                _set_flux_bounds(variables[i], max(0, lower[i]), flux)
+                cycle_free[variables[i][0]] = 1
+            else:
+                _set_flux_bounds(variables[i], flux, min(0, upper[i]))
+                cycle_free[variables[i][1]] = 1
+        objective.set_linear_coefficients({var: 0 for var in rct_coefs})
+        objective.set_linear_coefficients(cycle_free)
+        objective.direction = 'min'
+        model.slim_optimize()
+        # Without a solution of its own, loop removal confirms nothing
+        solved = model.solver.status == 'optimal'
+        if solved:
+            ll_fluxes = _solver_fluxes(model, state.fva_columns)
+            if state.fva_seen is not None:
+                _observe_fluxes(state, ll_fluxes)
+
+        # The extreme survives loop removal, so it is loopless
+        is_loopless = solved and abs(ll_fluxes[rct_idx] - value) < cutoff
+        if solved and not is_loopless:
+            # Keep the extreme to find the loops that rct depends on
+            _set_flux_bounds(variables[rct_idx], value, value)
+            model.slim_optimize()
+            almost_ll_fluxes = ll_fluxes
+            if model.solver.status == 'optimal':
+                almost_ll_fluxes = _solver_fluxes(model, state.fva_columns)
+
+        objective.set_linear_coefficients({var: 0 for var in cycle_free})
+        objective.set_linear_coefficients(rct_coefs)
+        objective.direction = direction
+        for i in changed:
+            _set_flux_bounds(variables[i], lower[i], upper[i])
+        if is_loopless:
+            break
+        if not solved:
+            # Fall back to the flux of the last loopless solution, if any
+            if closed:
+                value = ll_fluxes[rct_idx]
+            break
+
+        # Close those loops and optimize rct again. Unlike cobra, rct
+        # itself is never closed, which would pin its extreme to zero,
+        # nor is any reaction whose bounds exclude zero. Closed loops stay
+        # closed, so this ends.
+        looped = [i for i in loop_idx if i != rct_idx and i not in closed
+                  and lower[i] <= 0 <= upper[i]
+                  and abs(ll_fluxes[i]) < cutoff and abs(almost_ll_fluxes[i]) > cutoff]
+        if not looped:
+            value = ll_fluxes[rct_idx]
+            break
+        for i in looped:
+            lower[i], upper[i] = max(0, lower[i]), min(0, upper[i])
+            _set_flux_bounds(variables[i], lower[i], upper[i])
+        closed.update(looped)
+        model.slim_optimize()
+        if model.solver.status != 'optimal':
+            value = ll_fluxes[rct_idx]
+            break
+        value = objective.value
+
+    for i in closed:
+        _set_flux_bounds(variables[i], state.fva_bounds[0][i], state.fva_bounds[1][i])
+    if solved and abs(value - current) < cutoff:
+        return value, False
+    exact = None
+    if milp_idx is not None:
+        exact = _loopless_milp_value(state, rct_idx, direction, milp_idx, deadline)
+    return (value, True) if exact is None else (exact, False)
+
+def _fva_chunk(state, args):
+    """Compute the minimum and maximum flux of a chunk of reactions.
+       Assumes state.model has a zero objective and the old objective
+       fixed as a constraint. If loop_idx is given, loops are removed from each
+       extreme, see _loopless_fva_value for loop_idx, milp_idx and deadline.
+
+       prune is None or (minimum, maximum, lower, upper) arrays in
+       reaction order: the flux range attained by feasible solutions so
+       far and limits no extreme can pass, i.e. reaction bounds or for
+       loopless extremes the plain FVA range. An extreme whose limit is
+       already attained is taken without solving its LP. Later solutions
+       widen the attained range, only loopless ones if loop_idx is given.
+
+       Returns (result, lps, pruned, approximate) where result is a list
+       of (rct_id, min, max), lps the number of FVA LPs solved, pruned
+       the number of extremes taken without one and approximate the ids
+       of reactions with a loopless extreme that could not be confirmed
+       exact before deadline."""
+    rct_ids, loop_idx, prune, milp_idx, deadline = args
+    model = state.model
+    if state.fva_columns is None:
+        state.fva_columns = _flux_columns(model)
+        state.fva_variables = [(rct.forward_variable, rct.reverse_variable)
+                               for rct in model.reactions]
+        state.fva_bounds = (np.array([rct.lower_bound for rct in model.reactions]),
+                            np.array([rct.upper_bound for rct in model.reactions]))
+        state.fva_boundary = np.array([i for i, rct in enumerate(model.reactions)
+                                       if rct.boundary], dtype=int)
+    if prune is not None and state.fva_seen is None:
+        state.fva_seen = (np.array(prune[0], dtype=float), np.array(prune[1], dtype=float))
+
+    result = []
+    lps = pruned = 0
+    approximate = []
+    for rct_id in rct_ids:
+        rct = model.reactions.get_by_id(rct_id)
+        rct_idx = model.reactions.index(rct)
+        model.solver.objective.set_linear_coefficients(
+            {rct.forward_variable: 1, rct.reverse_variable: -1})
+
+        values = []
+        for direction in ('min', 'max'):
+            if prune is not None:
+                # Flux already attained at the limit is the extreme
+                lower, upper = prune[2][rct_idx], prune[3][rct_idx]
+                if direction == 'min' and state.fva_seen[0][rct_idx] <= lower + model.tolerance:
+                    values.append(lower)
+                    pruned += 1
+                    continue
+                if direction == 'max' and state.fva_seen[1][rct_idx] >= upper - model.tolerance:
+                    values.append(upper)
+                    pruned += 1
+                    continue
+
+            model.solver.objective.direction = direction
+            model.slim_optimize()
+            check_solver_status(model.solver.status)
+            lps += 1
+            if loop_idx is not None:
+                value, is_approximate = _loopless_fva_value(
+                    state, rct, model.solver.objective.value, loop_idx, milp_idx, deadline)
+                if is_approximate and rct_id not in approximate:
+                    approximate.append(rct_id)
+            else:
+                value = model.solver.objective.value
+                if prune is not None:
+                    _observe_fluxes(state)
+            values.append(value)
+
+        model.solver.objective.set_linear_coefficients(
+            {rct.forward_variable: 0, rct.reverse_variable: 0})
+        result.append((rct_id, *values))
+    return result, lps, pruned, approximate
+
+def _highs_fva_chunk(state, args):
+    """Compute the minimum and maximum flux of a chunk of reactions with
+       state.model being a HighsLP of the FVA problem. prune is as for
+       _fva_chunk without loop removal. Returns (result, lps, pruned, [])
+       as _fva_chunk does."""
+    rct_ids, prune = args
+    model = state.model
+    if prune is not None and state.fva_seen is None:
+        state.fva_seen = (np.array(prune[0], dtype=float), np.array(prune[1], dtype=float))
+
+    result = []
+    lps = pruned = 0
+    for rct_id in rct_ids:
+        rct_idx = model.rct_index[rct_id]
+        cols = (model.forward[rct_idx], model.reverse[rct_idx])
+        model.set_cost(cols, (1, -1))
+
+        values = []
+        for maximize in (False, True):
+            if prune is not None:
+                # Flux already attained at the limit is the extreme
+                lower, upper = prune[2][rct_idx], prune[3][rct_idx]
+                if not maximize and state.fva_seen[0][rct_idx] <= lower + model.tolerance:
+                    values.append(lower)
+                    pruned += 1
+                    continue
+                if maximize and state.fva_seen[1][rct_idx] >= upper - model.tolerance:
+                    values.append(upper)
+                    pruned += 1
+                    continue
+
+            model.set_sense(maximize)
+            check_solver_status(model.solve())
+            lps += 1
+            values.append(model.objective_value)
+            if prune is not None:
+                _observe_fluxes(state, model.fluxes())
+
+        model.set_cost(cols, (0, 0))
+        result.append((rct_id, *values))
+    return result, lps, pruned, []
+
+def _apply_bounds(model, indices, lower, upper):
+    """Set the bounds of the reactions of model at indices to the arrays
+       lower and upper, updating the reactions' stored bounds and their
+       solver variables directly in one pass. Solver variables whose
+       bounds do not change are skipped. No model context entries are
+       recorded."""
+    reactions = model.reactions
+    rcts = [reactions[i] for i in indices.tolist()]
+    old_lower = np.array([rct._lower_bound for rct in rcts], dtype=float)
+    old_upper = np.array([rct._upper_bound for rct in rcts], dtype=float)
+
+    # Split into forward and reverse variable bounds as cobra's
+    # update_variable_bounds does, None marking an unbounded side
+    unbounded = lambda x: np.where(np.isinf(x), None, x).tolist()
+    forward = np.maximum(lower, 0), np.maximum(upper, 0)
+    reverse = np.maximum(-upper, 0), np.maximum(-lower, 0)
+    forward_changed = ((forward[0] != np.maximum(old_lower, 0)) |
+                       (forward[1] != np.maximum(old_upper, 0))).tolist()
+    reverse_changed = ((reverse[0] != np.maximum(-old_upper, 0)) |
+                       (reverse[1] != np.maximum(-old_lower, 0))).tolist()
+    forward = forward[0].tolist(), unbounded(forward[1])
+    reverse = reverse[0].tolist(), unbounded(reverse[1])
+
+    variables = model.solver.variables
+    for k, (rct, lb, ub) in enumerate(zip(rcts, lower.tolist(), upper.tolist())):
+        rct._lower_bound, rct._upper_bound = lb, ub
+        if forward_changed[k]:
+            variables[rct.id].set_bounds(forward[0][k], forward[1][k])
+        if reverse_changed[k]:
+            variables[rct.reverse_id].set_bounds(reverse[0][k], reverse[1][k])
+
+def _ko_chunk(state, tasks):
+    """Compute the objective value of state.model for a chunk of
+       knockouts given as (key, rct_ids) where key identifies the knocked
+       out genes and rct_ids are the reactions the knockout disables.
+       Each knockout is applied and rolled back inside a model context.
+       Returns a list of (key, growth) where growth is nan if the
+       knockout is infeasible."""
+    model = state.model
+    result = []
+    for key, rct_ids in tasks:
+        with model:
+            FBAPipeline.set_bounds(model, FBAPipeline.reaction_indices(model, rct_ids), 0, 0)
+            growth = model.slim_optimize(error_value=float('nan'))
+        result.append((key, growth))
+    return result
+
+def _condition_chunk(state, conditions):
+    """Run a chunk of (index, pipeline, media) conditions on state.model.
+       Each condition is applied and rolled back inside a model context.
+       Returns a list of (index, pipeline, kbase_fba_obj, fba_sol)."""
+    if state.gpr is None:
+        state.gpr = CompiledGPR(state.model)
+    model, gpr = state.model, state.gpr
+
+    result = []
+    for index, pipeline, media in conditions:
+        with model:
+            pipeline.apply_media(model, media)
+            kbase_fba_obj, _, fba_sol, _ = pipeline.run(model, media, gpr)
+        result.append((index, pipeline, kbase_fba_obj, fba_sol))
+    return result
+
+def _race_worker(pipeline, model, results):
+    """Compute the FBA solution of model with pipeline, set to one of the
+       raced solvers, and put (solver, solution, optimum, lps, error) on
+       results, where optimum and lps are those set by run_fba."""
+    try:
+        pipeline.configure_solver(model)
+        solution = pipeline.run_fba(model)
+        results.put((pipeline.solver, solution, pipeline.optimum, pipeline.fba_lps, None))
+    except Exception as e:
+        results.put((pipeline.solver, None, None, 0, repr(e)))
+
+def _make_chunks(ids, processes, chunk_size=None, chunks_per_process=4):
+    """Split ids into chunks. Defaults to four chunks per process
+       to balance uneven LP times across workers."""
+    chunk_size = chunk_size or max(1, math.ceil(len(ids) / (chunks_per_process * processes)))
+    return [ids[i:i + chunk_size] for i in range(0, len(ids), chunk_size)]
+
+def _map_chunks(model, func, chunks, processes, deadline=None):
+    """Yield func(state, chunk) for each chunk, where state is the
+       _WorkerState of model in the process solving the chunk. Runs in
+       a pool of worker processes when processes > 1, otherwise in this
+       process. If a time.monotonic deadline is given, stop yielding
+       once it passes and terminate outstanding work."""
+    if processes > 1:
+        with multiprocessing.Pool(processes, initializer=_init_worker,
+                                  initargs=(model,)) as pool:
+            results = pool.imap_unordered(_call_chunk, [(func, chunk) for chunk in chunks])
+            for _ in chunks:
+                timeout = None if deadline is None else max(0, deadline - time.monotonic())
+                try:
+                    yield results.next(timeout)
+                except multiprocessing.TimeoutError:
+                    return
+    else:
+        # State of its own, since this may run inside a chunk of an outer
+        # map, e.g. a stage of a condition of _condition_chunk
+        state = _WorkerState(model)
+        for chunk in chunks:
+            if deadline is not None and time.monotonic() >= deadline:
+                return
+            yield func(state, chunk)
+
+def _stage_deadline(budget_end, shares):
+    """Return the time.monotonic deadline of the next stage to run, or
+       None if budget_end is None. shares are the budget shares of the
+       stages still to run, the next one first. Time left until
+       budget_end is split between them by share, so time a stage
+       leaves unused goes to the later stages."""
+    if budget_end is None:
+        return None
+    if not sum(shares):
+        return budget_end
+    now = time.monotonic()
+    return now + max(0., budget_end - now) * shares[0] / sum(shares)
+
+def _run_stage(pipeline, stage, model, results, deadline, processes):
+    """Run stage of pipeline alongside other stages with processes
+       worker processes, unless the pipeline sets its own, and return its
+       result. CBC solving model in this process is limited to processes
+       threads, instead of all processors, for the duration."""
+    attr = stage.processes_attr
+    own = attr is not None and getattr(pipeline, attr) is None
+    if own:
+        setattr(pipeline, attr, processes)
+    threads = None
+    if isinstance(model, cobra.Model) and 'coinor_cbc' in model.solver.interface.__name__:
+        threads = model.solver.configuration.threads
+        model.solver.configuration.threads = processes
+    try:
+        return stage.func(model, results, deadline)
+    finally:
+        if own:
+            setattr(pipeline, attr, None)
+        if threads is not None:
+            model.solver.configuration.threads = threads
+
+def _stage_worker(pipeline, stage, model, results, deadline, processes, queue_):
+    """Run stage of pipeline in a forked process and put (name, result,
+       attributes, error) on queue_, where attributes are the pipeline
+       attributes the stage set."""
+    try:
+        before = dict(vars(pipeline))
+        result = _run_stage(pipeline, stage, model, results, deadline, processes)
+        attributes = {name: value for name, value in vars(pipeline).items()
+                      if name not in before or before[name] is not value}
+        queue_.put((stage.name, result, attributes, None))
+    except Exception as e:
+        queue_.put((stage.name, None, {}, e))
+
+
+class Stage:
+    """A stage of FBAPipeline.run, run by FBAPipeline.run_stages once
+       the stages named in requires are done. func(model, results,
+       deadline) returns its result, where results holds the results of
+       earlier stages by name and deadline is a time.monotonic deadline
+       or None. lps estimates its number of LPs, by which concurrent
+       stages split the processors, and processes_attr names the
+       pipeline attribute holding its number of worker processes."""
+
+    def __init__(self, name, func, requires=(), lps=0, processes_attr=None):
+        self.name = name
+        self.func = func
+        self.requires = tuple(requires)
+        self.lps = lps
+        self.processes_attr = processes_attr
+
+def _num_processes(processes, num_tasks):
+    """Number of worker processes to use, all processors if None."""
+    processes = processes or multiprocessing.cpu_count()
+    return max(1, min(processes, num_tasks))
 
 class FBAPipeline:
 
@@ -11,6 +579,35 @@ class FBAPipeline:
 
     # Tuple of uptake atoms
     UPTAKE_ATOMS = ('C', 'N', 'P', 'S', 'O')
+
+    # Objective value below which a gene knockout is essential
+    ESSENTIAL_THRESHOLD = 1e-11
+
+    # Absolute flux below which a reaction carries no flux
+    ZERO_FLUX = 1e-9
+
+    # Flux each reaction is pushed towards by the blocked reaction
+    # pre-pass, as epsilon in FASTCC
+    BLOCKED_EPSILON = 1e-4
+
+    # Relative violation of bounds, mass balances and objective value
+    # allowed in a solution that wins a solver race
+    RACE_TOLERANCE = 1e-6
+
+    # Most reactions that can be part of a loop for Loopless FVA to solve
+    # exact MILPs, and seconds allowed for each. MILPs of genome scale
+    # models, with a few hundred such reactions, do not finish in minutes.
+    LOOPLESS_MILP_MAX_REACTIONS = 100
+    LOOPLESS_MILP_TIMEOUT = 10
+
+    # Share of time_budget_seconds of each stage after FBA, which always
+    # completes, and share kept for building, saving and reporting results
+    STAGE_BUDGET_SHARES = {'fva': 0.5, 'single_ko': 0.3, 'double_ko': 0.2, 'report_data': 0.}
+    OUTPUT_BUDGET_SHARE = 0.1
+
+    # Chunks per worker process for stages with a deadline, so that the
+    # deadline is checked often and little solved work is lost at it
+    DEADLINE_CHUNKS_PER_PROCESS = 32
     
     def __init__(self):
         # If true, make all reactions in model reversible.
@@ -38,9 +635,23 @@ class FBAPipeline:
         # is at least the fraction times maximum objective value.
         self.fraction_of_optimum_fva = 0.1
 
-        # Specify optimization solver, options: [coinor_cbc, glpk].
+        # Specify optimization solver, options: [coinor_cbc, glpk, highs, auto, race].
+        # highs solves FBA, pFBA and FVA with HighsLP and leaves the other
+        # analyses to glpk. auto is replaced by the solver the solver
+        # profile finds fastest for the model size and analysis. race is
+        # replaced by the solver that solves FBA first, see race_solution.
         self.solver = 'coinor_cbc'
 
+        # How solver was chosen if not given directly, e.g. 'auto'
+        self.solver_selection = None
+
+        # Solvers raced against each other. If None, all installed ones.
+        self.race_solvers = None
+
+        # Seconds until each raced solver returned, for those that
+        # returned before the winner was found, the winner included.
+        self.race_seconds = {}
+
         # Specify objective reaction to optimize.
         self.target_reaction = ''
 
@@ -65,6 +676,100 @@ class FBAPipeline:
         # Compounds to add to media
         self.media_supplement_list = []
 
+        # Number of worker processes used for FVA. If None, use
+        # all available processors.
+        self.fva_processes = None
+
+        # Number of reactions sent to an FVA worker per task. If None,
+        # a chunk size is chosen to give each worker several chunks.
+        self.fva_chunk_size = None
+
+        # If true, skip FVA LPs whose extreme is a reaction bound already
+        # attained by the FBA solution or an earlier FVA solution.
+        self.is_fva_pruning = True
+
+        # Objective value of the wild-type FBA optimum and number of LPs
+        # run_fba solved. The optimum is found once and reused by later
+        # stages instead of being solved again.
+        self.optimum = None
+        self.fba_lps = 0
+
+        # Number of LPs solved by the last run, all stages together.
+        self.lps = 0
+
+        # Model and ATP summaries of the FBA solution for the report,
+        # computed by run, see report.report_data.
+        self.report_data = None
+
+        # Number of FVA LPs solved and skipped by pruning.
+        self.fva_lps = 0
+        self.fva_lps_saved = 0
+
+        # Ids of reactions with a Loopless FVA extreme that loop removal
+        # could not confirm and no MILP solved in time. Their ranges are
+        # loopless but may be narrower than the exact ones.
+        self.fva_approximate = set()
+
+        # Ids of reactions that can not carry flux, found before FVA,
+        # and the number of LPs it took to find them.
+        self.blocked_reactions = set()
+        self.blocked_lps = 0
+
+        # Number of LPs used to find reactions that may be part of a loop.
+        self.loop_lps = 0
+
+        # Cache with get, put and key methods for internal null spaces,
+        # e.g. a ModelCache. If None, they are only kept in memory.
+        self.nullspace_cache = None
+
+        # ModelSnapshot with the stoichiometry of the analysed model,
+        # e.g. from a SnapshotCache. If set, internal null spaces are
+        # found from its arrays instead of the cobra model.
+        self.snapshot = None
+
+        # Number of worker processes used for the single gene
+        # knockout screen. If None, use all available processors.
+        self.ko_processes = None
+
+        # Objective value of the model for each single gene knockout,
+        # keyed by gene id. Filled by run when is_single_ko is set.
+        self.ko_growth = {}
+
+        # Number of LPs solved by the single knockout screen and number
+        # of knockout LPs skipped by its pre-screen.
+        self.ko_lps = 0
+        self.ko_lps_saved = 0
+
+        # If true, screen gene pairs for synthetic lethality.
+        self.is_double_ko = False
+
+        # Seconds allowed for solving double gene knockouts.
+        self.double_ko_time_budget = 3600.
+
+        # Seconds allowed for the whole run, split between stages by
+        # STAGE_BUDGET_SHARES. FVA and the knockout screens stop at their
+        # deadline with partial results. If None, stages run to completion.
+        self.time_budget_seconds = None
+
+        # time.monotonic() the time budget counts from, e.g. the start of
+        # the job. If None, the start of run.
+        self.budget_start = None
+
+        # Whether FVA solved every reaction and the single knockout
+        # screen every gene, False if a stage deadline cut it short.
+        self.fva_complete = True
+        self.ko_complete = True
+
+        # Synthetic lethal gene pairs as (gene_id, gene_id, growth),
+        # number of double knockout LPs solved and whether every
+        # candidate pair was solved within the time budget.
+        self.lethal_pairs = []
+        self.double_ko_lps = 0
+        self.double_ko_complete = True
+
+        # Reference of the genome the model's genes belong to.
+        self.genome_ref = ''
+
         # Kbase ID of the returning FBA object.
         self.output_id = ''
 
@@ -87,12 +792,22 @@ class FBAPipeline:
         p.fba_type = params['fba_type']
         p.fva_type = params['fva_type']
         p.is_single_ko = params['simulate_ko']
+        p.is_double_ko = params.get('simulate_double_ko', 0)
+        if params.get('double_ko_time_budget'):
+            p.double_ko_time_budget = params['double_ko_time_budget']
+        p.time_budget_seconds = params.get('time_budget_seconds') or None
         p.target_reaction = params['target_reaction']
         p.is_all_reversible = params['all_reversible']
         p.is_minimize_objective = params['minimize_objective']
         p.fraction_of_optimum_fva = params['fraction_of_optimum_fva']
         p.fraction_of_optimum_pfba = params['fraction_of_optimum_pfba']
 
+        # Parallelism params, optional
+        p.fva_processes = params.get('fva_processes') or None
+        p.fva_chunk_size = params.get('fva_chunk_size') or None
+        p.ko_processes = params.get('ko_processes') or None
+        p.is_fva_pruning = params.get('fva_pruning', 1)
+
         # Uptakes
         p.max_uptakes['C'] = params['max_c_uptake']
         p.max_uptakes['N'] = params['max_n_uptake']
@@ -101,13 +816,15 @@ class FBAPipeline:
         p.max_uptakes['O'] = params['max_o_uptake']
         p.default_max_uptake = params['default_max_uptake']
 
-        # Check if list params contain data. If so parse, else use default []
+        # Check if list params contain data. If so parse, else use default [].
+        # Lists arrive as comma separated strings from the narrative.
+        split = lambda x: x.split(',') if isinstance(x, str) else list(x)
         if params['media_supplement_list']:
-            p.media_supplement_list = params['media_supplement_list'].split(',')
+            p.media_supplement_list = split(params['media_supplement_list'])
         if params['reaction_ko_list']:
-            p.reaction_ko_list = params['reaction_ko_list'].split(',')
+            p.reaction_ko_list = split(params['reaction_ko_list'])
         if params['feature_ko_list']:
-            p.feature_ko_list = params['feature_ko_list'].split(',')
+            p.feature_ko_list = split(params['feature_ko_list'])
         # custom_bound_list input format [{'custom_reaction_id': ['rct1'], 'custom_lb': float, 'custom_ub': float}]
         if params['custom_bound_list']:
             p.custom_bound_list = [(item['custom_reaction_id'][0], item['custom_lb'], item['custom_ub'])
@@ -115,71 +832,940 @@ class FBAPipeline:
 
         return p
 
+    @staticmethod
+    def reaction_indices(model, rct_ids):
+        """Return the array of indices in model of rct_ids, skipping
+           reactions not in model."""
+        reactions = model.reactions
+        return np.array([reactions.index(rct_id) for rct_id in rct_ids
+                         if rct_id in reactions], dtype=int)
+
+    @staticmethod
+    def reaction_bounds(model):
+        """Return arrays of the lower and upper bounds of the reactions
+           of model, in reaction order."""
+        return np.array([(rct._lower_bound, rct._upper_bound) for rct in model.reactions],
+                        dtype=float).reshape(-1, 2).T
+
+    @staticmethod
+    def set_bounds(model, indices, lower, upper):
+        """
+        Set the bounds of many reactions of model at once. Equivalent to
+        setting rct.bounds of each reaction, including rollback when
+        called inside a model context, but the solver variables are
+        updated in a single pass and the context gets a single entry.
+
+        Parameters
+        ----------
+        model : cobra.Model
+            Model to change
+        indices : array-like of int
+            Indices of the reactions in model.reactions
+        lower, upper : array-like of float or float
+            New bounds, broadcast against indices
+        """
+        indices = np.asarray(indices, dtype=int).ravel()
+        lower = np.broadcast_to(np.asarray(lower, dtype=float), indices.shape)
+        upper = np.broadcast_to(np.asarray(upper, dtype=float), indices.shape)
+        if not indices.size:
+            return
+
+        # Keep the last bounds given for each reaction
+        indices, last = np.unique(indices[::-1], return_index=True)
+        lower, upper = lower[::-1][last], upper[::-1][last]
+
+        invalid = np.flatnonzero(lower > upper)
+        if invalid.size:
+            i = invalid[0]
+            raise ValueError(f'The lower bound must be less than or equal to the upper bound '
+                             f'of {model.reactions[indices[i]].id} ({lower[i]} <= {upper[i]}).')
+
+        context = get_context(model)
+        if context:
+            reactions = model.reactions
+            old = np.array([(reactions[i]._lower_bound, reactions[i]._upper_bound)
+                            for i in indices.tolist()]).reshape(-1, 2)
+            context(functools.partial(_apply_bounds, model, indices, old[:, 0], old[:, 1]))
+
+        _apply_bounds(model, indices, lower, upper)
+
+    def apply_media(self, model, media):
+        """Set the exchange bounds of model to media, as building the model
+           with media does. Used when one model is shared across conditions
+           instead of being built with each media. Exchanges of compounds
+           missing from media are closed for uptake. Complete or empty
+           media leaves every exchange open."""
+
+        # Exchange bounds are the negated media fluxes, as set by
+        # KBaseFBAModelToCobraBuilder.with_media
+        bounds = {f'EX_{cpd_id}': bounds for cpd_id, bounds
+                  in media.get_media_constraints().items()}
+        if media.name == 'Complete' or not bounds:
+            return
+
+        exchanges = model.exchanges
+        lower, upper = np.array([bounds.get(ex_rct.id, (0, ex_rct.upper_bound))
+                                 for ex_rct in exchanges], dtype=float).reshape(-1, 2).T
+        self.set_bounds(model, self.reaction_indices(model, (ex_rct.id for ex_rct in exchanges)),
+                        lower, upper)
+
     def configure_media(self, model, media):
+        """Open uptake of the medium to default_max_uptake and limit the
+           uptake of each atom in max_uptakes. Atom counts and the uptake
+           constraints are kept per model by uptake_constraints."""
 
         if media.name == 'Complete':
             self.default_max_uptake = 100.
 
+        uptakes = uptake_constraints(model, self.UPTAKE_ATOMS)
+
         if not math.isclose(self.default_max_uptake, 0):
-            for ex_flux in model.medium:
-                model.reactions.get_by_id(ex_flux).lower_bound = -1 * self.default_max_uptake
+            indices = uptakes.indices[uptakes.medium(model)]
+            upper = [model.reactions[i].upper_bound for i in indices]
+            self.set_bounds(model, indices, -1 * self.default_max_uptake, upper)
+
+        # Only constrain atoms the user specifies, otherwise max_uptakes will be None
+        uptakes.apply(model, self.max_uptakes, uptakes.medium(model))
+
+    def run_fva(self, model, fba_sol=None, deadline=None, optimum=None):
+        """Run FVA on every reaction in model, splitting the reactions
+           into chunks solved across a pool of worker processes. Returns
+           a DataFrame with minimum and maximum columns, indexed by
+           reaction id in model order. If a time.monotonic deadline is
+           given, reactions not solved by then have nan ranges and
+           fva_complete is set to False. optimum is the objective value
+           of the FBA optimum of model, solved here if not given.
+
+           Reactions found blocked by find_blocked_reactions get a zero
+           range without FVA LPs. If is_fva_pruning is set, each worker
+           tracks the flux range attained by the solutions it has seen,
+           starting from fba_sol when that satisfies the FVA optimum
+           constraint, and skips the LP of any extreme already at its
+           reaction bound.
+
+           Loopless FVA runs plain FVA on every reaction, then repeats
+           only the reactions returned by loop_reactions with CycleFreeFlux
+           loop removal. Any flux vector has a loopless counterpart with
+           the same boundary fluxes, and the flux of a reaction outside
+           every internal cycle is fixed by the boundary fluxes, so its
+           plain range is already loopless. Every loopless range is
+           attained by loopless flux vectors. Extremes loop removal can
+           not confirm are solved as MILPs when at most
+           LOOPLESS_MILP_MAX_REACTIONS reactions can be part of a loop,
+           and may otherwise be narrower than the exact ones. Reactions
+           with such an extreme, or one whose MILP was not solved in
+           time, are put in fva_approximate."""
 
-        # Only add constraints when user specifies to, otherwise max_uptakes will be None
-        constrs = {atom: 0. for atom in self.UPTAKE_ATOMS if self.max_uptakes[atom] is not None}
+        loopless = self.fva_type == 'Loopless FVA'
+        rct_ids = [rct.id for rct in model.reactions]
 
-        # Return early if user doesn't specify any max uptakes
-        if not constrs:
+        fva_sol = pd.DataFrame(index=rct_ids, columns=['minimum', 'maximum'], dtype=float)
+
+        with model:
+            if optimum is None:
+                optimum = model.slim_optimize(
+                    error_value=None,
+                    message='There is no optimal solution for the chosen objective!')
+
+            # Fix the old objective to at least fraction_of_optimum_fva
+            # of its optimum. The variable name is required by loopless FVA.
+            bound = self.fraction_of_optimum_fva * optimum
+            is_max = model.solver.objective.direction == 'max'
+            if is_max:
+                old_objective = model.problem.Variable('fva_old_objective', lb=bound)
+            else:
+                old_objective = model.problem.Variable('fva_old_objective', ub=bound)
+
+            # Loops do not depend on the FVA constraint, which excludes
+            # the zero flux vector they are found from
+            support, loop_rcts = set(), set()
+            if loopless:
+                support = self.internal_nullspace_support(model)
+                loop_rcts = self.loop_reactions(model, support)
+
+            # Flux range attained by feasible solutions so far, starting
+            # from fba_sol if it is feasible for the FVA problem. pFBA and
+            # Loopless FBA solutions are loopless.
+            seen = (np.full(len(rct_ids), np.inf), np.full(len(rct_ids), -np.inf))
+            loopless_seen = (seen[0].copy(), seen[1].copy())
+            objective = cobra.util.solver.linear_reaction_coefficients(model)
+            if fba_sol is not None and fba_sol.status == 'optimal':
+                value = sum(coef * fba_sol.fluxes[rct.id] for rct, coef in objective.items())
+                if (value >= bound - model.tolerance if is_max else
+                        value <= bound + model.tolerance):
+                    fluxes = fba_sol.fluxes.reindex(rct_ids).values
+                    seen = (fluxes.copy(), fluxes.copy())
+                    if self.fba_type in ('pFBA', 'Loopless FBA'):
+                        loopless_seen = (fluxes.copy(), fluxes.copy())
+
+            old_objective_constraint = model.problem.Constraint(
+                model.solver.objective.expression - old_objective,
+                lb=0, ub=0, name='fva_old_objective_constraint')
+            model.add_cons_vars([old_objective, old_objective_constraint])
+            model.objective = Zero
+
+            # Blocked reactions have a zero range and are not sent to FVA
+            self.blocked_reactions = self.find_blocked_reactions(model, seen)
+            fva_sol.loc[[rct_id for rct_id in rct_ids if rct_id in self.blocked_reactions]] = 0.
+            flux_ids = [rct_id for rct_id in rct_ids if rct_id not in self.blocked_reactions]
+            self.fva_lps = self.blocked_lps + (self.loop_lps if loopless else 0)
+            self.fva_lps_saved = 0
+            self.fva_approximate = set()
+
+            # Loop removal relaxes every reaction whose flux is not fixed
+            # by the boundary fluxes
+            loop_idx = np.array([i for i, rct_id in enumerate(rct_ids)
+                                 if rct_id in support], dtype=int)
+            # Extremes loop removal can not confirm are solved exactly
+            # as MILPs on the reactions that can be part of a loop, when
+            # there are few enough for the MILP to be solved in time
+            milp_idx = None
+            if len(loop_rcts) <= self.LOOPLESS_MILP_MAX_REACTIONS:
+                milp_idx = [i for i, rct_id in enumerate(rct_ids) if rct_id in loop_rcts]
+
+            if {rct.id for rct in objective} & loop_rcts:
+                # Loop removal may lower an objective that is part of a
+                # loop, which then limits every range
+                self._run_fva_pass(model, fva_sol, flux_ids, loop_idx, deadline=deadline,
+                                   milp_idx=milp_idx)
+            else:
+                # Plain FVA first. For Loopless FVA only reactions that can
+                # be part of a loop are then solved again with loop removal.
+                prune = None
+                if self.is_fva_pruning:
+                    prune = (*seen, np.array([rct.lower_bound for rct in model.reactions]),
+                             np.array([rct.upper_bound for rct in model.reactions]))
+                self._run_fva_pass(model, fva_sol, flux_ids, None, prune, deadline)
+
+                if loop_rcts:
+                    if self.is_fva_pruning:
+                        prune = (*loopless_seen, fva_sol['minimum'].values.copy(),
+                                 fva_sol['maximum'].values.copy())
+                    self._run_fva_pass(model, fva_sol,
+                                       [rct_id for rct_id in flux_ids if rct_id in loop_rcts],
+                                       loop_idx, prune, deadline, milp_idx)
+
+            self.fva_complete = not fva_sol.isna().values.any()
+
+        return fva_sol
+
+    def _run_fva_pass(self, model, fva_sol, rct_ids, loop_idx=None, prune=None, deadline=None,
+                      milp_idx=None):
+        """Solve the FVA ranges of rct_ids across worker processes and
+           write them to fva_sol until deadline. See _fva_chunk for
+           loop_idx, prune and milp_idx. With the highs solver, passes
+           without loop removal are solved on a HighsLP of model instead."""
+        if deadline is not None and time.monotonic() >= deadline:
             return
+        processes = _num_processes(self.fva_processes, len(rct_ids))
+        chunks = _make_chunks(rct_ids, processes, self.fva_chunk_size,
+                              4 if deadline is None else self.DEADLINE_CHUNKS_PER_PROCESS)
+        if self.solver == 'highs' and loop_idx is None:
+            problem, func = HighsLP(model), _highs_fva_chunk
+            chunks = [(chunk, prune) for chunk in chunks]
+        else:
+            problem, func = model, _fva_chunk
+            chunks = [(chunk, loop_idx, prune, milp_idx, deadline) for chunk in chunks]
+
+        for chunk_result, lps, pruned, approximate in _map_chunks(problem, func, chunks,
+                                                                  processes, deadline):
+            self.fva_lps += lps
+            self.fva_lps_saved += pruned
+            self.fva_approximate.update(approximate)
+            for rct_id, min_, max_ in chunk_result:
+                fva_sol.at[rct_id, 'minimum'] = min_
+                fva_sol.at[rct_id, 'maximum'] = max_
+
+    def find_blocked_reactions(self, model, seen=None):
+        """Return the set of ids of reactions that can not carry flux
+           under the current constraints of model, in a handful of LPs
+           rather than two per reaction, see _carrying_flux. Reversible
+           reactions not found to carry flux are left to FVA.
+
+           seen is an optional (minimum, maximum) pair of arrays of flux
+           attained by feasible solutions, in reaction order. Reactions
+           with nonzero flux there need no LP, and the arrays are widened
+           with every LP solution. Sets blocked_lps."""
+
+        forward, reverse, self.blocked_lps = self._carrying_flux(model, seen)
+        irreversible = np.array([rct.lower_bound >= 0 or rct.upper_bound <= 0
+                                 for rct in model.reactions], dtype=bool)
+        return {model.reactions[i].id for i in
+                np.flatnonzero(~forward & ~reverse & irreversible)}
+
+    def _carrying_flux(self, model, seen=None):
+        """Find which reactions can carry flux under the current
+           constraints of model. Follows LP7 of FASTCC: for each direction,
+           repeatedly maximize the number of candidate reactions carrying
+           at least BLOCKED_EPSILON flux, dropping candidates as they are
+           found to carry flux. A zero optimum proves no remaining
+           candidate can carry flux in that direction.
+
+           LP7 forces its candidates to carry flux in the tested direction,
+           so only reactions whose bounds already fix that direction are
+           candidates. Reversible reactions are only found to carry flux
+           through the LP solutions.
+
+           seen is as in find_blocked_reactions. Returns (forward, reverse,
+           lps): boolean arrays in reaction order telling whether each
+           reaction was found to carry forward or reverse flux, and the
+           number of LPs solved."""
+
+        lps = 0
+        rct_ids = [rct.id for rct in model.reactions]
+        columns = _flux_columns(model)
+        lower = np.array([rct.lower_bound for rct in model.reactions])
+        upper = np.array([rct.upper_bound for rct in model.reactions])
+
+        # Whether each reaction is known to carry forward or reverse flux
+        forward = np.zeros(len(rct_ids), dtype=bool)
+        reverse = np.zeros(len(rct_ids), dtype=bool)
+        if seen is not None:
+            forward |= seen[1] > self.ZERO_FLUX
+            reverse |= seen[0] < -self.ZERO_FLUX
+
+        irreversible = (lower >= 0) | (upper <= 0)
+        for sign, carrying, allowed in ((1, forward, upper > 0), (-1, reverse, lower < 0)):
+            candidates = np.flatnonzero(allowed & irreversible & ~carrying)
+            if not len(candidates):
+                continue
+
+            with model:
+                # z_i <= sign * v_i with 0 <= z_i <= epsilon, maximize sum z_i
+                z = [model.problem.Variable(f'blocked_z_{i}', lb=0, ub=self.BLOCKED_EPSILON)
+                     for i in candidates]
+                constraints = [model.problem.Constraint(
+                                   sign * model.reactions[i].flux_expression - var,
+                                   lb=0, name=f'blocked_c_{i}')
+                               for i, var in zip(candidates, z)]
+                model.add_cons_vars(z + constraints)
+                model.objective = model.problem.Objective(Zero, direction='max')
+                model.objective.set_linear_coefficients({var: 1 for var in z})
+
+                remaining = dict(zip(candidates, z))
+                while remaining:
+                    value = model.slim_optimize(error_value=0)
+                    lps += 1
+                    if value <= self.ZERO_FLUX:
+                        break
+
+                    fluxes = _solver_fluxes(model, columns)
+                    forward |= fluxes > self.ZERO_FLUX
+                    reverse |= fluxes < -self.ZERO_FLUX
+                    if seen is not None:
+                        np.minimum(seen[0], fluxes, out=seen[0])
+                        np.maximum(seen[1], fluxes, out=seen[1])
+
+                    found = [i for i in remaining if carrying[i]]
+                    if not found:
+                        break
+                    # Stop rewarding flux through reactions already found
+                    for i in found:
+                        remaining.pop(i).ub = 0
+
+        return forward, reverse, lps
+
+    def internal_nullspace_support(self, model):
+        """Return the set of ids of internal reactions in the support of
+           the null space of the internal stoichiometric matrix. With
+           boundary fluxes fixed, the flux of any other reaction is fixed.
+           The null space is computed once per stoichiometry and kept in
+           nullspace_cache, from snapshot if set."""
+        source = model if self.snapshot is None else self.snapshot
+        return internal_nullspace(source, self.nullspace_cache).support(self.ZERO_FLUX)
+
+    def loopless_solution(self, model, solution=None):
+        """Loopless FBA. Optimize model, unless its FBA solution is given,
+           then remove loops from the solution with CycleFreeFlux as
+           cobra's loopless_solution does, relaxing only the internal null
+           space support: boundary fluxes are kept and every other
+           reaction keeps its flux anyway."""
+
+        if solution is None:
+            solution = model.optimize()
+        if solution.status != 'optimal':
+            return solution
+        support = self.internal_nullspace_support(model)
+
+        with model:
+            # Keep the optimum
+            objective_constraint = model.problem.Constraint(
+                model.objective.expression, lb=solution.objective_value,
+                name='loopless_obj_constraint')
+            model.add_cons_vars([objective_constraint])
+
+            # Keep boundary fluxes and minimize loop flux without sign changes
+            reactions = model.reactions
+            fluxes = solution.fluxes.values
+            lower, upper = self.reaction_bounds(model)
+            boundary = np.array([rct.boundary for rct in reactions])
+            loop = np.array([rct.id in support for rct in reactions]) & ~boundary
+            forward = fluxes >= 0
+            lower = np.where(boundary, fluxes, np.where(forward, np.maximum(0, lower),
+                                                        np.maximum(fluxes, lower)))
+            upper = np.where(boundary, fluxes, np.where(forward, np.minimum(fluxes, upper),
+                                                        np.minimum(0, upper)))
+            changed = np.flatnonzero(boundary | loop)
+            self.set_bounds(model, changed, lower[changed], upper[changed])
+            cycle_free = {reactions[i].forward_variable if forward[i] else
+                          reactions[i].reverse_variable: 1 for i in np.flatnonzero(loop)}
+            model.objective = model.problem.Objective(Zero, direction='min', sloppy=True)
+            model.objective.set_linear_coefficients(cycle_free)
+
+            solution = model.optimize()
+            solution.objective_value = objective_constraint.primal
+        return solution
+
+    def pfba_solution(self, model, optimum):
+        """pFBA of model given the objective value optimum of its FBA.
+           Follows cobra's pfba without solving the FBA again: the
+           objective is kept at fraction_of_optimum_pfba of optimum while
+           total flux is minimized, and the solution's objective value is
+           total flux."""
+
+        with model:
+            bound = self.fraction_of_optimum_pfba * optimum
+            if model.objective_direction == 'max':
+                lb, ub = bound, None
+            else:
+                lb, ub = None, bound
+            model.add_cons_vars([model.problem.Constraint(
+                model.objective.expression, lb=lb, ub=ub, name='pfba_objective_constraint')])
+
+            model.objective = model.problem.Objective(Zero, direction='min', sloppy=True)
+            model.objective.set_linear_coefficients(
+                {var: 1. for rct in model.reactions
+                 for var in (rct.forward_variable, rct.reverse_variable)})
+            solution = model.optimize()
+        return solution
+
+    def highs_solution(self, model):
+        """FBA, or pFBA if fba_type is pFBA, of model solved as a HighsLP.
+           Follows cobra's pfba: the objective is kept at
+           fraction_of_optimum_pfba of its optimum while total flux is
+           minimized, and the solution's objective value is total flux.
+           Raises OptimizationError if either LP is not solved to
+           optimality."""
+        lp = HighsLP(model)
+        lp.solve()
+        self.optimum = lp.objective_value if lp.status == 'optimal' else None
+        self.fba_lps = 1
+        check_solver_status(lp.status, raise_error=True)
+        if self.fba_type != 'pFBA':
+            return lp.solution()
+
+        # Fix the objective, then minimize total flux
+        cols = np.flatnonzero(lp.cost)
+        optimum = self.fraction_of_optimum_pfba * lp.objective_value
+        if lp.maximize:
+            lp.add_row(cols, lp.cost[cols], optimum, np.inf)
+        else:
+            lp.add_row(cols, lp.cost[cols], -np.inf, optimum)
+        cost = np.zeros(len(lp.cost))
+        cost[lp.forward] = cost[lp.reverse] = 1
+        lp.set_objective(cost, maximize=False)
+        lp.solve()
+        self.fba_lps += 1
+        check_solver_status(lp.status, raise_error=True)
+        return lp.solution()
+
+    def verify_solution(self, model, solution):
+        """Return True if the fluxes of solution are within the reaction
+           bounds, satisfy the mass balances of model and reproduce the
+           objective value of solution, i.e. the objective for FBA or
+           total flux for pFBA, up to RACE_TOLERANCE."""
+        fluxes = solution.fluxes.reindex([rct.id for rct in model.reactions]).values
+        if solution.objective_value is None or np.isnan(fluxes).any():
+            return False
+        scale = max(1., np.abs(fluxes).max(initial=0))
+        tol = self.RACE_TOLERANCE * scale
+
+        lower, upper = self.reaction_bounds(model)
+        if np.any(fluxes < lower - tol) or np.any(fluxes > upper + tol):
+            return False
+
+        balance = create_stoichiometric_matrix(model, array_type='lil').tocsr() @ fluxes
+        constraints = [model.constraints[met.id] for met in model.metabolites]
+        met_lower = np.array([-np.inf if c.lb is None else c.lb for c in constraints], dtype=float)
+        met_upper = np.array([np.inf if c.ub is None else c.ub for c in constraints], dtype=float)
+        if np.any(balance < met_lower - tol) or np.any(balance > met_upper + tol):
+            return False
+
+        if self.fba_type == 'pFBA':
+            value = np.abs(fluxes).sum()
+        else:
+            coefs = linear_reaction_coefficients(model)
+            value = sum(coef * solution.fluxes[rct.id] for rct, coef in coefs.items())
+        return abs(value - solution.objective_value) <= (
+            self.RACE_TOLERANCE * max(1., abs(solution.objective_value)) + tol)
+
+    def race_solution(self, model):
+        """
+        FBA of model solved by every solver of race_solvers at once, each
+        in its own process on its own copy of model. The first optimal
+        solution that passes verify_solution wins and the processes of
+        the other solvers are killed. solver is then set to the winner,
+        which later stages use, and model is configured for it. If no
+        solver returns a verified optimum, the first result returned is
+        used, e.g. an infeasible solution.
+
+        Parameters
+        ----------
+        model : cobra.Model
+            Model to solve, configured except for its solver
+        """
+        solvers = list(self.race_solvers or installed_solvers())
+        if self.fba_type == 'Loopless FBA' and 'glpk' in solvers and 'highs' in solvers:
+            # highs leaves Loopless FBA to glpk
+            solvers.remove('highs')
+        if len(solvers) < 2 or multiprocessing.current_process().daemon:
+            # Nothing to race, or in a worker process, which can not
+            # start processes of its own
+            self.solver = solvers[0] if len(solvers) == 1 else 'auto'
+            self.configure_solver(model)
+            return self.run_fba(model)
+
+        results = multiprocessing.Queue()
+        processes = []
+        for solver in solvers:
+            pipeline = copy.copy(self)
+            pipeline.solver = solver
+            processes.append(multiprocessing.Process(target=_race_worker,
+                                                     args=(pipeline, model, results),
+                                                     daemon=True))
+        start = time.perf_counter()
+        for process in processes:
+            process.start()
+
+        self.race_seconds = {}
+        winner = first = None
+        race_lps = 0
+        try:
+            while len(self.race_seconds) < len(solvers):
+                try:
+                    solver, solution, optimum, lps, error = results.get(timeout=1)
+                except queue.Empty:
+                    # Every process died without a result
+                    if not any(process.is_alive() for process in processes):
+                        break
+                    continue
+                self.race_seconds[solver] = time.perf_counter() - start
+                race_lps += lps
+                if error is None and first is None:
+                    first = solver, solution, optimum
+                if (error is None and solution.status == 'optimal'
+                        and self.verify_solution(model, solution)):
+                    winner = solver, solution, optimum
+                    break
+        finally:
+            for process in processes:
+                if process.is_alive():
+                    process.terminate()
+                process.join()
+            results.close()
+
+        winner = winner or first
+        if winner is None:
+            raise RuntimeError(f'No raced solver returned a solution: {", ".join(solvers)}')
+        self.solver, solution, self.optimum = winner
+        self.solver_selection = 'race'
+        self.fba_lps = race_lps
+        self.configure_solver(model)
+        return solution
+
+    def loop_reactions(self, model, support=None):
+        """Return the set of ids of internal reactions that may be part of
+           a loop, i.e. a steady state flux through internal reactions only
+           that respects reaction directions. Candidates are the reactions
+           in support, by default internal_nullspace_support, narrowed to
+           those that are reversible or found by _carrying_flux to carry
+           flux with every boundary reaction closed and other bounds
+           reduced to their direction. Must be called before adding
+           constraints that exclude the zero flux vector. Sets loop_lps."""
+
+        if support is None:
+            support = self.internal_nullspace_support(model)
+        self.loop_lps = 0
+        if not support:
+            return set()
+
+        with model:
+            lower, upper = self.reaction_bounds(model)
+            boundary = np.array([rct.boundary for rct in model.reactions])
+            self.set_bounds(model, np.arange(len(model.reactions)),
+                            np.where(boundary | (lower >= 0), 0, -self.MAX_BOUND),
+                            np.where(boundary | (upper <= 0), 0, self.MAX_BOUND))
+            forward, reverse, self.loop_lps = self._carrying_flux(model)
 
-        for rct_id in model.medium:
+        return {rct.id for rct, fwd, rev in zip(model.reactions, forward, reverse)
+                if rct.id in support and (fwd or rev or rct.reversibility)}
 
-            ex_rct = model.reactions.get_by_id(rct_id)
-            compound = list(ex_rct.metabolites)[0]
-            cmp_atoms = atom_count(compound.formula)
+    def active_reactions(self, fba_sol):
+        """Return the set of reaction ids carrying flux in fba_sol, or
+           None if fba_sol is not an optimal flux vector for the objective."""
+        # pFBA below the full optimum does not give an optimal flux vector
+        is_optimal = self.fba_type != 'pFBA' or self.fraction_of_optimum_pfba >= 1
+        if fba_sol is None or fba_sol.status != 'optimal' or not is_optimal:
+            return None
+        return {rct_id for rct_id, flux in fba_sol.fluxes.items()
+                if abs(flux) > self.ZERO_FLUX}
 
-            for atom in constrs:
-                atom_occurences = cmp_atoms.get(atom)
-                if atom_occurences:
-                    constrs[atom] += ex_rct.reverse_variable * atom_occurences
+    def prescreen_gene_knockouts(self, model, footprints, fba_sol=None, optimum=None):
+        """Resolve single gene knockouts that do not need an LP.
 
-        for atom in constrs:
-            model.add_cons_vars(
-                model.problem.Constraint(constrs[atom],
-                                         lb=0,
-                                         ub=self.max_uptakes[atom]))
+           A knockout that disables no reaction, or only reactions with
+           zero flux in an optimal wild-type solution, keeps that solution
+           feasible and therefore keeps the wild-type optimum. Remaining
+           genes are grouped by the set of reactions their knockout
+           disables, since such genes share the same knockout optimum.
 
-    def run(self, model, media):
-        """This function mutates model."""
+           footprints maps gene id to the reactions its knockout disables.
+           Returns (growth, groups) where growth maps resolved gene ids to
+           the wild-type optimum, solved here if not given, and groups maps
+           one representative gene id per footprint to the list of gene
+           ids sharing it."""
 
-        # Select optimization solver
-        model.solver = self.solver
-        if self.solver == 'coinor_cbc':
+        active = self.active_reactions(fba_sol)
+
+        growth, groups, by_footprint = {}, {}, {}
+        for gene in model.genes:
+            gene_id = gene.id
+            footprint = footprints.get(gene_id, frozenset())
+            if not footprint or (active is not None and not footprint & active):
+                if optimum is None:
+                    optimum = model.slim_optimize(error_value=float('nan'))
+                    self.ko_lps += 1
+                growth[gene_id] = optimum
+            elif footprint in by_footprint:
+                groups[by_footprint[footprint]].append(gene_id)
+            else:
+                by_footprint[footprint] = gene_id
+                groups[gene_id] = [gene_id]
+
+        return growth, groups
+
+    def run_essentiality_screen(self, model, gpr=None, fba_sol=None, deadline=None,
+                                optimum=None):
+        """Knock out each gene in model one at a time and compute the
+           objective value, fanning the genes out over a pool of worker
+           processes. Knockouts are evaluated with the compiled gpr on
+           top of feature_ko_list. Genes resolved by
+           prescreen_gene_knockouts are not solved. Returns a dict mapping
+           gene id to growth, where growth is nan if the knockout is
+           infeasible. If a time.monotonic deadline is given, genes not
+           solved by then are left out and ko_complete is set to False.
+           optimum is the wild-type objective value, see
+           prescreen_gene_knockouts."""
+
+        self.ko_lps = 0
+        gene_ids = [gene.id for gene in model.genes]
+        if not gene_ids:
+            return {}
+
+        gpr = gpr or CompiledGPR(model)
+        footprints = gpr.single_knockout_footprints(self.feature_ko_list)
+
+        growth, groups = self.prescreen_gene_knockouts(model, footprints, fba_sol, optimum)
+        self.ko_lps_saved = len(gene_ids) - len(groups)
+
+        if groups:
+            processes = _num_processes(self.ko_processes, len(groups))
+            chunks = _make_chunks([(gene_id, footprints[gene_id]) for gene_id in groups],
+                                  processes, None,
+                                  4 if deadline is None else self.DEADLINE_CHUNKS_PER_PROCESS)
+
+            for chunk_result in _map_chunks(model, _ko_chunk, chunks, processes, deadline):
+                self.ko_lps += len(chunk_result)
+                for gene_id, value in chunk_result:
+                    for member_id in groups[gene_id]:
+                        growth[member_id] = value
+
+        # Report genes in model order
+        self.ko_complete = len(growth) == len(gene_ids)
+        return {gene_id: growth[gene_id] for gene_id in gene_ids if gene_id in growth}
+
+    def run_double_ko_screen(self, model, ko_growth, gpr=None, fba_sol=None, fva_sol=None,
+                             deadline=None):
+        """Search gene pairs for synthetic lethality. ko_growth is the
+           result of run_essentiality_screen. Candidate pairs are pruned
+           before any LP is solved:
+             - essential single genes are dropped, and so are genes
+               missing from a partial ko_growth, which may be essential
+               on their own, leaving double_ko_complete False,
+             - genes must be associated with a reaction that can carry
+               flux according to fva_sol, i.e. an active or alternative
+               path, or that FVA did not solve in time,
+             - pairs whose combined footprint equals one gene's single
+               footprint keep that gene's non-lethal growth,
+             - pairs whose footprint misses every reaction active in an
+               optimal fba_sol keep the wild-type optimum.
+           Remaining pairs are deduplicated by footprint and solved in
+           parallel until double_ko_time_budget seconds have passed or
+           the time.monotonic deadline, if given, whichever comes first.
+           Returns a list of (gene_id, gene_id, growth) for lethal pairs."""
+
+        deadline = min(time.monotonic() + self.double_ko_time_budget,
+                       math.inf if deadline is None else deadline)
+        gpr = gpr or CompiledGPR(model)
+        footprints = gpr.single_knockout_footprints(self.feature_ko_list)
+
+        # Reactions that carry flux in some feasible state, or may,
+        # since FVA did not solve them
+        if fva_sol is None:
+            flux_rcts = set(gpr.rct_ids)
+        else:
+            flux_rcts = {rct_id for rct_id, min_, max_ in fva_sol.itertuples()
+                         if not (abs(min_) <= self.ZERO_FLUX and abs(max_) <= self.ZERO_FLUX)}
+
+        essential = {gene.id for gene in self.classify_essential_genes(model, ko_growth)}
+        flux_genes = [gene.id for gene in model.genes if gene.id in gpr.gene_index
+                      and any(gpr.rct_ids[rct_idx] in flux_rcts
+                              for rct_idx in gpr.gene_rcts[gpr.gene_index[gene.id]])]
+        # Only genes the single knockout screen solved are known not to
+        # be essential
+        candidates = [gene_id for gene_id in flux_genes
+                      if gene_id in ko_growth and gene_id not in essential]
+        unscreened = any(gene_id not in ko_growth for gene_id in flux_genes)
+
+        active = self.active_reactions(fba_sol)
+        groups, by_footprint = {}, {}
+        for pair in itertools.combinations(candidates, 2):
+            footprint = gpr.knockout_footprint(pair, self.feature_ko_list)
+            if footprint in (footprints[pair[0]], footprints[pair[1]]):
+                continue
+            if active is not None and not footprint & active:
+                continue
+            if footprint in by_footprint:
+                groups[by_footprint[footprint]].append(pair)
+            else:
+                by_footprint[footprint] = pair
+                groups[pair] = [pair]
+
+        self.double_ko_lps = 0
+        self.double_ko_complete = True
+        lethal_pairs = []
+        if groups:
+            processes = _num_processes(self.ko_processes, len(groups))
+            chunks = _make_chunks([(pair, footprint) for footprint, pair in by_footprint.items()],
+                                  processes, None, self.DEADLINE_CHUNKS_PER_PROCESS)
+
+            for chunk_result in _map_chunks(model, _ko_chunk, chunks, processes, deadline):
+                self.double_ko_lps += len(chunk_result)
+                for pair, value in chunk_result:
+                    if math.isnan(value) or value < self.ESSENTIAL_THRESHOLD:
+                        lethal_pairs.extend((*member, value) for member in groups[pair])
+
+            self.double_ko_complete = self.double_ko_lps == len(groups)
+        if unscreened:
+            self.double_ko_complete = False
+
+        return sorted(lethal_pairs)
+
+    def classify_essential_genes(self, model, growth):
+        """Return the set of genes whose knockout drops the objective
+           below ESSENTIAL_THRESHOLD or makes the model infeasible."""
+        return {model.genes.get_by_id(gene_id) for gene_id, value in growth.items()
+                if math.isnan(value) or value < self.ESSENTIAL_THRESHOLD}
+
+    @staticmethod
+    def run_many(model, conditions, processes=None):
+        """Run several conditions on one model. conditions is a list of
+           (pipeline, media) pairs. Each condition's media, knockouts and
+           bounds are applied inside a model context, so the model is
+           converted and its LP built only once. Conditions are solved
+           in parallel by a pool of worker processes each holding one
+           copy of model. Returns a list of (pipeline, kbase_fba_obj,
+           fba_sol) in the order of conditions."""
+
+        if not conditions:
+            return []
+
+        processes = _num_processes(processes, len(conditions))
+        tasks = []
+        for index, (pipeline, media) in enumerate(conditions):
+            # Worker processes can not start pools of their own
+            if processes > 1:
+                pipeline.fva_processes = pipeline.ko_processes = 1
+            tasks.append((index, pipeline, media))
+
+        results = [None] * len(conditions)
+        for chunk_result in _map_chunks(model, _condition_chunk,
+                                        _make_chunks(tasks, processes), processes):
+            for index, pipeline, kbase_fba_obj, fba_sol in chunk_result:
+                results[index] = (pipeline, kbase_fba_obj, fba_sol)
+
+        return results
+
+    def configure_solver(self, model):
+        """Set the solver of model to the one selected by solver,
+           replacing auto with the choice of the solver profile."""
+        if self.solver == 'auto':
+            self.solver = SolverProfile.load().choose(
+                size_class(model), analysis_type(self.fba_type, self.fva_type))
+            self.solver_selection = 'auto'
+        if self.solver == 'race':
+            # Each raced solver configures its own copy of model
+            return
+
+        # Select optimization solver. Only switch when needed since
+        # switching rebuilds the solver problem.
+        solver = 'glpk' if self.solver == 'highs' else self.solver
+        if interface_to_str(model.problem) != solver:
+            model.solver = solver
+        if solver == 'coinor_cbc':
             # Use all available processors
             model.solver.configuration.threads = -1
 
+    def run_fba(self, model):
+        """Return the FBA solution of model for fba_type. Sets optimum
+           to the objective value of the plain FBA optimum, None if it is
+           not optimal, and fba_lps to the number of LPs solved. Raises
+           OptimizationError if pFBA has no FBA optimum to start from, or
+           if highs solves a model without an optimum."""
+        if self.solver == 'race':
+            return self.race_solution(model)
+        if self.solver == 'highs' and self.fba_type != 'Loopless FBA':
+            return self.highs_solution(model)
+
+        # Run vanilla FBA, which pFBA and Loopless FBA start from
+        solution = model.optimize()
+        self.optimum = solution.objective_value if solution.status == 'optimal' else None
+        self.fba_lps = 1
+        if self.fba_type == 'pFBA':
+            check_solver_status(solution.status, raise_error=True)
+            solution = self.pfba_solution(model, self.optimum)
+            self.fba_lps += 1
+        elif self.fba_type == 'Loopless FBA' and self.optimum is not None:
+            # Run CycleFreeFlux algorithm
+            solution = self.loopless_solution(model, solution)
+            self.fba_lps += 1
+        return solution
+
+    def run_stages(self, model, stages, budget_end=None):
+        """
+        Run stages in dependency order and return a dict of their results
+        by name. Stages whose requirements are done run concurrently: the
+        one with the fewest LPs in this process and each other one in a
+        forked process, i.e. on its own copy of model, with the pipeline
+        attributes it sets copied back. Processors are split between them
+        by estimated LPs. Stages run one after another when there are
+        fewer processors than concurrent stages with LPs, or in a worker
+        process, which can not start processes of its own. Each step,
+        i.e. stage or set of concurrent stages, gets a deadline from the
+        budget shares of its stages. Raises RuntimeError if a forked stage
+        exits without a result.
+
+        Parameters
+        ----------
+        stages : list
+            Stage objects, each listed after the stages it requires.
+            Requirements not in stages are taken as done.
+        budget_end : float
+            time.monotonic end of the time budget, or None
+        """
+        depth = {}
+        for stage in stages:
+            depth[stage.name] = 1 + max((depth[name] for name in stage.requires if name in depth),
+                                        default=0)
+
+        # Group stages that can run concurrently into steps
+        cores = multiprocessing.cpu_count()
+        can_fork = not multiprocessing.current_process().daemon
+        steps = []
+        for level in sorted(set(depth.values())):
+            group = [stage for stage in stages if depth[stage.name] == level]
+            if can_fork and len(group) > 1 and sum(1 for stage in group if stage.lps) <= cores:
+                steps.append(group)
+            else:
+                steps.extend([stage] for stage in group)
+        shares = [max(self.STAGE_BUDGET_SHARES.get(stage.name, 0.) for stage in step)
+                  for step in steps]
+
+        results = {}
+        for i, step in enumerate(steps):
+            deadline = _stage_deadline(budget_end, shares[i:])
+            if len(step) == 1:
+                results[step[0].name] = step[0].func(model, results, deadline)
+                continue
+
+            total_lps = sum(stage.lps for stage in step)
+            processes = {stage.name: max(1, cores * stage.lps // total_lps) for stage in step}
+            local = min(step, key=lambda stage: stage.lps)
+
+            context = multiprocessing.get_context('fork')
+            queue_ = context.Queue()
+            children = {stage.name: context.Process(target=_stage_worker,
+                                                    args=(self, stage, model, results, deadline,
+                                                          processes[stage.name], queue_))
+                        for stage in step if stage is not local}
+            for child in children.values():
+                child.start()
+            try:
+                results[local.name] = _run_stage(self, local, model, results, deadline,
+                                                 processes[local.name])
+                pending = set(children)
+                while pending:
+                    try:
+                        name, result, attributes, error = queue_.get(timeout=1)
+                    except queue.Empty:
+                        # A child flushes its result before exiting, so one
+                        # that exited with nothing left in the queue died
+                        exited = [name for name in pending if not children[name].is_alive()]
+                        if exited and queue_.empty():
+                            raise RuntimeError('Pipeline stages exited without a result: ' +
+                                               ', '.join(f'{name} (exit code '
+                                                         f'{children[name].exitcode})'
+                                                         for name in sorted(exited)))
+                        continue
+                    if error is not None:
+                        raise error
+                    pending.discard(name)
+                    results[name] = result
+                    vars(self).update(attributes)
+            finally:
+                for child in children.values():
+                    if child.is_alive():
+                        child.terminate()
+                    child.join()
+                queue_.close()
+
+        return results
+
+    def run(self, model, media, gpr=None):
+        """This function mutates model. gpr is the compiled CompiledGPR
+           of model, compiled here if not given."""
+
+        # End of the time budget of the stages after FBA
+        budget_end = None
+        if self.time_budget_seconds:
+            start = time.monotonic() if self.budget_start is None else self.budget_start
+            budget_end = start + (1 - self.OUTPUT_BUDGET_SHARE) * self.time_budget_seconds
+
+        self.configure_solver(model)
+
         # If specified, make all reactions reversible
         if self.is_all_reversible:
-            for rct in model.reactions:
-                rct.upper_bound = self.MAX_BOUND
-                rct.lower_bound = self.MAX_BOUND * -1
+            self.set_bounds(model, np.arange(len(model.reactions)),
+                            self.MAX_BOUND * -1, self.MAX_BOUND)
 
         # Add custom bounds to reactions
-        for rct_id, lb, ub in self.custom_bound_list:
-            if rct_id in model.reactions:
-                rct = model.reactions.get_by_id(rct_id)
-                rct.lower_bound, rct.upper_bound = lb, ub
+        custom_bounds = [(rct_id, lb, ub) for rct_id, lb, ub in self.custom_bound_list
+                         if rct_id in model.reactions]
+        if custom_bounds:
+            rct_ids, lower, upper = zip(*custom_bounds)
+            self.set_bounds(model, self.reaction_indices(model, rct_ids), lower, upper)
+
+        # Compile gene-reaction rules once for all knockouts in this run
+        gpr = gpr or CompiledGPR(model)
 
         # Filter out user specified genes to ko that are not in model.
         self.feature_ko_list = list(filter(lambda gene: gene in model.genes,
                                            self.feature_ko_list))
-        # Knockout specified genes
-        if self.feature_ko_list:
-            cobra.manipulation.delete_model_genes(model, self.feature_ko_list)
-
-        for rct_id in self.reaction_ko_list:
-            if rct_id in model.reactions:
-                rct = model.reactions.get_by_id(rct_id)
-                rct.lower_bound, rct.upper_bound = 0, 0
+        # Knockout specified genes and reactions
+        ko_rct_ids = gpr.disabled_reactions(self.feature_ko_list).union(self.reaction_ko_list)
+        self.set_bounds(model, self.reaction_indices(model, ko_rct_ids), 0, 0)
+        for gene_id in self.feature_ko_list:
+            model.genes.get_by_id(gene_id).functional = False
 
         # Update exchange reaction variable bounds based on user
         # specified max uptakes. Add max uptake contraints.
@@ -191,33 +1777,50 @@ class FBAPipeline:
 
         # Set direction of the objective function, maximize by default.
         if self.is_minimize_objective:
-            model.objective.direction = 'min'
+            model.objective_direction = 'min'
 
         # Compute FBA solution
-        if self.fba_type == 'pFBA':
-            from cobra.flux_analysis import pfba
-            fba_sol = pfba(model,
-                           fraction_of_optimum=self.fraction_of_optimum_pfba)
-        elif self.fba_type == 'Loopless FBA':
-            # Run CycleFreeFlux algorithm
-            fba_sol = cobra.flux_analysis.loopless_solution(model)
-        else:
-            # Run vanilla FBA
-            fba_sol = model.optimize()
+        fba_sol = self.run_fba(model)
 
+        # Stages after FBA. FVA, the single knockout screen and the
+        # report data only need the FBA solution, so they run concurrently.
+        stages = [Stage('report_data', lambda model, results, deadline:
+                        report_data(model, fba_sol))]
         # If specified, compute FVA solution
-        fva_sol = None
         if self.fva_type != 'Neither':
-            from cobra.flux_analysis import flux_variability_analysis as fva
-            fva_sol = fva(model,
-                          loopless=self.fva_type == 'Loopless FVA',
-                          fraction_of_optimum=self.fraction_of_optimum_fva)
-        
+            stages.append(Stage('fva', lambda model, results, deadline:
+                                self.run_fva(model, fba_sol, deadline, self.optimum),
+                                lps=2 * len(model.reactions), processes_attr='fva_processes'))
         # If specified, simulate all single gene knockouts
+        if self.is_single_ko or self.is_double_ko:
+            stages.append(Stage('single_ko', lambda model, results, deadline:
+                                self.run_essentiality_screen(model, gpr, fba_sol, deadline,
+                                                             self.optimum),
+                                lps=len(model.genes), processes_attr='ko_processes'))
+        # If specified, screen gene pairs for synthetic lethality
+        if self.is_double_ko:
+            stages.append(Stage('double_ko', lambda model, results, deadline:
+                                self.run_double_ko_screen(model, results['single_ko'], gpr,
+                                                          fba_sol, results.get('fva'),
+                                                          deadline),
+                                requires=('single_ko', 'fva'),
+                                lps=len(model.genes) ** 2 // 2, processes_attr='ko_processes'))
+
+        results = self.run_stages(model, stages, budget_end)
+        self.report_data = results['report_data']
+        fva_sol = results.get('fva')
         essential_genes = set()
-        if self.is_single_ko:
-            essential_genes = cobra.flux_analysis.variability. \
-                              find_essential_genes(model, threshold=1e-11)
+        if 'single_ko' in results:
+            self.ko_growth = results['single_ko']
+            essential_genes = self.classify_essential_genes(model, self.ko_growth)
+        if 'double_ko' in results:
+            self.lethal_pairs = results['double_ko']
+
+        # Count LPs of every stage that ran
+        self.lps = (self.fba_lps
+                    + (self.fva_lps if fva_sol is not None else 0)
+                    + (self.ko_lps if self.is_single_ko or self.is_double_ko else 0)
+                    + (self.double_ko_lps if self.is_double_ko else 0))
 
         # Convert COBRApy model to kbase format
         fba_builder = KBaseFBABuilder.from_cobra(self.output_id,
@@ -226,7 +1829,28 @@ class FBAPipeline:
                                                  media,
                                                  self.workspace)
 
-        kbase_fba_obj = fba_builder.with_cobra_fva_solution(fva_sol).build()
-        
+        # Ranges of reactions FVA did not solve in time are saved as
+        # their bounds, which contain the true range
+        saved_fva_sol = fva_sol
+        if fva_sol is not None and not self.fva_complete:
+            lower, upper = self.reaction_bounds(model)
+            saved_fva_sol = fva_sol.fillna({'minimum': pd.Series(lower, index=fva_sol.index),
+                                            'maximum': pd.Series(upper, index=fva_sol.index)})
+
+        kbase_fba_obj = fba_builder.with_cobra_fva_solution(saved_fva_sol).build()
+
+        # Flag loopless ranges that may be narrower than the exact ones
+        if fva_sol is not None and self.fva_approximate:
+            kbase_fba_obj.setdefault('parameters', {})['Approximate FVA reactions'] = ','.join(
+                rct_id for rct_id in fva_sol.index if rct_id in self.fva_approximate)
+
+        # Record synthetic lethal pairs as deletion results
+        if self.lethal_pairs and self.genome_ref:
+            kbase_fba_obj['FBADeletionResults'] = [
+                {'feature_refs': [f'{self.genome_ref}/features/id/{gene_id}'
+                                  for gene_id in (gene1, gene2)],
+                 'growthFraction': 0.}
+                for gene1, gene2, _ in self.lethal_pairs]
+
         # TODO: essential_genes to this object in cobrakbase
         return kbase_fba_obj, fva_sol, fba_sol, essential_genes
@@ -0,0 +1,265 @@
+import sys
+import json
+import time
+import argparse
+import cobrakbase
+from cobrakbase.core.converters import KBaseFBAModelToCobraBuilder
+from cobrakbase.core.model import KBaseFBAModelMetabolite, KBaseFBAModelReaction
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+# Paths of an FBAModel read by KBaseFBAModelToCobraBuilder and the Impl,
+# as workspace included paths. Gapfilling data, template references,
+# aliases, roles and notes are left out of the download.
+FBAMODEL_PATHS = ['/id',
+                  '/name',
+                  '/genome_ref',
+                  '/modelcompartments',
+                  '/modelcompounds/[*]/id',
+                  '/modelcompounds/[*]/name',
+                  '/modelcompounds/[*]/formula',
+                  '/modelcompounds/[*]/charge',
+                  '/modelcompounds/[*]/modelcompartment_ref',
+                  '/modelcompounds/[*]/dblinks',
+                  '/modelreactions/[*]/id',
+                  '/modelreactions/[*]/name',
+                  '/modelreactions/[*]/direction',
+                  '/modelreactions/[*]/maxforflux',
+                  '/modelreactions/[*]/maxrevflux',
+                  '/modelreactions/[*]/dblinks',
+                  '/modelreactions/[*]/modelReactionReagents',
+                  '/modelreactions/[*]/modelReactionProteins/[*]'
+                  '/modelReactionProteinSubunits/[*]/feature_refs',
+                  '/biomasses/[*]/id',
+                  '/biomasses/[*]/name',
+                  '/biomasses/[*]/biomasscompounds']
+
+def select_paths(data, paths):
+    """
+    Return the subset of data at paths, the way the workspace subsets
+    an object for included paths. Keys missing from data are skipped.
+
+    Parameters
+    ----------
+    data : dict
+        Object data
+    paths : list
+        Included paths, e.g. '/modelreactions/[*]/id'
+    """
+    # Tree of path keys, None where the whole value is included
+    tree = {}
+    for path in paths:
+        node = tree
+        keys = path.strip('/').split('/')
+        for key in keys[:-1]:
+            if node.get(key, {}) is None:
+                break
+            node = node.setdefault(key, {})
+        else:
+            node[keys[-1]] = None
+    return _select(data, tree)
+
+# Helper function for select_paths
+def _select(data, tree):
+    if tree is None:
+        return data
+    if isinstance(data, list):
+        return [_select(item, tree['[*]']) for item in data]
+    return {key: _select(data[key], subtree) for key, subtree in tree.items() if key in data}
+
+def build_model(fbamodel_json, media=None):
+    """Return the cobra model of fbamodel_json, built with media if given."""
+    builder = KBaseFBAModelToCobraBuilder(cobrakbase.core.model.KBaseFBAModel(fbamodel_json))
+    if media is not None:
+        builder = builder.with_media(media)
+    return builder.build()
+
+# Marks the end of a streamed list in the output of _members
+END = object()
+
+# Helper function for stream_model
+def _members(events, prefix, streamed):
+    """Yield (key, value) of each member of the object at prefix of the
+       ijson events, except for members at keys in streamed, which are
+       lists yielded as (key, item) for each item followed by (key, END)."""
+    key = None
+    builder = None
+    for path, event, value in events:
+        if key is None:
+            if path == prefix and event == 'map_key':
+                key = value
+                member = f'{prefix}.{key}' if prefix else key
+                item = member + '.item'
+            elif path == prefix and event == 'end_map':
+                return
+            continue
+
+        if key in streamed and path == member:
+            # Start or end of the list, or a null in place of it
+            if event != 'start_array':
+                yield key, END
+                key = None
+            continue
+
+        if builder is None:
+            builder = ijson.ObjectBuilder()
+        builder.event(event, value)
+        # Last event of a list item or a member, i.e. its end or a scalar
+        if path == (item if key in streamed else member) and \
+                event not in ('start_map', 'start_array', 'map_key'):
+            yield key, builder.value
+            builder = None
+            if key not in streamed:
+                key = None
+
+
+class StreamedFBAModel:
+    """FBAModel read for KBaseFBAModelToCobraBuilder from the output of
+       _members, with the id, metabolites, reactions and data the builder
+       reads of a KBaseFBAModel. Any order of reading gives the whole
+       object. Each of modelcompounds and modelreactions is handed over
+       one item at a time as it is parsed if it is read before the
+       members that follow it, and buffered otherwise. With the
+       workspace's sorted keys, id and biomasses precede both."""
+
+    # Lists read item by item, each only once
+    STREAMED = ('modelcompounds', 'modelreactions')
+
+    def __init__(self, members):
+        self.members = members
+        # Members other than the streamed lists read so far
+        self.fields = {}
+        # Streamed lists read before they were asked for
+        self.buffered = {}
+        # Streamed lists already asked for
+        self.read = set()
+
+    def _read(self, streaming=None):
+        """Read members, yielding (key, value) of each other member and
+           of each item of the list at streaming, and END once it ends.
+           Items of any other streamed list are buffered."""
+        for member, value in self.members:
+            if member == streaming:
+                yield member, value
+            elif member in self.STREAMED:
+                items = self.buffered.setdefault(member, [])
+                if value is not END:
+                    items.append(value)
+            else:
+                self.fields[member] = value
+                yield member, value
+
+    def _items(self, key):
+        if key in self.read:
+            raise ValueError(f'{key} of a streamed FBAModel can only be read once')
+        self.read.add(key)
+        if key in self.buffered:
+            yield from self.buffered.pop(key)
+            return
+        for member, value in self._read(key):
+            if member == key:
+                if value is END:
+                    return
+                yield value
+
+    def _field(self, key):
+        if key not in self.fields:
+            for member, _ in self._read():
+                if member == key:
+                    break
+        return self.fields.get(key)
+
+    @property
+    def id(self):
+        return self._field('id')
+
+    @property
+    def data(self):
+        """Members other than the streamed lists, all read first."""
+        for _ in self._read():
+            pass
+        return self.fields
+
+    @property
+    def metabolites(self):
+        # Duplicate compounds are dropped as by KBaseFBAModel
+        ids = set()
+        for compound in self._items('modelcompounds'):
+            if compound['id'] not in ids:
+                ids.add(compound['id'])
+                yield KBaseFBAModelMetabolite(compound)
+
+    @property
+    def reactions(self):
+        for reaction in self._items('modelreactions'):
+            yield KBaseFBAModelReaction(reaction)
+
+def stream_model(fp, media=None, prefix=''):
+    """
+    Build the cobra model of the FBAModel JSON in the binary file fp
+    while it is parsed, without holding its text or the whole object
+    data in memory at once. Returns (model, data), where data are the
+    members other than modelcompounds and modelreactions. Requires ijson.
+
+    Parameters
+    ----------
+    fp : file
+        Binary file of JSON
+    media : KBaseBiochemMedia
+        Media to build the model with
+    prefix : str
+        ijson prefix of the FBAModel object data in fp
+    """
+    events = ijson.parse(fp, use_float=True)
+    fbamodel = StreamedFBAModel(_members(events, prefix, StreamedFBAModel.STREAMED))
+    builder = KBaseFBAModelToCobraBuilder(fbamodel)
+    if media is not None:
+        builder = builder.with_media(media)
+    model = builder.build()
+    return model, fbamodel.data
+
+def benchmark(path, paths=FBAMODEL_PATHS):
+    """
+    Return the payload bytes and seconds taken to parse and convert the
+    FBAModel JSON file at path, whole and limited to paths, as a dict
+    {'full': (bytes, parse seconds, build seconds), 'included': ...}.
+
+    Parameters
+    ----------
+    path : str
+        FBAModel object data as JSON, e.g. downloaded from a narrative
+    paths : list
+        Included paths
+    """
+    with open(path) as f:
+        text = f.read()
+    payloads = {'full': text,
+                'included': json.dumps(select_paths(json.loads(text), paths))}
+
+    results = {}
+    for name, payload in payloads.items():
+        start = time.perf_counter()
+        fbamodel_json = json.loads(payload)
+        parsed = time.perf_counter()
+        build_model(fbamodel_json)
+        built = time.perf_counter()
+        results[name] = (len(payload.encode('utf-8')), parsed - start, built - parsed)
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Compare payload size, parse and conversion time of whole '
+                    'FBAModel objects against the FBAMODEL_PATHS subset.')
+    parser.add_argument('files', nargs='+', help='FBAModel object data JSON files')
+    args = parser.parse_args(argv)
+
+    print('file\tpayload\tbytes\tparse_s\tbuild_s')
+    for path in args.files:
+        for name, (size, parse, build) in benchmark(path).items():
+            print(f'{path}\t{name}\t{size}\t{parse:.3f}\t{build:.3f}', flush=True)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,166 @@
+import re
+
+# Operators of compiled rule nodes
+AND, OR = 0, 1
+
+# A rule token is a parenthesis or a run of anything else
+_TOKEN = re.compile(r'\(|\)|[^\s()]+')
+
+# Helper function for parsing gene-reaction rules
+def compile_rule(rule, gene_index):
+    """
+    Compile a gene-reaction rule string into a nested tuple AST.
+    Leaves are integer gene indices and internal nodes are
+    (op, children) with op either AND or OR. 'and' binds tighter
+    than 'or' as in COBRApy. Genes not yet in gene_index are added.
+    Returns None for an empty rule.
+
+    Parameters
+    ----------
+    rule : str
+        Gene-reaction rule, e.g. '(b0001 and b0002) or b0003'
+    gene_index : dict
+        Maps gene id to integer index, updated in place
+    """
+    tokens = _TOKEN.findall(rule)
+    if not tokens:
+        return None
+
+    pos = 0
+
+    def peek():
+        return tokens[pos].lower() if pos < len(tokens) else None
+
+    def parse(op, parse_operand):
+        nonlocal pos
+        children = [parse_operand()]
+        while peek() == ('and' if op == AND else 'or'):
+            pos += 1
+            children.append(parse_operand())
+        if len(children) == 1:
+            return children[0]
+        # Flatten nested nodes of the same operator
+        flat = []
+        for child in children:
+            if isinstance(child, tuple) and child[0] == op:
+                flat.extend(child[1])
+            else:
+                flat.append(child)
+        return (op, tuple(flat))
+
+    def parse_atom():
+        nonlocal pos
+        token = tokens[pos]
+        pos += 1
+        if token == '(':
+            node = parse_or()
+            if peek() != ')':
+                raise ValueError(f'Unbalanced parenthesis in rule: {rule}')
+            pos += 1
+            return node
+        if token == ')' or token.lower() in ('and', 'or'):
+            raise ValueError(f'Unexpected {token} in rule: {rule}')
+        return gene_index.setdefault(token, len(gene_index))
+
+    def parse_and():
+        return parse(AND, parse_atom)
+
+    def parse_or():
+        return parse(OR, parse_and)
+
+    node = parse_or()
+    if pos != len(tokens):
+        raise ValueError(f'Unexpected {tokens[pos]} in rule: {rule}')
+    return node
+
+def is_active(node, ko_mask):
+    """Evaluate a compiled rule given a bitset of knocked out gene indices."""
+    if isinstance(node, int):
+        return not (ko_mask >> node) & 1
+    op, children = node
+    if op == AND:
+        return all(is_active(child, ko_mask) for child in children)
+    return any(is_active(child, ko_mask) for child in children)
+
+
+class CompiledGPR:
+    """Gene-reaction rules of a model compiled once into integer
+       indexed ASTs, with gene sets represented as integer bitsets.
+       Answers which reactions a set of gene knockouts disables
+       without re-parsing rule strings."""
+
+    def __init__(self, model):
+        # Maps gene id to bit index
+        self.gene_index = {}
+
+        # Reaction ids and compiled rules of reactions with a rule
+        self.rct_ids = []
+        self.rules = []
+
+        # Reaction indices affected by each gene, by gene index
+        self.gene_rcts = []
+
+        for rct in model.reactions:
+            node = compile_rule(rct.gene_reaction_rule, self.gene_index)
+            if node is None:
+                continue
+            self.rct_ids.append(rct.id)
+            self.rules.append(node)
+
+        self.gene_rcts = [[] for _ in self.gene_index]
+        for rct_idx, node in enumerate(self.rules):
+            for gene_idx in self._leaves(node):
+                self.gene_rcts[gene_idx].append(rct_idx)
+
+    @classmethod
+    def _leaves(cls, node):
+        if isinstance(node, int):
+            return {node}
+        return set().union(*(cls._leaves(child) for child in node[1]))
+
+    def mask(self, gene_ids):
+        """Return the bitset of gene_ids, ignoring unknown genes."""
+        ko_mask = 0
+        for gene_id in gene_ids:
+            idx = self.gene_index.get(gene_id)
+            if idx is not None:
+                ko_mask |= 1 << idx
+        return ko_mask
+
+    def disabled_reactions(self, gene_ids):
+        """Return the set of reaction ids disabled by knocking out gene_ids."""
+        ko_mask = self.mask(gene_ids)
+        candidates = set()
+        for gene_id in gene_ids:
+            idx = self.gene_index.get(gene_id)
+            if idx is not None:
+                candidates.update(self.gene_rcts[idx])
+        return {self.rct_ids[rct_idx] for rct_idx in candidates
+                if not is_active(self.rules[rct_idx], ko_mask)}
+
+    def knockout_footprint(self, gene_ids, base_gene_ids=()):
+        """Return the frozenset of reaction ids disabled by knocking out
+           gene_ids on top of the base_gene_ids knockouts."""
+        base_mask = self.mask(base_gene_ids)
+        ko_mask = base_mask | self.mask(gene_ids)
+        candidates = set()
+        for gene_id in gene_ids:
+            idx = self.gene_index.get(gene_id)
+            if idx is not None:
+                candidates.update(self.gene_rcts[idx])
+        return frozenset(self.rct_ids[rct_idx] for rct_idx in candidates
+                         if is_active(self.rules[rct_idx], base_mask)
+                         and not is_active(self.rules[rct_idx], ko_mask))
+
+    def single_knockout_footprints(self, base_gene_ids=()):
+        """Return a dict mapping each gene id to the frozenset of reaction
+           ids its knockout disables on top of the base_gene_ids knockouts."""
+        base_mask = self.mask(base_gene_ids)
+        footprints = {}
+        for gene_id, idx in self.gene_index.items():
+            ko_mask = base_mask | (1 << idx)
+            footprints[gene_id] = frozenset(
+                self.rct_ids[rct_idx] for rct_idx in self.gene_rcts[idx]
+                if is_active(self.rules[rct_idx], base_mask)
+                and not is_active(self.rules[rct_idx], ko_mask))
+        return footprints
@@ -0,0 +1,214 @@
+import numpy as np
+import pandas as pd
+import scipy.sparse
+from scipy.optimize import linprog
+from cobra.core import Solution
+
+try:
+    import highspy
+except ImportError:
+    highspy = None
+
+# HiGHS model status name to optlang status
+_HIGHS_STATUS = {'Optimal': 'optimal',
+                 'Infeasible': 'infeasible',
+                 'Unbounded': 'unbounded',
+                 'Primal infeasible or unbounded': 'infeasible_or_unbounded',
+                 'Time limit reached': 'time_limit',
+                 'Iteration limit reached': 'iteration_limit'}
+
+# scipy.optimize.linprog status code to optlang status
+_LINPROG_STATUS = {0: 'optimal', 1: 'iteration_limit', 2: 'infeasible', 3: 'unbounded'}
+
+
+class HighsLP:
+    """The LP of a cobra model in array form, solved with HiGHS. Columns
+       are the solver variables of the model, i.e. the forward and reverse
+       variable of each reaction and any added variables, and rows its
+       constraints. Mass balances are built from the sparse stoichiometric
+       matrix, other constraints from their linear coefficients, so no
+       symbolic expressions are involved. Solved with highspy if installed,
+       keeping the basis across objective changes, otherwise with
+       scipy.optimize.linprog(method='highs') from scratch each time."""
+
+    def __init__(self, model):
+        variables = model.solver.variables
+        col_index = {var.name: j for j, var in enumerate(variables)}
+        self.col_lower = np.array([-np.inf if var.lb is None else var.lb for var in variables],
+                                  dtype=float)
+        self.col_upper = np.array([np.inf if var.ub is None else var.ub for var in variables],
+                                  dtype=float)
+
+        self.rct_ids = [rct.id for rct in model.reactions]
+        self.rct_index = {rct_id: i for i, rct_id in enumerate(self.rct_ids)}
+        self.forward = np.array([col_index[rct.id] for rct in model.reactions], dtype=int)
+        self.reverse = np.array([col_index[rct.reverse_id] for rct in model.reactions], dtype=int)
+        self.tolerance = model.tolerance
+
+        # Mass balances from the stoichiometric matrix
+        self.met_ids = [met.id for met in model.metabolites]
+        met_index = {met_id: i for i, met_id in enumerate(self.met_ids)}
+        rows, cols, values = [], [], []
+        for rct, fwd, rev in zip(model.reactions, self.forward.tolist(), self.reverse.tolist()):
+            for met, coef in rct.metabolites.items():
+                i = met_index[met.id]
+                rows += (i, i)
+                cols += (fwd, rev)
+                values += (coef, -coef)
+        row_lower = [model.constraints[met_id].lb for met_id in self.met_ids]
+        row_upper = [model.constraints[met_id].ub for met_id in self.met_ids]
+
+        # Other constraints, free rows left out
+        for constraint in model.constraints:
+            if constraint.name in met_index or (constraint.lb is None and constraint.ub is None):
+                continue
+            i = len(row_lower)
+            for var, coef in constraint.get_linear_coefficients(constraint.variables).items():
+                rows.append(i)
+                cols.append(col_index[var.name])
+                values.append(coef)
+            row_lower.append(constraint.lb)
+            row_upper.append(constraint.ub)
+
+        self.row_lower = np.array([-np.inf if lb is None else lb for lb in row_lower], dtype=float)
+        self.row_upper = np.array([np.inf if ub is None else ub for ub in row_upper], dtype=float)
+        self.matrix = scipy.sparse.csc_matrix((values, (rows, cols)),
+                                              shape=(len(row_lower), len(variables)))
+
+        objective = model.solver.objective
+        self.cost = np.zeros(len(variables))
+        for var, coef in objective.get_linear_coefficients(objective.variables).items():
+            self.cost[col_index[var.name]] = coef
+        self.maximize = objective.direction == 'max'
+
+        # Result of the last solve
+        self.status = None
+        self.objective_value = None
+        self.x = self.row_dual = self.col_dual = None
+
+        self._highs = None
+
+    def __getstate__(self):
+        # The HiGHS instance is rebuilt on first solve after unpickling
+        state = self.__dict__.copy()
+        state['_highs'] = None
+        return state
+
+    def _build_highs(self):
+        lp = highspy.HighsLp()
+        lp.num_col_, lp.num_row_ = self.matrix.shape[1], self.matrix.shape[0]
+        lp.col_cost_ = self.cost
+        lp.col_lower_, lp.col_upper_ = self.col_lower, self.col_upper
+        lp.row_lower_, lp.row_upper_ = self.row_lower, self.row_upper
+        lp.sense_ = highspy.ObjSense.kMaximize if self.maximize else highspy.ObjSense.kMinimize
+        lp.a_matrix_.format_ = highspy.MatrixFormat.kColwise
+        lp.a_matrix_.num_col_, lp.a_matrix_.num_row_ = lp.num_col_, lp.num_row_
+        lp.a_matrix_.start_ = self.matrix.indptr
+        lp.a_matrix_.index_ = self.matrix.indices
+        lp.a_matrix_.value_ = self.matrix.data
+
+        self._highs = highspy.Highs()
+        self._highs.setOptionValue('output_flag', False)
+        self._highs.passModel(lp)
+
+    def set_cost(self, cols, values):
+        """Set the objective coefficients of columns cols to values."""
+        cols = np.asarray(cols, dtype=np.int32)
+        values = np.asarray(values, dtype=float)
+        self.cost[cols] = values
+        if self._highs is not None:
+            self._highs.changeColsCost(len(cols), cols, values)
+
+    def set_objective(self, cost, maximize):
+        """Replace the objective with the coefficient array cost."""
+        changed = np.flatnonzero(cost != self.cost)
+        self.set_cost(changed, cost[changed])
+        self.set_sense(maximize)
+
+    def set_sense(self, maximize):
+        self.maximize = maximize
+        if self._highs is not None:
+            self._highs.changeObjectiveSense(highspy.ObjSense.kMaximize if maximize else
+                                             highspy.ObjSense.kMinimize)
+
+    def add_row(self, cols, values, lb, ub):
+        """Add the constraint lb <= sum(values * x[cols]) <= ub."""
+        cols = np.asarray(cols, dtype=np.int32)
+        values = np.asarray(values, dtype=float)
+        row = scipy.sparse.csc_matrix((values, (np.zeros(len(cols), dtype=int), cols)),
+                                      shape=(1, self.matrix.shape[1]))
+        self.matrix = scipy.sparse.vstack([self.matrix, row], format='csc')
+        self.row_lower = np.append(self.row_lower, lb)
+        self.row_upper = np.append(self.row_upper, ub)
+        if self._highs is not None:
+            self._highs.addRow(lb, ub, len(cols), cols, values)
+
+    def solve(self):
+        """Solve the LP and return its status as an optlang status
+           string. Duals are with respect to the objective as given,
+           i.e. the change of the objective per unit of the bound."""
+        if highspy is not None:
+            self._solve_highs()
+        else:
+            self._solve_linprog()
+        return self.status
+
+    def _solve_highs(self):
+        if self._highs is None:
+            self._build_highs()
+        self._highs.run()
+        # Objective changes keep the last basis primal feasible, so
+        # later solves continue from it with the primal simplex
+        self._highs.setOptionValue('simplex_strategy', 4)
+        self.status = _HIGHS_STATUS.get(
+            self._highs.modelStatusToString(self._highs.getModelStatus()), 'undefined')
+        if self.status != 'optimal':
+            self.objective_value = None
+            return
+        solution = self._highs.getSolution()
+        self.objective_value = self._highs.getInfo().objective_function_value
+        self.x = np.array(solution.col_value)
+        self.row_dual = np.array(solution.row_dual)
+        self.col_dual = np.array(solution.col_dual)
+
+    def _solve_linprog(self):
+        # linprog takes equalities and <= inequalities of a minimization
+        sign = -1. if self.maximize else 1.
+        matrix = self.matrix.tocsr()
+        eq = self.row_lower == self.row_upper
+        lower = ~eq & np.isfinite(self.row_lower)
+        upper = ~eq & np.isfinite(self.row_upper)
+        result = linprog(sign * self.cost,
+                         A_ub=scipy.sparse.vstack([matrix[upper], -matrix[lower]]),
+                         b_ub=np.concatenate([self.row_upper[upper], -self.row_lower[lower]]),
+                         A_eq=matrix[eq], b_eq=self.row_upper[eq],
+                         bounds=np.column_stack([self.col_lower, self.col_upper]),
+                         method='highs')
+        self.status = _LINPROG_STATUS.get(result.status, 'undefined')
+        if self.status != 'optimal':
+            self.objective_value = None
+            return
+        self.objective_value = sign * result.fun
+        self.x = result.x
+        self.row_dual = np.zeros(len(self.row_lower))
+        self.row_dual[eq] = sign * result.eqlin.marginals
+        num_upper = upper.sum()
+        self.row_dual[upper] += sign * result.ineqlin.marginals[:num_upper]
+        self.row_dual[lower] -= sign * result.ineqlin.marginals[num_upper:]
+        self.col_dual = sign * (result.lower.marginals + result.upper.marginals)
+
+    def fluxes(self):
+        """Net flux of each reaction in the last solution."""
+        return self.x[self.forward] - self.x[self.reverse]
+
+    def solution(self):
+        """Return the last solution as a cobra Solution."""
+        if self.status != 'optimal':
+            return Solution(None, self.status, pd.Series(np.nan, index=self.rct_ids,
+                                                         name='fluxes'))
+        return Solution(self.objective_value, self.status,
+                        pd.Series(self.fluxes(), index=self.rct_ids, name='fluxes'),
+                        pd.Series(self.col_dual[self.forward] - self.col_dual[self.reverse],
+                                  index=self.rct_ids, name='reduced_costs'),
+                        pd.Series(self.row_dual[:len(self.met_ids)], index=self.met_ids,
+                                  name='shadow_prices'))
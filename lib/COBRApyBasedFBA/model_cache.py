@@ -0,0 +1,153 @@
+import os
+import gzip
+import json
+import pickle
+import hashlib
+import tempfile
+from COBRApyBasedFBA.snapshot import ModelSnapshot, write_snapshot
+
+
+class ModelCache:
+    """On-disk cache of converted cobra models. Workspace objects
+       referenced by ws/obj/ver are immutable, so a model converted from
+       a fully versioned reference can be reused across runs. Entries
+       are evicted least recently used first once the cache grows past
+       max_bytes."""
+
+    # File extension of cache entries
+    EXTENSION = '.pkl'
+
+    def __init__(self, directory, max_bytes):
+        # Directory holding one file per cached model
+        self.directory = directory
+
+        # Total size of cache entries kept after eviction
+        self.max_bytes = max_bytes
+
+        # Number of hits and misses, and bytes of entries read on hits
+        # and written by put, since this cache was created
+        self.hits = 0
+        self.misses = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+
+        os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def key(*parts):
+        """Build a cache key from parts such as versioned object
+           references and library versions."""
+        return hashlib.sha1('|'.join(map(str, parts)).encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + self.EXTENSION)
+
+    def _load(self, f):
+        return pickle.load(f)
+
+    def _dump(self, value, f):
+        pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def get(self, key):
+        """Return the cached value of key or None on a miss."""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                value = self._load(f)
+                size = f.tell()
+        except (OSError, EOFError, ValueError, pickle.UnpicklingError):
+            self.misses += 1
+            return None
+
+        # Mark entry as recently used
+        os.utime(path)
+        self.hits += 1
+        self.bytes_read += size
+        return value
+
+    def put(self, key, value):
+        """Store value under key and evict old entries if needed."""
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                self._dump(value, f)
+                self.bytes_written += f.tell()
+            # Atomic so concurrent readers never see a partial entry
+            os.replace(tmp_path, self._path(key))
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        self.evict()
+
+    def stats(self):
+        """Return a dict of hit, miss and byte counts and the current
+           number and total size of entries."""
+        sizes = [entry.stat().st_size for entry in os.scandir(self.directory)
+                 if entry.name.endswith(self.EXTENSION)]
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'bytes_read': self.bytes_read,
+                'bytes_written': self.bytes_written,
+                'entries': len(sizes),
+                'bytes': sum(sizes)}
+
+    def evict(self):
+        """Remove least recently used entries until the cache
+           fits in max_bytes."""
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(self.EXTENSION):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+class ObjectCache(ModelCache):
+    """On-disk cache of workspace object data, stored as gzip compressed
+       JSON. Keys must be built from fully versioned references, since
+       only those always refer to the same data."""
+
+    # File extension of cache entries
+    EXTENSION = '.json.gz'
+
+    # Fast compression, object JSON shrinks well even at low levels
+    COMPRESS_LEVEL = 1
+
+    def _load(self, f):
+        with gzip.GzipFile(fileobj=f, mode='rb') as gz:
+            return json.load(gz)
+
+    def _dump(self, value, f):
+        with gzip.GzipFile(fileobj=f, mode='wb', compresslevel=self.COMPRESS_LEVEL) as gz:
+            gz.write(json.dumps(value).encode('utf-8'))
+
+
+class SnapshotCache(ModelCache):
+    """On-disk cache of models in the snapshot format. put takes a
+       cobra model and get returns its ModelSnapshot, memory-mapped from
+       the cache entry, for consumers that only need model arrays."""
+
+    # File extension of cache entries
+    EXTENSION = '.snp'
+
+    def _load(self, f):
+        snapshot = ModelSnapshot(f)
+        # Leave f at its end, get counts the entry size from it
+        f.seek(0, os.SEEK_END)
+        return snapshot
+
+    def _dump(self, value, f):
+        write_snapshot(value, f)
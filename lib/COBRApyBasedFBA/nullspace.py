@@ -0,0 +1,138 @@
+import hashlib
+import collections
+import numpy as np
+from cobra.util.array import nullspace
+from COBRApyBasedFBA.snapshot import ModelSnapshot
+
+# Number of null spaces kept in memory, by stoichiometry fingerprint
+MEMORY_SIZE = 8
+
+_memory = collections.OrderedDict()
+
+
+class InternalNullspace:
+    """Basis of the null space of a model's internal stoichiometric
+       matrix, i.e. of its loops when reaction directions are ignored.
+       Rows of basis follow rct_ids. Internal reactions missing from
+       rct_ids carry no flux in any loop."""
+
+    def __init__(self, rct_ids, basis):
+        self.rct_ids = rct_ids
+        self.basis = basis
+
+    def support(self, tol=1e-9):
+        """Return the set of ids of reactions with a nonzero row."""
+        if not self.basis.size:
+            return set()
+        in_support = np.abs(self.basis).max(axis=1) > tol
+        return {rct_id for rct_id, nonzero in zip(self.rct_ids, in_support) if nonzero}
+
+# Helper function for stoichiometry_fingerprint and compute_internal_nullspace
+def _internal_reactions(model):
+    """Return a list of (rct_id, {met_id: coef}) of the internal reactions
+       of model, a cobra.Model or a ModelSnapshot. A snapshot is read
+       from its arrays, without building cobra objects."""
+    if isinstance(model, ModelSnapshot):
+        indptr = model.arrays['S_indptr']
+        indices = model.arrays['S_indices'].tolist()
+        data = model.arrays['S_data'].tolist()
+        met_ids = model.field('met_id')
+        # Boundary reactions have a single metabolite, as in cobra
+        return [(rct_id, {met_ids[indices[k]]: data[k] for k in range(indptr[j], indptr[j + 1])})
+                for j, rct_id in enumerate(model.field('rct_id'))
+                if indptr[j + 1] - indptr[j] != 1]
+    return [(rct.id, {met.id: float(coef) for met, coef in rct.metabolites.items()})
+            for rct in model.reactions if not rct.boundary]
+
+# Helper function for cache keys
+def stoichiometry_fingerprint(model):
+    """Return a hex digest of the internal reactions of model and their
+       stoichiometry. Independent of bounds, objective and reaction order,
+       and equal for a cobra.Model and its ModelSnapshot."""
+    digest = hashlib.sha1()
+    for rct_id, metabolites in sorted(_internal_reactions(model)):
+        digest.update(rct_id.encode())
+        for met, coef in sorted(metabolites.items()):
+            digest.update(f'|{met}:{coef!r}'.encode())
+        digest.update(b'\n')
+    return digest.hexdigest()
+
+def compute_internal_nullspace(model):
+    """
+    Compute the null space of the internal stoichiometric matrix of
+    model. The matrix is first reduced on its sparse structure: a
+    metabolite used by a single remaining reaction forces that reaction
+    to zero flux, so the reaction is dropped, repeatedly. The SVD is
+    only taken of the remaining core.
+
+    Parameters
+    ----------
+    model : cobra.Model or ModelSnapshot
+        Model to compute the null space of
+    """
+    rcts = _internal_reactions(model)
+    met_rcts = collections.defaultdict(set)
+    for j, (_, metabolites) in enumerate(rcts):
+        for met_id in metabolites:
+            met_rcts[met_id].add(j)
+
+    # Drop reactions that are the only user of a metabolite
+    removed = set()
+    queue = [met_id for met_id, users in met_rcts.items() if len(users) == 1]
+    while queue:
+        users = met_rcts[queue.pop()]
+        if len(users) != 1:
+            continue
+        j = users.pop()
+        removed.add(j)
+        for met_id in rcts[j][1]:
+            others = met_rcts[met_id]
+            others.discard(j)
+            if len(others) == 1:
+                queue.append(met_id)
+
+    core = [j for j in range(len(rcts)) if j not in removed]
+    met_index = {}
+    for j in core:
+        for met_id in rcts[j][1]:
+            met_index.setdefault(met_id, len(met_index))
+
+    s_core = np.zeros((len(met_index), len(core)))
+    for col, j in enumerate(core):
+        for met_id, coef in rcts[j][1].items():
+            s_core[met_index[met_id], col] = coef
+
+    basis = nullspace(s_core) if core else np.zeros((0, 0))
+    return InternalNullspace([rcts[j][0] for j in core], basis)
+
+def internal_nullspace(model, cache=None):
+    """
+    Return the InternalNullspace of model. Null spaces are kept in
+    memory and, if given, in cache by stoichiometry fingerprint, so
+    they are computed once per distinct stoichiometry.
+
+    Parameters
+    ----------
+    model : cobra.Model or ModelSnapshot
+        Model to get the null space of
+    cache : ModelCache
+        Optional on-disk cache, e.g. the one holding converted models
+    """
+    fingerprint = stoichiometry_fingerprint(model)
+    if fingerprint in _memory:
+        _memory.move_to_end(fingerprint)
+        return _memory[fingerprint]
+
+    result = None
+    if cache is not None:
+        key = cache.key('nullspace', fingerprint)
+        result = cache.get(key)
+    if result is None:
+        result = compute_internal_nullspace(model)
+        if cache is not None:
+            cache.put(key, result)
+
+    _memory[fingerprint] = result
+    if len(_memory) > MEMORY_SIZE:
+        _memory.popitem(last=False)
+    return result
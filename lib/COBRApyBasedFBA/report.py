@@ -35,7 +35,17 @@ round_format = lambda x: nan_format(round(x, 6))
 equation_format = lambda rct: round_float_str(rct.build_reaction_string(use_metabolite_names=True))
 
 # Helper function to determine reaction class
-def class_formater(rct_id, fva_sol):
+def class_formater(rct_id, fva_sol, blocked_reactions=(), approximate_reactions=()):
+    # Reactions found blocked before FVA need no tolerance check
+    if rct_id in blocked_reactions:
+        return 'blocked'
+    # Reactions FVA did not solve within its time budget
+    if np.isnan(fva_sol.minimum[rct_id]) or np.isnan(fva_sol.maximum[rct_id]):
+        return 'unsolved'
+    # Loopless ranges that may be narrower than the exact ones
+    if rct_id in approximate_reactions:
+        return 'approximate'
+
     min_zero = math.isclose(fva_sol.minimum[rct_id], 0, abs_tol=1e-07)
     max_zero = math.isclose(fva_sol.maximum[rct_id], 0, abs_tol=1e-07)
 
@@ -50,8 +60,11 @@ def class_formater(rct_id, fva_sol):
     return 'functional'
 
 # Helper function to format reaction/ex-reaction display data
-def reaction_formater(model, fba_sol, fva_sol, ex):
-    """ex specifies exchange reaction"""
+def reaction_formater(model, fba_sol, fva_sol, ex, blocked_reactions=(),
+                      approximate_reactions=()):
+    """ex specifies exchange reaction, blocked_reactions are the
+       reaction ids found blocked before FVA and approximate_reactions
+       those with an unconfirmed Loopless FVA extreme"""
     if fva_sol is None:
         return json.dumps([])
 
@@ -68,15 +81,17 @@ def reaction_formater(model, fba_sol, fva_sol, ex):
                         'flux': round_format(fba_sol.fluxes[rct_id]),
                         'min_flux': round_format(fva_sol.minimum[rct_id]),
                         'max_flux': round_format(fva_sol.maximum[rct_id]),
-                        'class': class_formater(rct_id, fva_sol),
+                        'class': class_formater(rct_id, fva_sol, blocked_reactions,
+                                                approximate_reactions),
                         'equation': equation_format(rct),
                         'name': missing_format(rct.name)}
                        for rct_id, rct in zip(rct_ids, rcts)])
 
-# Helper function for formatting model summary
-def model_summary(model):
+# Helper function for formatting model summary. Summarizes solution,
+# so the model is not solved again.
+def model_summary(model, solution):
 
-    df = model.summary().to_frame()
+    df = model.summary(solution=solution).to_frame()
 
     def rct_name(rct_id):
         if rct_id is np.nan:
@@ -115,18 +130,18 @@ def model_summary(model):
     return [row[1:] for row in df.itertuples()]
 
 # Helper function for formatting ATP summary
-def atp_summary_formatter(model):
-    """Returns list of ATP summary values if metabolites are found
-       or a message stating they could not be found. Also return a
-       bool specicifying whether or not summary exists."""
+def atp_summary_formatter(model, solution):
+    """Returns list of ATP summary values of solution if metabolites
+       are found or a message stating they could not be found. Also
+       return a bool specicifying whether or not summary exists."""
 
     # Select ATP metabolite
     if 'atp_c' in model.metabolites:
-        df = model.metabolites.atp_c.summary().to_frame()
+        df = model.metabolites.atp_c.summary(solution=solution).to_frame()
     elif 'ATP_c' in model.metabolites:
-        df = model.metabolites.ATP_c.summary().to_frame()
+        df = model.metabolites.ATP_c.summary(solution=solution).to_frame()
     elif 'cpd00002_c0' in model.metabolites:
-        df = model.metabolites.cpd00002_c0.summary().to_frame()
+        df = model.metabolites.cpd00002_c0.summary(solution=solution).to_frame()
     else:
         # Empty ATP summary
         msg = 'Could not find atp_c, ATP_c or cpd00002_c0 in metabolites. ' \
@@ -148,27 +163,43 @@ def atp_summary_formatter(model):
     return atp_summary, True
 
 # Helper function for formating essential genes
-def essential_genes_formatter(model, essential_genes):
-    if not essential_genes:
+def essential_genes_formatter(model, essential_genes, ko_growth):
+    if not ko_growth:
         return json.dumps([])
 
+    # Genes missing from ko_growth were not solved within the time budget
     return json.dumps([{'name': missing_format(gene.id),
-                        'essential': yes_no_format(gene in essential_genes)}
+                        'essential': yes_no_format(gene in essential_genes)
+                                     if gene.id in ko_growth else 'Unsolved',
+                        'growth': round_format(ko_growth.get(gene.id, math.nan))}
                       for gene in model.genes])
 
+# Helper function for formating synthetic lethal gene pairs
+def lethal_pairs_formatter(lethal_pairs):
+    return json.dumps([{'gene1': gene1, 'gene2': gene2, 'growth': round_format(growth)}
+                       for gene1, gene2, growth in lethal_pairs])
+
+# Call this function to compute the report data that depends only on the FBA solution
+def report_data(model, fba_sol):
+    """Return the model and ATP summaries of fba_sol as a dict."""
+    atp_summary, is_atp_summary = atp_summary_formatter(model, fba_sol)
+    return {'summary': model_summary(model, fba_sol),
+            'atp_summary': {'is_atp_summary': is_atp_summary, 'summary': atp_summary}}
+
 # Call this function to build the report
 def build_report(pipeline, model, fba_sol, fva_sol,
                  essential_genes, model_id, media_id):
-    """Build output report and return string of html."""
+    """Build output report and return string of html. Uses the
+       report data computed by the pipeline run if there is any."""
 
-    atp_summary, is_atp_summary = atp_summary_formatter(model)
+    data = pipeline.report_data or report_data(model, fba_sol)
 
     # Formating for objective value
     obj_value = round_format(fba_sol.fluxes[pipeline.target_reaction])
     obj_units = 'gm/gm CDW hr' if 'biomass' in pipeline.target_reaction else 'mmol/gm CDW hr'
 
-    context = {'summary':     model_summary(model),
-               'atp_summary': {'is_atp_summary': is_atp_summary, 'summary': atp_summary},
+    context = {'summary':     data['summary'],
+               'atp_summary': data['atp_summary'],
                'overview':    [{'name': 'Model',                    'value': model_id},
                                {'name': 'Media',                    'value': media_id},
                                {'name': 'Optimization status',      'value': fba_sol.status},
@@ -179,32 +210,74 @@ def build_report(pipeline, model, fba_sol, fva_sol,
                                {'name': 'FBA type',                 'value': pipeline.fba_type},
                                {'name': 'FVA type',                 'value': pipeline.fva_type},
                                {'name': 'FVA fraction of optimum',  'value': pipeline.fraction_of_optimum_fva},
+                               {'name': 'LPs solved',               'value': pipeline.lps},
+                               {'name': 'FVA LPs saved',            'value': pipeline.fva_lps_saved},
+                               {'name': 'FVA complete',             'value': yes_no_format(pipeline.fva_complete)},
+                               {'name': 'Approximate FVA ranges',   'value': len(pipeline.fva_approximate)},
+                               {'name': 'Blocked reactions',        'value': len(pipeline.blocked_reactions)},
                                {'name': 'All reversible reactions', 'value': yes_no_format(pipeline.is_all_reversible)},
                                {'name': 'Single gene KO',           'value': yes_no_format(pipeline.is_single_ko)},
+                               {'name': 'Single gene KO LPs saved', 'value': pipeline.ko_lps_saved},
+                               {'name': 'Single gene KO complete',  'value': yes_no_format(pipeline.ko_complete)},
+                               {'name': 'Double gene KO',           'value': yes_no_format(pipeline.is_double_ko)},
+                               {'name': 'Double gene KO LPs',       'value': pipeline.double_ko_lps},
+                               {'name': 'Double gene KO complete',  'value': yes_no_format(pipeline.double_ko_complete)},
                                {'name': 'Gene KO',                  'value': len(pipeline.feature_ko_list)},
                                {'name': 'Reaction KO',              'value': len(pipeline.reaction_ko_list)},
                                {'name': 'Custom bounds',            'value': len(pipeline.custom_bound_list)},
                                {'name': 'Media supplement',         'value': len(pipeline.media_supplement_list)},
-                               {'name': 'Solver',                   'value': pipeline.solver.upper()}
+                               {'name': 'Solver',                   'value': pipeline.solver.upper() +
+                                                                        (f' ({pipeline.solver_selection})' if pipeline.solver_selection else '')}
                                ],
                'reaction_tab': {
                    'is_reactions': fva_sol is not None,
-                   'reactions': reaction_formater(model, fba_sol, fva_sol, ex=False),
+                   'reactions': reaction_formater(model, fba_sol, fva_sol, ex=False,
+                                                  blocked_reactions=pipeline.blocked_reactions,
+                                                  approximate_reactions=pipeline.fva_approximate),
                    'help': 'Select FVA setting and rerun to produce results.'
                 },
                'ex_reaction_tab': {
                    'is_reactions': fva_sol is not None,
-                   'reactions': reaction_formater(model, fba_sol, fva_sol, ex=True),
+                   'reactions': reaction_formater(model, fba_sol, fva_sol, ex=True,
+                                                  blocked_reactions=pipeline.blocked_reactions,
+                                                  approximate_reactions=pipeline.fva_approximate),
                    'help': 'Select FVA setting and rerun to produce results.'
                 },
                 'essential_genes_tab': {
-                    'is_essential_genes': len(essential_genes) > 0,
-                    'essential_genes': essential_genes_formatter(model, essential_genes),
+                    'is_essential_genes': len(pipeline.ko_growth) > 0,
+                    'essential_genes': essential_genes_formatter(model, essential_genes,
+                                                                 pipeline.ko_growth),
                     'help': 'Select simulate all single KO to produce results.'
+                },
+                'lethal_pairs_tab': {
+                    'is_double_ko': pipeline.is_double_ko,
+                    'lethal_pairs': lethal_pairs_formatter(pipeline.lethal_pairs),
+                    'help': 'Select simulate double KO to produce results.'
                 }
            }
 
-    template_file = 'template.html'
+    return render_template('template.html', context)
+
+# Call this function to build the report of a batch run
+def build_batch_report(batch, model_id):
+    """Build output report of FBAPipeline.run_many results
+       and return string of html."""
+
+    conditions = [{'id': kbase_fba_obj['id'],
+                   'media': kbase_fba_obj['media_ref'],
+                   'status': fba_sol.status,
+                   'objective': round_format(fba_sol.fluxes[pipeline.target_reaction]),
+                   'fba_type': pipeline.fba_type,
+                   'gene_ko': len(pipeline.feature_ko_list),
+                   'reaction_ko': len(pipeline.reaction_ko_list),
+                   'custom_bounds': len(pipeline.custom_bound_list)}
+                  for pipeline, kbase_fba_obj, fba_sol in batch]
+
+    return render_template('batch_template.html', {'model_id': model_id,
+                                                   'conditions': conditions})
+
+# Helper function to render a template in this directory
+def render_template(template_file, context):
     # Directory this file is in
     template_dir = os.path.dirname(os.path.realpath(__file__))
 
@@ -0,0 +1,249 @@
+import json
+import struct
+import numpy as np
+import cobra
+
+# File layout: MAGIC, little endian uint64 header length, JSON header,
+# then every array starting at a multiple of ALIGN bytes.
+MAGIC = b'CFBASNP1'
+ALIGN = 64
+
+# String fields of reactions, metabolites and genes. Each is stored as
+# an int32 array of indices into one interned string table.
+REACTION_FIELDS = ('id', 'name', 'gpr', 'subsystem', 'notes', 'annotation')
+METABOLITE_FIELDS = ('id', 'name', 'formula', 'compartment', 'notes', 'annotation')
+GENE_FIELDS = ('id', 'name')
+
+
+class _StringTable:
+    """Interns strings, storing each distinct string once."""
+
+    def __init__(self):
+        self.index = {}
+
+    def add(self, s):
+        return self.index.setdefault(s or '', len(self.index))
+
+    def arrays(self):
+        encoded = [s.encode('utf-8') for s in self.index]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(b) for b in encoded])
+        return offsets, np.frombuffer(b''.join(encoded), dtype=np.uint8)
+
+# Helper function for JSON fields
+def _dumps(x):
+    return json.dumps(x, sort_keys=True) if x else ''
+
+def write_snapshot(model, path):
+    """
+    Write model to path, or to a binary file, in the snapshot format. Stoichiometry is
+    stored as a sparse CSC matrix with one column per reaction,
+    bounds and objective as float64 arrays, and all text as
+    interned string tables.
+
+    Parameters
+    ----------
+    model : cobra.Model
+        Model to write
+    path : str or file
+        Destination file name, or binary file open for writing at
+        its start
+    """
+    strings = _StringTable()
+    met_index = {met.id: i for i, met in enumerate(model.metabolites)}
+    objective = {rct.id: coef for rct, coef in
+                 cobra.util.solver.linear_reaction_coefficients(model).items()}
+
+    arrays = {}
+    indptr, indices, data = [0], [], []
+    for rct in model.reactions:
+        for met, coef in rct.metabolites.items():
+            indices.append(met_index[met.id])
+            data.append(coef)
+        indptr.append(len(indices))
+    arrays['S_indptr'] = np.array(indptr, dtype=np.int64)
+    arrays['S_indices'] = np.array(indices, dtype=np.int32)
+    arrays['S_data'] = np.array(data, dtype=np.float64)
+
+    arrays['lower_bound'] = np.array([r.lower_bound for r in model.reactions], dtype=np.float64)
+    arrays['upper_bound'] = np.array([r.upper_bound for r in model.reactions], dtype=np.float64)
+    arrays['objective'] = np.array([objective.get(r.id, 0.) for r in model.reactions],
+                                   dtype=np.float64)
+    arrays['met_charge'] = np.array([np.nan if m.charge is None else m.charge
+                                     for m in model.metabolites], dtype=np.float64)
+
+    rct_values = {'id': lambda r: r.id, 'name': lambda r: r.name,
+                  'gpr': lambda r: r.gene_reaction_rule,
+                  'subsystem': lambda r: r.subsystem,
+                  'notes': lambda r: _dumps(r.notes),
+                  'annotation': lambda r: _dumps(r.annotation)}
+    met_values = {'id': lambda m: m.id, 'name': lambda m: m.name,
+                  'formula': lambda m: m.formula,
+                  'compartment': lambda m: m.compartment,
+                  'notes': lambda m: _dumps(m.notes),
+                  'annotation': lambda m: _dumps(m.annotation)}
+    gene_values = {'id': lambda g: g.id, 'name': lambda g: g.name}
+
+    for prefix, objs, fields, values in (('rct', model.reactions, REACTION_FIELDS, rct_values),
+                                          ('met', model.metabolites, METABOLITE_FIELDS, met_values),
+                                          ('gene', model.genes, GENE_FIELDS, gene_values)):
+        for field in fields:
+            arrays[f'{prefix}_{field}'] = np.array([strings.add(values[field](x)) for x in objs],
+                                                   dtype=np.int32)
+
+    arrays['strings_offsets'], arrays['strings_data'] = strings.arrays()
+
+    meta = {'id': model.id,
+            'name': model.name,
+            'objective_direction': model.objective.direction,
+            'compartments': model.compartments}
+
+    # Lay out arrays after the header, each aligned to ALIGN bytes
+    header = {'meta': meta, 'arrays': {}}
+    offset = 0
+    for name, array in arrays.items():
+        header['arrays'][name] = [array.dtype.str, list(array.shape), offset]
+        offset += -(-array.nbytes // ALIGN) * ALIGN
+    header_bytes = json.dumps(header).encode('utf-8')
+    start = -(-(len(MAGIC) + 8 + len(header_bytes)) // ALIGN) * ALIGN
+
+    if isinstance(path, str):
+        with open(path, 'wb') as f:
+            _write(f, header_bytes, header, arrays, start, offset)
+    else:
+        _write(path, header_bytes, header, arrays, start, offset)
+
+# Helper function for write_snapshot
+def _write(f, header_bytes, header, arrays, start, size):
+    f.write(MAGIC)
+    f.write(struct.pack('<Q', len(header_bytes)))
+    f.write(header_bytes)
+    for name, array in arrays.items():
+        f.seek(start + header['arrays'][name][2])
+        f.write(np.ascontiguousarray(array).tobytes())
+    f.truncate(start + size)
+    f.seek(start + size)
+
+
+class ModelSnapshot:
+    """A model snapshot loaded with memory-mapping. Arrays are read
+       only views of the file and strings are decoded on first use.
+       Pickled by path, so a snapshot handed to a worker process maps
+       the same file again instead of copying its arrays."""
+
+    def __init__(self, path):
+        if isinstance(path, str):
+            with open(path, 'rb') as f:
+                header_len, header = self._read_header(f, path)
+        else:
+            header_len, header = self._read_header(path, path.name)
+            path = path.name
+        start = -(-(len(MAGIC) + 8 + header_len) // ALIGN) * ALIGN
+
+        # File the arrays are mapped from
+        self.path = path
+
+        self.meta = header['meta']
+        self.arrays = {}
+        buf = np.memmap(path, dtype=np.uint8, mode='r')
+        for name, (dtype, shape, offset) in header['arrays'].items():
+            dtype = np.dtype(dtype)
+            nbytes = int(np.prod(shape)) * dtype.itemsize
+            begin = start + offset
+            self.arrays[name] = buf[begin:begin + nbytes].view(dtype).reshape(shape)
+
+        self._strings = None
+
+    @staticmethod
+    def _read_header(f, name):
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f'{name} is not a model snapshot')
+        header_len, = struct.unpack('<Q', f.read(8))
+        return header_len, json.loads(f.read(header_len).decode('utf-8'))
+
+    def __reduce__(self):
+        return ModelSnapshot, (self.path,)
+
+    @property
+    def strings(self):
+        """Interned string table."""
+        if self._strings is None:
+            offsets = self.arrays['strings_offsets']
+            data = self.arrays['strings_data'].tobytes()
+            self._strings = [data[offsets[i]:offsets[i + 1]].decode('utf-8')
+                             for i in range(len(offsets) - 1)]
+        return self._strings
+
+    def field(self, name):
+        """Return the list of strings of field name, e.g. 'rct_id'."""
+        strings = self.strings
+        return [strings[i] for i in self.arrays[name]]
+
+    def stoichiometry(self):
+        """Return the stoichiometric matrix as a scipy.sparse.csc_matrix
+           with metabolites as rows and reactions as columns."""
+        from scipy.sparse import csc_matrix
+        a = self.arrays
+        return csc_matrix((a['S_data'], a['S_indices'], a['S_indptr']),
+                          shape=(len(a['met_id']), len(a['rct_id'])))
+
+    def to_model(self):
+        """Build a cobra.Model from the snapshot."""
+        a = self.arrays
+        loads = lambda s: json.loads(s) if s else {}
+
+        model = cobra.Model(self.meta['id'], name=self.meta['name'])
+        model.compartments = self.meta['compartments']
+
+        met_fields = {f: self.field('met_' + f) for f in METABOLITE_FIELDS}
+        mets = []
+        for i, met_id in enumerate(met_fields['id']):
+            charge = a['met_charge'][i]
+            met = cobra.Metabolite(met_id,
+                                   formula=met_fields['formula'][i] or None,
+                                   name=met_fields['name'][i],
+                                   compartment=met_fields['compartment'][i] or None,
+                                   charge=None if np.isnan(charge) else
+                                          int(charge) if charge.is_integer() else float(charge))
+            met.notes = loads(met_fields['notes'][i])
+            met.annotation = loads(met_fields['annotation'][i])
+            mets.append(met)
+        model.add_metabolites(mets)
+
+        rct_fields = {f: self.field('rct_' + f) for f in REACTION_FIELDS}
+        indptr, indices, data = a['S_indptr'], a['S_indices'], a['S_data']
+        rcts = []
+        for i, rct_id in enumerate(rct_fields['id']):
+            rct = cobra.Reaction(rct_id,
+                                 name=rct_fields['name'][i],
+                                 subsystem=rct_fields['subsystem'][i],
+                                 lower_bound=float(a['lower_bound'][i]),
+                                 upper_bound=float(a['upper_bound'][i]))
+            # Link metabolites directly, they are already in the model
+            rct._metabolites = {mets[j]: float(coef) for j, coef in
+                                zip(indices[indptr[i]:indptr[i + 1]],
+                                    data[indptr[i]:indptr[i + 1]])}
+            for met in rct._metabolites:
+                met._reaction.add(rct)
+            rct.gene_reaction_rule = rct_fields['gpr'][i]
+            rct.notes = loads(rct_fields['notes'][i])
+            rct.annotation = loads(rct_fields['annotation'][i])
+            rcts.append(rct)
+        model.add_reactions(rcts)
+
+        for gene_id, name in zip(self.field('gene_id'), self.field('gene_name')):
+            if gene_id in model.genes:
+                model.genes.get_by_id(gene_id).name = name
+
+        model.objective = {rct: float(coef) for rct, coef in zip(rcts, a['objective'])
+                           if coef != 0}
+        model.objective_direction = self.meta['objective_direction']
+        return model
+
+def load_snapshot(path):
+    """Load the snapshot at path with memory-mapping."""
+    return ModelSnapshot(path)
+
+def load_model(path):
+    """Load the snapshot at path as a cobra.Model."""
+    return ModelSnapshot(path).to_model()
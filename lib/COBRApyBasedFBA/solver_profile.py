@@ -0,0 +1,227 @@
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import cobra
+import optlang
+from COBRApyBasedFBA.highs import highspy
+
+# Persisted profile table, shipped with the module and refreshed by
+# running this module as a script
+PROFILE_PATH = os.path.join(os.path.dirname(__file__), 'solver_profile.json')
+
+# Solver used when the profile has no timings for an installed solver
+DEFAULT_SOLVER = 'glpk'
+
+# Solvers FBAPipeline supports, by optlang availability name
+SOLVERS = {'coinor_cbc': 'COINOR_CBC', 'glpk': 'GLPK', 'highs': None}
+
+# Upper bound on number of reactions of each model size class
+SIZE_CLASSES = (('small', 1000), ('medium', 5000), ('large', float('inf')))
+
+# fba_type and fva_type of each analysis type
+ANALYSES = {'FBA': ('FBA', 'Neither'),
+            'pFBA': ('pFBA', 'Neither'),
+            'FVA': ('FBA', 'FVA'),
+            'Loopless': ('Loopless FBA', 'Loopless FVA')}
+
+# Reference models used by benchmark, bundled with cobra or, named
+# <model>x<copies>, communities of copies of one, see community_model.
+# iJO1366x3 has about 7000 reactions, for the large size class.
+REFERENCE_MODELS = ('textbook', 'salmonella', 'iJO1366', 'iJO1366x3')
+
+def size_class(model):
+    """Return the size class of model by number of reactions."""
+    for name, max_reactions in SIZE_CLASSES:
+        if len(model.reactions) <= max_reactions:
+            return name
+
+def analysis_type(fba_type, fva_type):
+    """Return the analysis type, a key of ANALYSES, whose solver choice
+       applies to a run with fba_type and fva_type."""
+    if fba_type == 'Loopless FBA' or fva_type == 'Loopless FVA':
+        return 'Loopless'
+    if fva_type != 'Neither':
+        return 'FVA'
+    return 'pFBA' if fba_type == 'pFBA' else 'FBA'
+
+def installed_solvers():
+    """Return the solvers of SOLVERS installed here."""
+    return [solver for solver, name in SOLVERS.items()
+            if (highspy is not None if name is None else optlang.available_solvers.get(name))]
+
+
+class SolverProfile:
+    """Seconds taken by each solver on each model size class and analysis
+       type, stored as table[size_class][analysis][solver]."""
+
+    def __init__(self, table=None):
+        self.table = table or {}
+
+    @classmethod
+    def load(cls, path=PROFILE_PATH):
+        """Load the profile at path, empty if there is none."""
+        try:
+            with open(path) as f:
+                return cls(json.load(f))
+        except FileNotFoundError:
+            return cls()
+
+    def save(self, path=PROFILE_PATH):
+        with open(path, 'w') as f:
+            json.dump(self.table, f, indent=2, sort_keys=True)
+
+    def record(self, size, analysis, solver, seconds):
+        self.table.setdefault(size, {}).setdefault(analysis, {})[solver] = seconds
+
+    def choose(self, size, analysis, solvers=None):
+        """
+        Return the fastest of solvers, by default the installed ones, for
+        a model of size class size and analysis type analysis. Only
+        solvers with timings are chosen, so an installed solver missing
+        from the profile is never picked. Size classes without timings
+        use those of the nearest size class with timings. Falls back to
+        DEFAULT_SOLVER if no candidate has timings.
+
+        Parameters
+        ----------
+        size : str
+            Size class, see size_class
+        analysis : str
+            Analysis type, see analysis_type
+        solvers : list
+            Candidate solvers
+        """
+        solvers = installed_solvers() if solvers is None else solvers
+        names = [name for name, _ in SIZE_CLASSES]
+        # Size classes ordered by distance from size
+        for name in sorted(names, key=lambda name: abs(names.index(name) - names.index(size))):
+            timings = {solver: seconds for solver, seconds in
+                       self.table.get(name, {}).get(analysis, {}).items() if solver in solvers}
+            if timings:
+                return min(timings, key=timings.get)
+        return DEFAULT_SOLVER if DEFAULT_SOLVER in solvers else solvers[0]
+
+def community_model(model, copies):
+    """
+    Return a community of copies of model sharing its extracellular
+    compartment 'e'. Reactions and metabolites of each copy get the
+    suffix _<copy>, except reactions only on extracellular metabolites,
+    e.g. exchanges, which are shared. The objective is the sum of the
+    objectives of the copies.
+
+    Parameters
+    ----------
+    model : cobra.Model
+        Model to copy
+    copies : int
+        Number of copies
+    """
+    community = cobra.Model(f'{model.id}x{copies}')
+    shared = {met.id: met.copy() for met in model.metabolites if met.compartment == 'e'}
+    objective = cobra.util.solver.linear_reaction_coefficients(model)
+
+    reactions, objective_coefs = [], {}
+    for k in range(copies):
+        mets = dict(shared)
+        for met in model.metabolites:
+            if met.id not in shared:
+                mets[met.id] = cobra.Metabolite(f'{met.id}_{k}', formula=met.formula,
+                                                name=met.name, charge=met.charge,
+                                                compartment=met.compartment)
+        for rct in model.reactions:
+            is_shared = all(met.id in shared for met in rct.metabolites)
+            if is_shared and k:
+                continue
+            new = cobra.Reaction(rct.id if is_shared else f'{rct.id}_{k}', name=rct.name,
+                                 lower_bound=rct.lower_bound, upper_bound=rct.upper_bound)
+            new.add_metabolites({mets[met.id]: coef for met, coef in rct.metabolites.items()})
+            new.gene_reaction_rule = rct.gene_reaction_rule
+            reactions.append(new)
+            if rct in objective:
+                objective_coefs[new] = objective[rct]
+    community.add_reactions(reactions)
+    community.objective = objective_coefs
+    return community
+
+def reference_model(name):
+    """Load a model bundled with cobra by name, or the community_model
+       of such a model for names of the form <model>x<copies>."""
+    match = re.fullmatch(r'(.+)x(\d+)', name)
+    if match:
+        return community_model(reference_model(match.group(1)), int(match.group(2)))
+    try:
+        from cobra.io import load_model
+        return load_model(name)
+    except ImportError:
+        # Older cobra releases bundle models as test data
+        from cobra.test import create_test_model
+        return create_test_model({'iJO1366': 'ecoli'}.get(name, name))
+
+def benchmark(models, solvers=None, analyses=ANALYSES, profile=None):
+    """
+    Time each solver on each model and analysis type with FBAPipeline
+    and record the mean seconds taken over the models of each size
+    class in profile. Returns the profile.
+
+    Parameters
+    ----------
+    models : list
+        cobra models to time
+    solvers : list
+        Solvers to time, by default all installed ones
+    analyses : iterable
+        Analysis types to time, keys of ANALYSES
+    profile : SolverProfile
+        Profile to update, a new one by default
+    """
+    from COBRApyBasedFBA.fba_pipeline import FBAPipeline
+
+    solvers = installed_solvers() if solvers is None else solvers
+    profile = profile or SolverProfile()
+    timings = {}
+    for model in models:
+        size = size_class(model)
+        for analysis in analyses:
+            for solver in solvers:
+                pipeline = FBAPipeline()
+                pipeline.solver = solver
+                pipeline.fba_type, pipeline.fva_type = ANALYSES[analysis]
+                copy = model.copy()
+
+                start = time.perf_counter()
+                pipeline.configure_solver(copy)
+                fba_sol = pipeline.run_fba(copy)
+                if pipeline.fva_type != 'Neither':
+                    pipeline.run_fva(copy, fba_sol)
+                seconds = time.perf_counter() - start
+
+                timings.setdefault((size, analysis, solver), []).append(seconds)
+                print(f'{model.id}\t{size}\t{analysis}\t{solver}\t{seconds:.3f}', flush=True)
+
+    for (size, analysis, solver), seconds in timings.items():
+        profile.record(size, analysis, solver, round(sum(seconds) / len(seconds), 4))
+    return profile
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Time every installed solver on reference models and '
+                    'update the profile used by the auto solver.')
+    parser.add_argument('--models', nargs='+', default=REFERENCE_MODELS,
+                        help='names of models bundled with cobra or communities of '
+                             'them, see reference_model, or paths to SBML files')
+    parser.add_argument('--solvers', nargs='+', default=None,
+                        help='solvers to time, default all installed ones')
+    parser.add_argument('--analyses', nargs='+', default=list(ANALYSES), choices=list(ANALYSES))
+    parser.add_argument('--output', default=PROFILE_PATH, help='profile to update')
+    args = parser.parse_args(argv)
+
+    models = [cobra.io.read_sbml_model(name) if os.path.exists(name) else reference_model(name)
+              for name in args.models]
+    profile = benchmark(models, args.solvers, args.analyses, SolverProfile.load(args.output))
+    profile.save(args.output)
+
+if __name__ == '__main__':
+    sys.exit(main())
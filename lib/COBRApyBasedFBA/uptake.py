@@ -0,0 +1,116 @@
+import weakref
+import functools
+import numpy as np
+from optlang.symbolics import Zero
+from cobra.util.context import get_context
+from cobrakbase.modelseed.utils import atom_count
+
+# UptakeConstraints of each model, dropped with the model
+_cache = weakref.WeakKeyDictionary()
+
+# Helper function for constraint bounds
+def _set_constraint_bounds(constraint, lb, ub):
+    # Free the row first so the new bounds never cross the old ones
+    constraint.lb = None
+    constraint.ub = ub
+    constraint.lb = lb
+
+
+class UptakeConstraints:
+    """Atom uptake limits on the exchange reactions of a model. Atom
+       counts of every exchange compound are computed once into an
+       exchange by atom matrix. Each atom has one named constraint on
+       the uptake (reverse) variables of exchanges in the medium. It is
+       added to the solver once and only its changed coefficients and
+       its bounds are updated on later runs."""
+
+    # Prefix of the constraint names, followed by the atom
+    PREFIX = 'max_uptake_'
+
+    def __init__(self, model, atoms):
+        self.atoms = tuple(atoms)
+
+        # Number of reactions of model when built, to detect edits
+        self.num_reactions = len(model.reactions)
+
+        exchanges = model.exchanges
+        self.indices = np.array([model.reactions.index(rct) for rct in exchanges], dtype=int)
+        self.reverse_ids = [rct.reverse_id for rct in exchanges]
+        self.has_products = np.array([bool(rct.products) for rct in exchanges], dtype=bool)
+        self.has_reactants = np.array([bool(rct.reactants) for rct in exchanges], dtype=bool)
+
+        # Count of each atom in the compound of each exchange
+        self.counts = np.zeros((len(exchanges), len(self.atoms)))
+        for i, rct in enumerate(exchanges):
+            compound = next(iter(rct.metabolites), None)
+            if compound is None or not compound.formula:
+                continue
+            cmp_atoms = atom_count(compound.formula)
+            for j, atom in enumerate(self.atoms):
+                self.counts[i, j] = cmp_atoms.get(atom) or 0
+
+        # Coefficients last set in the constraint of each atom
+        self.coefficients = {}
+
+    def medium(self, model):
+        """Return a boolean array over exchanges, True for those in
+           model.medium given the current bounds."""
+        reactions = model.reactions
+        lower = np.array([reactions[i]._lower_bound for i in self.indices.tolist()], dtype=float)
+        upper = np.array([reactions[i]._upper_bound for i in self.indices.tolist()], dtype=float)
+        return (self.has_products & (upper > 0)) | (self.has_reactants & (lower < 0))
+
+    def apply(self, model, max_uptakes, medium):
+        """
+        Limit the uptake of each atom to max_uptakes[atom] over the
+        exchanges in medium, or remove the limit if it is None. Bound
+        changes are rolled back with the model context, leaving the
+        constraint free, while the constraint itself stays in the solver.
+
+        Parameters
+        ----------
+        model : cobra.Model
+            Model to constrain
+        max_uptakes : dict
+            Maps atom to its max uptake or None
+        medium : numpy.ndarray
+            Boolean array over exchanges, as returned by medium
+        """
+        context = get_context(model)
+        for j, atom in enumerate(self.atoms):
+            name = self.PREFIX + atom
+            max_uptake = max_uptakes.get(atom)
+            if name not in model.constraints:
+                if max_uptake is None:
+                    continue
+                # Free constraint added outside any model context
+                model.solver.add(model.problem.Constraint(Zero, name=name))
+                model.solver.update()
+                self.coefficients.pop(atom, None)
+            constraint = model.constraints[name]
+
+            if max_uptake is not None:
+                coefs = np.where(medium, self.counts[:, j], 0.)
+                old = self.coefficients.get(atom)
+                changed = (range(len(coefs)) if old is None
+                           else np.flatnonzero(coefs != old).tolist())
+                variables = model.solver.variables
+                constraint.set_linear_coefficients({variables[self.reverse_ids[k]]: coefs[k]
+                                                    for k in changed})
+                self.coefficients[atom] = coefs
+
+            bounds = (None, None) if max_uptake is None else (0, max_uptake)
+            if (constraint.lb, constraint.ub) != bounds:
+                if context:
+                    context(functools.partial(_set_constraint_bounds, constraint,
+                                              constraint.lb, constraint.ub))
+                _set_constraint_bounds(constraint, *bounds)
+
+def uptake_constraints(model, atoms):
+    """Return the UptakeConstraints of model for atoms, built on first
+       use and rebuilt if reactions were added or removed."""
+    uptakes = _cache.get(model)
+    if (uptakes is None or uptakes.atoms != tuple(atoms)
+            or uptakes.num_reactions != len(model.reactions)):
+        uptakes = _cache[model] = UptakeConstraints(model, atoms)
+    return uptakes
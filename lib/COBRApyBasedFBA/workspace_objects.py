@@ -0,0 +1,134 @@
+import json
+import random
+import contextlib
+import collections
+from installed_clients.WorkspaceClient import Workspace
+from installed_clients.baseclient import ServerError
+
+# ijson prefix of the object data in the response streamed by open_object
+OBJECT_DATA_PREFIX = 'result.item.data.item.data'
+
+# Fields of a workspace object_info tuple used by the Impl
+ObjectInfo = collections.namedtuple('ObjectInfo', ['id', 'name', 'type', 'version',
+                                                   'workspace_id', 'size'])
+
+# Helper function for object_info tuples
+def object_info(info):
+    return ObjectInfo(info[0], info[1], info[2], info[4], info[6], info[9])
+
+# Helper function to check for a wsid/objid/version reference, the only
+# form of reference that always refers to the same object data
+def is_versioned(ref):
+    parts = ref.split('/')
+    return len(parts) == 3 and all(part.isdigit() for part in parts)
+
+
+class WorkspaceObjects:
+    """Access to workspace objects. Any number of objects, whole or
+       limited to included paths, are resolved and downloaded together
+       in a single get_objects2 call, i.e. one round trip. With a cache,
+       objects are first looked up there by versioned reference and only
+       the missing ones are downloaded."""
+
+    def __init__(self, url, token, cache=None):
+        self.ws = Workspace(url, token=token)
+        # ObjectCache of object data by versioned reference or None
+        self.cache = cache
+
+    def resolve(self, refs):
+        """Return refs as wsid/objid/version references. Any other refs are
+           resolved to the current version in a single get_object_info3
+           call."""
+        return [ref for ref, _ in self.resolve_infos(refs)]
+
+    def resolve_infos(self, refs):
+        """Return (versioned_ref, info) of each ref in refs as resolve,
+           where info is the ObjectInfo of the refs it looked up and None
+           for refs that were versioned already."""
+        unversioned = [ref for ref in refs if not is_versioned(ref)]
+        if not unversioned:
+            return [(ref, None) for ref in refs]
+        infos = self.ws.get_object_info3(
+            {'objects': [{'ref': ref} for ref in unversioned]})['infos']
+        resolved = {ref: (f'{info[6]}/{info[0]}/{info[4]}', object_info(info))
+                    for ref, info in zip(unversioned, infos)}
+        return [resolved.get(ref, (ref, None)) for ref in refs]
+
+    def cacheable(self, info):
+        """Return whether the object of info fits in the cache, i.e. a
+           cache is set and the object is no larger than its bound."""
+        return self.cache is not None and info.size <= self.cache.max_bytes
+
+    def get_objects(self, specs):
+        """
+        Return a list of (data, info) for each object in specs, where
+        info is an ObjectInfo whose version is the resolved version.
+
+        Parameters
+        ----------
+        specs : list
+            Workspace ObjectSpecification dicts, e.g. {'ref': '1/2'} or
+            {'ref': '1/2', 'included': ['/genome_ref']} for a subset
+        """
+        if self.cache is None:
+            return [(data, object_info(info)) for data, info in self._download(specs)]
+
+        refs = self.resolve([spec['ref'] for spec in specs])
+        keys = [self.cache.key(ref, *spec.get('included', ())) for ref, spec in zip(refs, specs)]
+        objects = [self.cache.get(key) for key in keys]
+
+        # Download cache misses by their resolved reference
+        missing = [i for i, obj in enumerate(objects) if obj is None]
+        if missing:
+            downloaded = self._download([dict(specs[i], ref=refs[i]) for i in missing])
+            for i, obj in zip(missing, downloaded):
+                objects[i] = obj
+                # An entry past the bound would only evict all others
+                if self.cacheable(object_info(obj[1])):
+                    self.cache.put(keys[i], obj)
+
+        return [(data, object_info(info)) for data, info in objects]
+
+    @contextlib.contextmanager
+    def open_object(self, ref, included=None):
+        """Context manager giving the get_objects2 response for the object
+           at ref as a binary file, read from the connection as it is
+           parsed. The object data is at OBJECT_DATA_PREFIX. Not cached,
+           meant for objects that are not cacheable."""
+        spec = {'ref': ref}
+        if included is not None:
+            spec['included'] = included
+        client = self.ws._client
+        body = json.dumps({'method': 'Workspace.get_objects2',
+                           'params': [{'objects': [spec]}],
+                           'version': '1.1',
+                           'id': str(random.random())[2:]})
+        response = client.session.post(client.url, data=body, headers=client._headers,
+                                       timeout=client.timeout,
+                                       verify=not client.trust_all_ssl_certificates,
+                                       stream=True)
+        try:
+            # Errors are raised as by the workspace client
+            if response.status_code == 500:
+                if response.headers.get('content-type') == 'application/json':
+                    error = response.json()
+                    if 'error' in error:
+                        raise ServerError(**error['error'])
+                raise ServerError('Unknown', 0, response.text)
+            response.raise_for_status()
+
+            response.raw.decode_content = True
+            yield response.raw
+        finally:
+            response.close()
+
+    def _download(self, specs):
+        objects = self.ws.get_objects2({'objects': specs})['data']
+        return [(obj['data'], obj['info']) for obj in objects]
+
+    def get_object(self, ref, included=None):
+        """Return (data, info) of the object at ref."""
+        spec = {'ref': ref}
+        if included is not None:
+            spec['included'] = included
+        return self.get_objects([spec])[0]
@@ -12,6 +12,7 @@ import requests as _requests
 import random as _random
 import os as _os
 import traceback as _traceback
+import threading as _threading
 from requests.exceptions import ConnectionError
 from urllib3.exceptions import ProtocolError
 
@@ -31,6 +32,31 @@ _AJ = 'application/json'
 _URL_SCHEME = frozenset(['http', 'https'])
 _CHECK_JOB_RETRYS = 3
 
+# Defaults for clients created without pool_size or keep_alive
+POOL_SIZE = 10
+KEEP_ALIVE = True
+
+# Shared sessions by (process id, pool size). Forked processes get their
+# own, since pooled connections can't be shared across processes.
+_sessions = {}
+_sessions_lock = _threading.Lock()
+
+
+def _get_session(pool_size):
+    # Sessions, like their connection pools, are safe to share between
+    # threads for plain requests such as these
+    key = (_os.getpid(), pool_size)
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is None:
+            session = _requests.Session()
+            adapter = _requests.adapters.HTTPAdapter(pool_connections=pool_size,
+                                                     pool_maxsize=pool_size)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _sessions[key] = session
+        return session
+
 
 def _get_token(user_id, password, auth_svc):
     # This is bandaid helper function until we get a full
@@ -120,6 +146,11 @@ class BaseClient(object):
     lookup_url - set to true when contacting KBase dynamic services.
     async_job_check_time_ms - the wait time between checking job state for
         asynchronous jobs run with the run_job method.
+    pool_size - the number of connections kept open to each host by the
+        session shared with other clients of the same pool size. Default
+        POOL_SIZE.
+    keep_alive - if False, close the connection after each call. Default
+        KEEP_ALIVE.
     '''
     def __init__(
             self, url=None, timeout=30 * 60, user_id=None,
@@ -129,7 +160,9 @@ class BaseClient(object):
             lookup_url=False,
             async_job_check_time_ms=100,
             async_job_check_time_scale_percent=150,
-            async_job_check_max_time_ms=300000):
+            async_job_check_max_time_ms=300000,
+            pool_size=None,
+            keep_alive=None):
         if url is None:
             raise ValueError('A url is required')
         scheme, _, _, _, _, _ = _urlparse(url)
@@ -163,6 +196,15 @@ class BaseClient(object):
                         authdata['user_id'], authdata['password'], auth_svc)
         if self.timeout < 1:
             raise ValueError('Timeout value must be at least 1 second')
+        self.pool_size = POOL_SIZE if pool_size is None else int(pool_size)
+        if self.pool_size < 1:
+            raise ValueError('Pool size must be at least 1')
+        if not (KEEP_ALIVE if keep_alive is None else keep_alive):
+            self._headers['Connection'] = 'close'
+
+    @property
+    def session(self):
+        return _get_session(self.pool_size)
 
     def _call(self, url, method, params, context=None):
         arg_hash = {'method': method,
@@ -176,9 +218,9 @@ class BaseClient(object):
             arg_hash['context'] = context
 
         body = _json.dumps(arg_hash, cls=_JSONObjectEncoder)
-        ret = _requests.post(url, data=body, headers=self._headers,
-                             timeout=self.timeout,
-                             verify=not self.trust_all_ssl_certificates)
+        ret = self.session.post(url, data=body, headers=self._headers,
+                                timeout=self.timeout,
+                                verify=not self.trust_all_ssl_certificates)
         ret.encoding = 'utf-8'
         if ret.status_code == 500:
             if ret.headers.get(_CT) == _AJ:
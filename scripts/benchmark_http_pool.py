@@ -0,0 +1,95 @@
+"""Time service calls through installed_clients.baseclient against a local
+stand-in JSON-RPC server, with and without the shared keep-alive session.
+
+Usage: python scripts/benchmark_http_pool.py [--calls N] [--threads N] [--handshake-ms MS]
+
+Run from the repository root. The server waits handshake-ms on each new
+connection to stand in for the TCP and TLS handshakes with a remote service.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+from installed_clients.baseclient import BaseClient
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Send headers and body without waiting for acks, as real servers do
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        # Each new connection pays the handshake latency once
+        time.sleep(self.server.handshake_seconds)
+        super().setup()
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        body = json.dumps({'version': '1.1', 'id': request['id'],
+                           'result': [{'method': request['method']}]}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if self.close_connection:
+            self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class StandInServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    handshake_seconds = 0.
+
+
+class PostPerCallClient(BaseClient):
+    """BaseClient calling requests.post on every call, as before the
+       shared session, for comparison."""
+
+    @property
+    def session(self):
+        return requests
+
+
+def run(client, calls, threads):
+    """Return seconds taken for calls service calls on threads threads."""
+    start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as executor:
+        list(executor.map(lambda _: client.call_method('StandIn.ping', [{}]), range(calls)))
+    return time.perf_counter() - start
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--calls', type=int, default=500)
+    parser.add_argument('--threads', type=int, default=1)
+    parser.add_argument('--handshake-ms', type=float, default=5.)
+    args = parser.parse_args(argv)
+
+    server = StandInServer(('127.0.0.1', 0), StandInHandler)
+    server.handshake_seconds = args.handshake_ms / 1000
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_port}'
+
+    clients = {'requests.post per call': PostPerCallClient(url, token='x', ignore_authrc=True),
+               'shared session, no keep-alive': BaseClient(url, token='x', ignore_authrc=True,
+                                                           keep_alive=False),
+               'shared session, keep-alive': BaseClient(url, token='x', ignore_authrc=True,
+                                                        pool_size=max(args.threads, 1))}
+    print(f'{args.calls} calls on {args.threads} threads, {args.handshake_ms} ms per handshake')
+    for name, client in clients.items():
+        seconds = run(client, args.calls, args.threads)
+        print(f'{name:32}{seconds:8.3f} s{1000 * seconds / args.calls:8.2f} ms/call', flush=True)
+    server.shutdown()
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -17,6 +17,9 @@ elif [ "${1}" = "async" ] ; then
   sh ./scripts/run_async.sh
 elif [ "${1}" = "init" ] ; then
   echo "Initialize module"
+elif [ "${1}" = "benchmark" ] ; then
+  echo "Benchmark solvers"
+  PYTHONPATH=./lib python -m COBRApyBasedFBA.solver_profile "${@:2}"
 elif [ "${1}" = "bash" ] ; then
   bash
 elif [ "${1}" = "report" ] ; then
@@ -147,3 +147,39 @@ class COBRApyBasedFBATest(unittest.TestCase):
             'default_max_uptake': 0.
         }
         self.serviceImpl.run_fba_pipeline(self.ctx, params)
+
+    def test_run_fba_pipeline_batch(self):
+        base_params = {
+            'solver': 'coinor_cbc',
+            'fraction_of_optimum_fva': 0.1,
+            'fraction_of_optimum_pfba': 1.0,
+            'minimize_objective': 0,
+            'all_reversible': 0,
+            'workspace': 'abrace05:narrative_1594056508275',
+            'fbamodel_id': '44773/6/1',
+            'media_id': '44773/2/1',
+            'target_reaction': 'bio1',
+            'fba_output_id': 'FBA_test_result',
+            'fba_type': 'pFBA',
+            'fva_type': 'Neither',
+            'simulate_ko': 0,
+            'feature_ko_list': '',
+            'reaction_ko_list': '',
+            'custom_bound_list': [],
+            'media_supplement_list': '',
+            'max_c_uptake': 0.,
+            'max_n_uptake': 0.,
+            'max_p_uptake': 0.,
+            'max_s_uptake': 0.,
+            'max_o_uptake': 0.,
+            'default_max_uptake': 0.
+        }
+        params = {
+            'params': base_params,
+            'conditions': [
+                {'fba_output_id': 'FBA_test_batch_wt'},
+                {'fba_output_id': 'FBA_test_batch_ko', 'feature_ko_list': ['b0001']}
+            ]
+        }
+        ret = self.serviceImpl.run_fba_pipeline_batch(self.ctx, params)[0]
+        self.assertEqual(len(ret['new_fba_refs']), 2)
@@ -0,0 +1,674 @@
+# -*- coding: utf-8 -*-
+import io
+import os
+import json
+import pickle
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+from cobra.exceptions import OptimizationError
+from cobra.io import load_model
+from cobra.util.array import create_stoichiometric_matrix, nullspace
+from cobra.util.solver import linear_reaction_coefficients
+from cobrakbase.core.kbasebiochemmedia import KBaseBiochemMedia
+from cobrakbase.modelseed.utils import atom_count
+from cobra.flux_analysis import (add_loopless, double_gene_deletion, find_blocked_reactions,
+                                 find_essential_genes, flux_variability_analysis,
+                                 loopless_solution, single_gene_deletion)
+
+from COBRApyBasedFBA import fba_pipeline
+from COBRApyBasedFBA.fba_pipeline import FBAPipeline
+from COBRApyBasedFBA import nullspace as internal
+from COBRApyBasedFBA import report
+from COBRApyBasedFBA.gpr import CompiledGPR
+from COBRApyBasedFBA.fbamodel import (FBAMODEL_PATHS, StreamedFBAModel, build_model,
+                                      select_paths, stream_model)
+from COBRApyBasedFBA.workspace_objects import OBJECT_DATA_PREFIX
+from COBRApyBasedFBA.model_cache import ModelCache, SnapshotCache
+from COBRApyBasedFBA.uptake import UptakeConstraints
+from COBRApyBasedFBA.solver_profile import SolverProfile, community_model, size_class
+
+
+class FBAPipelineTest(unittest.TestCase):
+    """Offline checks of FBAPipeline analyses against cobra on the
+       textbook model bundled with cobra."""
+
+    # Absolute difference allowed between fluxes and objective values
+    TOLERANCE = 1e-6
+
+    # FBAModel object data of the textbook model as the workspace returns
+    # it, with biomass, compartments, aliases and gapfilling data
+    FBAMODEL_JSON = os.path.join(os.path.dirname(__file__), 'data', 'textbook_fbamodel.json')
+
+    @classmethod
+    def setUpClass(cls):
+        cls.textbook = load_model('textbook')
+
+    def model(self, solver='glpk'):
+        model = self.textbook.copy()
+        model.solver = solver
+        return model
+
+    @staticmethod
+    def pipeline(**attributes):
+        pipeline = FBAPipeline()
+        pipeline.solver = 'glpk'
+        pipeline.fba_type = 'FBA'
+        pipeline.fva_processes = 1
+        pipeline.ko_processes = 1
+        for name, value in attributes.items():
+            setattr(pipeline, name, value)
+        return pipeline
+
+    def assertModelsEqual(self, model, expected):
+        self.assertEqual(model.id, expected.id)
+        self.assertEqual([met.id for met in model.metabolites],
+                         [met.id for met in expected.metabolites])
+        for met in model.metabolites:
+            other = expected.metabolites.get_by_id(met.id)
+            self.assertEqual((met.name, met.formula, met.charge, met.compartment),
+                             (other.name, other.formula, other.charge, other.compartment))
+        self.assertEqual([rct.id for rct in model.reactions],
+                         [rct.id for rct in expected.reactions])
+        for rct in model.reactions:
+            other = expected.reactions.get_by_id(rct.id)
+            self.assertEqual((rct.name, rct.bounds, rct.gene_reaction_rule),
+                             (other.name, other.bounds, other.gene_reaction_rule))
+            self.assertEqual({met.id: coef for met, coef in rct.metabolites.items()},
+                             {met.id: coef for met, coef in other.metabolites.items()})
+            self.assertEqual(rct.annotation, other.annotation)
+        self.assertEqual(str(model.objective.expression), str(expected.objective.expression))
+
+    def assertRangesEqual(self, fva_sol, expected):
+        expected = expected.loc[fva_sol.index]
+        diff = (fva_sol - expected).abs().max(axis=1)
+        mismatched = diff[diff > self.TOLERANCE].index
+        self.assertFalse(len(mismatched), pd.concat([fva_sol.loc[mismatched],
+                                                     expected.loc[mismatched]], axis=1))
+
+    def run_fva(self, pipeline, model):
+        fba_sol = pipeline.run_fba(model)
+        return pipeline.run_fva(model, fba_sol)
+
+    def run_pipeline(self, pipeline, model):
+        """Run pipeline on model in Complete media. The FBA object builder
+           expects the KBase biomass id, and the report summaries an older
+           cobra, so they are left out."""
+        model.reactions.Biomass_Ecoli_core.id = 'bio1_biomass'
+        model.repair()
+        pipeline.target_reaction = 'bio1_biomass'
+        media = KBaseBiochemMedia({'id': 'Complete', 'name': 'Complete', 'mediacompounds': []})
+        with mock.patch.object(fba_pipeline, 'report_data', return_value={}):
+            return pipeline.run(model, media)
+
+    def test_fva(self):
+        for fraction in (0.1, 1.0):
+            for processes in (1, 2):
+                model = self.model()
+                pipeline = self.pipeline(fraction_of_optimum_fva=fraction,
+                                         fva_processes=processes, is_fva_pruning=False)
+                fva_sol = self.run_fva(pipeline, model)
+                self.assertTrue(pipeline.fva_complete)
+                self.assertRangesEqual(fva_sol, flux_variability_analysis(
+                    model, fraction_of_optimum=fraction, processes=1))
+
+    def test_fva_pruning(self):
+        for fraction in (0.1, 1.0):
+            for processes in (1, 2):
+                model = self.model()
+                pipeline = self.pipeline(fraction_of_optimum_fva=fraction,
+                                         fva_processes=processes, is_fva_pruning=True)
+                fva_sol = self.run_fva(pipeline, model)
+                self.assertTrue(pipeline.fva_complete)
+                self.assertRangesEqual(fva_sol, flux_variability_analysis(
+                    model, fraction_of_optimum=fraction, processes=1))
+                self.assertGreater(pipeline.fva_lps_saved, 0)
+
+    def test_loopless_fva(self):
+        # The exact loopless ranges are those of FVA with every loop
+        # excluded by cobra's MILP constraints
+        for all_reversible in (False, True):
+            for fraction in (0.1, 1.0):
+                model = self.model()
+                pipeline = self.pipeline(fva_type='Loopless FVA', fraction_of_optimum_fva=fraction,
+                                         is_all_reversible=all_reversible)
+                if all_reversible:
+                    pipeline.set_bounds(model, np.arange(len(model.reactions)),
+                                        -pipeline.MAX_BOUND, pipeline.MAX_BOUND)
+                reference = model.copy()
+                add_loopless(reference, method='original')
+                expected = flux_variability_analysis(reference, fraction_of_optimum=fraction,
+                                                     processes=1)
+                for processes in (1, 2):
+                    with model:
+                        pipeline.fva_processes = processes
+                        fva_sol = self.run_fva(pipeline, model)
+                    self.assertTrue(pipeline.fva_complete)
+                    self.assertRangesEqual(fva_sol, expected)
+
+    def test_loopless_fva_approximate(self):
+        # Without MILPs, extremes loop removal can not confirm are only
+        # loopless, and every reaction with one is flagged
+        settings = {'fva_type': 'Loopless FVA', 'fraction_of_optimum_fva': 0.1,
+                    'is_all_reversible': True, 'LOOPLESS_MILP_MAX_REACTIONS': 0}
+        model = self.model()
+        pipeline = self.pipeline(**settings)
+        pipeline.set_bounds(model, np.arange(len(model.reactions)),
+                            -pipeline.MAX_BOUND, pipeline.MAX_BOUND)
+        reference = model.copy()
+        add_loopless(reference, method='original')
+        expected = flux_variability_analysis(reference, fraction_of_optimum=0.1, processes=1)
+        fva_sol = self.run_fva(pipeline, model)
+        diff = (fva_sol - expected.loc[fva_sol.index]).abs().max(axis=1)
+        mismatched = set(diff[diff > self.TOLERANCE].index)
+        self.assertTrue(mismatched)
+        self.assertLessEqual(mismatched, pipeline.fva_approximate)
+        self.assertGreater(pipeline.fva_lps_saved, 0)
+
+        # A MILP is not solved past its deadline
+        state = fba_pipeline._WorkerState(model)
+        self.assertIsNone(fba_pipeline._loopless_milp_value(state, 0, 'max', [0],
+                                                            time.monotonic()))
+        self.assertIsNone(state.fva_milp)
+
+        # Flagged in the report and the saved object
+        pipeline = self.pipeline(**settings)
+        kbase_fba_obj, fva_sol, _, _ = self.run_pipeline(pipeline, self.model())
+        self.assertTrue(pipeline.fva_approximate)
+        self.assertEqual(set(kbase_fba_obj['parameters']['Approximate FVA reactions'].split(',')),
+                         pipeline.fva_approximate)
+        self.assertEqual({report.class_formater(rct_id, fva_sol, pipeline.blocked_reactions,
+                                                pipeline.fva_approximate)
+                          for rct_id in pipeline.fva_approximate}, {'approximate'})
+
+    def test_internal_nullspace(self):
+        model = self.model()
+        internal_idx = [i for i, rct in enumerate(model.reactions) if not rct.boundary]
+        basis = nullspace(create_stoichiometric_matrix(model)[:, internal_idx])
+        expected = {model.reactions[i].id for i, row in zip(internal_idx, basis)
+                    if np.abs(row).max() > FBAPipeline.ZERO_FLUX}
+        self.assertEqual(self.pipeline().internal_nullspace_support(model), expected)
+
+        with tempfile.TemporaryDirectory() as directory:
+            cache = ModelCache(directory, 1 << 20)
+            internal._memory.clear()
+            result = internal.internal_nullspace(model, cache)
+            # Bounds do not change the fingerprint
+            model.reactions.FRD7.knock_out()
+            self.assertIs(internal.internal_nullspace(model.copy(), cache), result)
+            internal._memory.clear()
+            self.assertEqual(internal.internal_nullspace(model, cache).support(),
+                             result.support())
+            self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_snapshot(self):
+        model = self.model()
+        with tempfile.TemporaryDirectory() as directory:
+            cache = SnapshotCache(directory, 1 << 20)
+            cache.put('textbook', model)
+            snapshot = cache.get('textbook')
+            self.assertEqual(cache.bytes_read, cache.bytes_written)
+
+            self.assertEqual(snapshot.field('rct_id'), [rct.id for rct in model.reactions])
+            self.assertTrue(np.array_equal(snapshot.stoichiometry().toarray(),
+                                           create_stoichiometric_matrix(model)))
+            restored = pickle.loads(pickle.dumps(snapshot))
+            self.assertEqual(restored.path, snapshot.path)
+            self.assertTrue(np.array_equal(restored.arrays['upper_bound'],
+                                           [rct.upper_bound for rct in model.reactions]))
+
+            # Null spaces read from the snapshot are those of the model
+            self.assertEqual(internal.stoichiometry_fingerprint(snapshot),
+                             internal.stoichiometry_fingerprint(model))
+            self.assertEqual(internal.compute_internal_nullspace(snapshot).support(),
+                             internal.compute_internal_nullspace(model).support())
+            internal._memory.clear()
+            self.assertEqual(self.pipeline(snapshot=snapshot).internal_nullspace_support(model),
+                             self.pipeline().internal_nullspace_support(model))
+
+    def test_model_cache(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = ModelCache(directory, 1 << 20)
+            self.assertIsNone(cache.get('a'))
+            cache.put('a', b'a' * 1000)
+            cache.put('b', b'b' * 1000)
+            size = os.path.getsize(cache._path('a'))
+            os.utime(cache._path('a'), (1000, 1000))
+            os.utime(cache._path('b'), (2000, 2000))
+
+            # A hit marks a as recently used, so b is evicted first
+            self.assertEqual(cache.get('a'), b'a' * 1000)
+            cache.max_bytes = 2 * size
+            cache.put('c', b'c' * 1000)
+            self.assertIsNone(cache.get('b'))
+            self.assertEqual(cache.get('a'), b'a' * 1000)
+            self.assertEqual(cache.get('c'), b'c' * 1000)
+
+            stats = cache.stats()
+            self.assertEqual((stats['hits'], stats['misses']), (3, 2))
+            self.assertEqual((stats['entries'], stats['bytes']), (2, 2 * size))
+            self.assertEqual(stats['bytes_read'], 3 * size)
+            self.assertEqual(stats['bytes_written'], 3 * size)
+
+    def test_fbamodel_paths(self):
+        with open(self.FBAMODEL_JSON) as f:
+            fbamodel_json = json.load(f)
+        subset = select_paths(fbamodel_json, FBAMODEL_PATHS)
+        self.assertNotIn('gapfillings', subset)
+        self.assertNotIn('aliases', subset['modelcompounds'][0])
+
+        # Nothing the conversion reads is left out of the download
+        self.assertModelsEqual(build_model(subset), build_model(fbamodel_json))
+
+    def test_stream_model(self):
+        with open(self.FBAMODEL_JSON) as f:
+            fbamodel_json = json.load(f)
+        expected = build_model(fbamodel_json)
+        members = {key: value for key, value in fbamodel_json.items()
+                   if key not in StreamedFBAModel.STREAMED}
+
+        # Object data of a get_objects2 response, keys sorted as returned
+        response = {'id': '1', 'version': '1.1',
+                    'result': [{'data': [{'data': fbamodel_json, 'info': []}]}]}
+        f = io.BytesIO(json.dumps(response, sort_keys=True).encode('utf-8'))
+        model, data = stream_model(f, prefix=OBJECT_DATA_PREFIX)
+        self.assertModelsEqual(model, expected)
+        self.assertEqual(data, members)
+
+        # Lists before the members the builder reads first are buffered
+        reordered = dict(reversed(list(fbamodel_json.items())))
+        model, data = stream_model(io.BytesIO(json.dumps(reordered).encode('utf-8')))
+        self.assertModelsEqual(model, expected)
+        self.assertEqual(data, members)
+
+    def test_loopless_fba(self):
+        for all_reversible in (False, True):
+            model = self.model()
+            pipeline = self.pipeline(fba_type='Loopless FBA')
+            if all_reversible:
+                pipeline.set_bounds(model, np.arange(len(model.reactions)),
+                                    -pipeline.MAX_BOUND, pipeline.MAX_BOUND)
+            expected = loopless_solution(model)
+            solution = pipeline.run_fba(model)
+            self.assertEqual(solution.status, 'optimal')
+            self.assertAlmostEqual(solution.objective_value, expected.objective_value,
+                                   delta=self.TOLERANCE)
+            self.assertAlmostEqual(solution.fluxes['Biomass_Ecoli_core'],
+                                   expected.fluxes['Biomass_Ecoli_core'], delta=self.TOLERANCE)
+
+            # Fluxes are loopless if cobra's loopless MILP admits them. Its
+            # Fast-SNP null space is random, seeded so glpk never stalls.
+            reference = model.copy()
+            np.random.seed(0)
+            add_loopless(reference)
+            fluxes = solution.fluxes.values
+            pipeline.set_bounds(reference, np.arange(len(fluxes)), fluxes - self.TOLERANCE,
+                                fluxes + self.TOLERANCE)
+            self.assertFalse(np.isnan(reference.slim_optimize()))
+
+    def test_highs(self):
+        for fba_type in ('FBA', 'pFBA'):
+            model = self.model()
+            expected = self.pipeline(fba_type=fba_type)
+            expected_sol = expected.run_fba(model)
+            expected_fva = expected.run_fva(model, expected_sol)
+
+            pipeline = self.pipeline(fba_type=fba_type, solver='highs')
+            solution = pipeline.run_fba(model)
+            self.assertEqual(solution.status, 'optimal')
+            self.assertAlmostEqual(pipeline.optimum, expected.optimum, delta=self.TOLERANCE)
+            self.assertAlmostEqual(solution.objective_value, expected_sol.objective_value,
+                                   delta=self.TOLERANCE)
+            self.assertTrue(pipeline.verify_solution(model, solution))
+            self.assertRangesEqual(pipeline.run_fva(model, solution), expected_fva)
+
+            with model:
+                model.reactions.ATPM.lower_bound = 1000
+                with self.assertRaises(OptimizationError):
+                    pipeline.run_fba(model)
+                self.assertIsNone(pipeline.optimum)
+
+    def test_infeasible_pfba(self):
+        media = KBaseBiochemMedia({'id': 'Complete', 'name': 'Complete', 'mediacompounds': []})
+        for solver in ('glpk', 'highs'):
+            pipeline = self.pipeline(fba_type='pFBA', solver=solver,
+                                     custom_bound_list=[('ATPM', 1000, 1000)])
+            with self.assertRaises(OptimizationError):
+                pipeline.run(self.model(), media)
+            self.assertIsNone(pipeline.optimum)
+
+    def test_race(self):
+        for fba_type in ('FBA', 'pFBA', 'Loopless FBA'):
+            model = self.model()
+            expected = self.pipeline(fba_type=fba_type)
+            expected_sol = expected.run_fba(model)
+
+            pipeline = self.pipeline(fba_type=fba_type, solver='race',
+                                     race_solvers=['glpk', 'highs'])
+            solution = pipeline.run_fba(model)
+            if fba_type == 'Loopless FBA':
+                # highs leaves Loopless FBA to glpk, so there is no race
+                self.assertEqual(pipeline.solver, 'glpk')
+            else:
+                self.assertEqual(pipeline.solver_selection, 'race')
+                self.assertIn(pipeline.solver, pipeline.race_solvers)
+                self.assertIn(pipeline.solver, pipeline.race_seconds)
+            self.assertAlmostEqual(pipeline.optimum, expected.optimum, delta=self.TOLERANCE)
+            self.assertAlmostEqual(solution.objective_value, expected_sol.objective_value,
+                                   delta=self.TOLERANCE)
+            self.assertTrue(pipeline.verify_solution(model, solution))
+
+        # Only glpk returns a result for an infeasible model
+        model.reactions.ATPM.lower_bound = 1000
+        pipeline = self.pipeline(solver='race', race_solvers=['glpk', 'highs'])
+        self.assertEqual(pipeline.run_fba(model).status, 'infeasible')
+        self.assertEqual(pipeline.solver, 'glpk')
+        self.assertIsNone(pipeline.optimum)
+
+    def test_solver_profile(self):
+        profile = SolverProfile({'small': {'FBA': {'glpk': 1., 'highs': 2., 'coinor_cbc': 3.}},
+                                 'medium': {'FBA': {'highs': 1., 'glpk': 5.}}})
+        candidates = ['coinor_cbc', 'glpk', 'highs']
+        self.assertEqual(profile.choose('small', 'FBA', candidates), 'glpk')
+        self.assertEqual(profile.choose('small', 'FBA', ['coinor_cbc', 'highs']), 'highs')
+        self.assertEqual(profile.choose('medium', 'FBA', candidates), 'highs')
+        # Size classes without timings use the nearest one with them
+        self.assertEqual(profile.choose('large', 'FBA', candidates), 'highs')
+        self.assertEqual(profile.choose('medium', 'FBA', ['coinor_cbc']), 'coinor_cbc')
+        # Without any timings, fall back to glpk if it is a candidate
+        self.assertEqual(profile.choose('small', 'pFBA', candidates), 'glpk')
+        self.assertEqual(profile.choose('small', 'pFBA', ['highs']), 'highs')
+
+        profile.record('large', 'FBA', 'coinor_cbc', 0.5)
+        self.assertEqual(profile.choose('large', 'FBA', candidates), 'coinor_cbc')
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'profile.json')
+            profile.save(path)
+            self.assertEqual(SolverProfile.load(path).table, profile.table)
+            self.assertEqual(SolverProfile.load(os.path.join(directory, 'missing')).table, {})
+
+    def test_community_model(self):
+        model = self.model()
+        community = community_model(model, 3)
+        shared = [rct for rct in model.reactions
+                  if all(met.compartment == 'e' for met in rct.metabolites)]
+        self.assertEqual(len(community.reactions),
+                         3 * len(model.reactions) - 2 * len(shared))
+        self.assertEqual(size_class(community), 'small')
+        self.assertEqual({rct.id for rct in linear_reaction_coefficients(community)},
+                         {f'Biomass_Ecoli_core_{k}' for k in range(3)})
+        # The copies share the uptake of one model
+        self.assertLess(community.slim_optimize(), model.slim_optimize() + self.TOLERANCE)
+
+    @staticmethod
+    def variable_bounds(model):
+        return {var.name: (var.lb, var.ub) for var in model.variables}
+
+    def test_set_bounds(self):
+        model = self.model()
+        expected = model.copy()
+        original = (self.variable_bounds(model), [rct.bounds for rct in model.reactions])
+        # Repeated indices keep their last bounds, as assigned one by one
+        changes = [(0, -10, 10), (5, 0, 0), (7, -np.inf, np.inf), (0, -3, -2),
+                   (12, 0, 0.5), (20, 0, 1000), (24, 1, 5)]
+        for i, lower, upper in changes:
+            expected.reactions[i].bounds = lower, upper
+        indices, lower, upper = map(list, zip(*changes))
+
+        with model:
+            FBAPipeline.set_bounds(model, indices, lower, upper)
+            self.assertEqual([rct.bounds for rct in model.reactions],
+                             [rct.bounds for rct in expected.reactions])
+            self.assertEqual(self.variable_bounds(model), self.variable_bounds(expected))
+            self.assertAlmostEqual(model.slim_optimize(), expected.slim_optimize(),
+                                   delta=self.TOLERANCE)
+            with self.assertRaises(ValueError):
+                FBAPipeline.set_bounds(model, [1, 2], [0, 5], [1, 4])
+        self.assertEqual((self.variable_bounds(model), [rct.bounds for rct in model.reactions]),
+                         original)
+
+    def test_blocked_reactions(self):
+        model = self.model()
+        model.reactions.PGI.knock_out()
+        # Reversible reactions are left to FVA
+        expected = {rct_id for rct_id in find_blocked_reactions(model, processes=1)
+                    if model.reactions.get_by_id(rct_id).reversibility is False}
+        self.assertIn('PGI', expected)
+        pipeline = self.pipeline()
+        self.assertEqual(pipeline.find_blocked_reactions(model), expected)
+
+        fva_sol = self.run_fva(pipeline, model)
+        self.assertLessEqual(pipeline.blocked_reactions, expected)
+        self.assertFalse(fva_sol.loc[list(expected)].values.any())
+        self.assertRangesEqual(fva_sol, flux_variability_analysis(
+            model, fraction_of_optimum=pipeline.fraction_of_optimum_fva, processes=1))
+
+    @staticmethod
+    def disabled_reactions(model, gene_ids):
+        """Reaction ids disabled by knocking out gene_ids, by cobra."""
+        with model:
+            for gene_id in gene_ids:
+                model.genes.get_by_id(gene_id).knock_out()
+            return {rct.id for rct in model.reactions if not rct.functional}
+
+    def test_gpr(self):
+        model = self.model()
+        gpr = CompiledGPR(model)
+        gene_ids = [gene.id for gene in model.genes]
+        base_gene_ids = ['b0008', 'b3916']
+        base_disabled = self.disabled_reactions(model, base_gene_ids)
+        footprints = gpr.single_knockout_footprints(base_gene_ids)
+        for gene_id in gene_ids:
+            disabled = self.disabled_reactions(model, [gene_id])
+            self.assertEqual(gpr.disabled_reactions([gene_id]), disabled, gene_id)
+            self.assertEqual(footprints[gene_id], self.disabled_reactions(
+                model, base_gene_ids + [gene_id]) - base_disabled, gene_id)
+        for pair in zip(gene_ids, gene_ids[1:] + gene_ids[:1]):
+            self.assertEqual(gpr.knockout_footprint(pair, base_gene_ids),
+                             self.disabled_reactions(model, base_gene_ids + list(pair))
+                             - base_disabled, pair)
+
+    def test_essential_genes(self):
+        expected = single_gene_deletion(self.model(), processes=1)
+        expected = {next(iter(ids)): growth for ids, growth in
+                    zip(expected['ids'], expected['growth'])}
+        expected_essential = {gene.id for gene in find_essential_genes(
+            self.model(), threshold=FBAPipeline.ESSENTIAL_THRESHOLD, processes=1)}
+
+        for processes in (1, 2):
+            model = self.model()
+            pipeline = self.pipeline(ko_processes=processes)
+            fba_sol = pipeline.run_fba(model)
+            growth = pipeline.run_essentiality_screen(model, fba_sol=fba_sol,
+                                                      optimum=pipeline.optimum)
+            self.assertTrue(pipeline.ko_complete)
+            self.assertEqual(set(growth), set(expected))
+            # Infeasible knockouts are nan on both sides
+            np.testing.assert_allclose([growth[gene_id] for gene_id in expected],
+                                       list(expected.values()), rtol=0, atol=self.TOLERANCE)
+            self.assertEqual({gene.id for gene in
+                              pipeline.classify_essential_genes(model, growth)},
+                             expected_essential)
+
+    def test_lethal_pairs(self):
+        model = self.model()
+        essential = {gene.id for gene in find_essential_genes(
+            model, threshold=FBAPipeline.ESSENTIAL_THRESHOLD, processes=1)}
+        deletions = double_gene_deletion(model, processes=1)
+        expected = set()
+        for ids, growth in zip(deletions['ids'], deletions['growth']):
+            if len(ids) == 2 and not ids & essential and \
+                    (np.isnan(growth) or growth < FBAPipeline.ESSENTIAL_THRESHOLD):
+                expected.add(frozenset(ids))
+
+        for processes in (1, 2):
+            model = self.model()
+            pipeline = self.pipeline(ko_processes=processes)
+            fba_sol = pipeline.run_fba(model)
+            fva_sol = pipeline.run_fva(model, fba_sol)
+            ko_growth = pipeline.run_essentiality_screen(model, fba_sol=fba_sol,
+                                                         optimum=pipeline.optimum)
+            lethal_pairs = pipeline.run_double_ko_screen(model, ko_growth, fba_sol=fba_sol,
+                                                         fva_sol=fva_sol)
+            self.assertTrue(pipeline.double_ko_complete)
+            self.assertEqual({frozenset(pair[:2]) for pair in lethal_pairs}, expected)
+
+        # Genes a partial single knockout screen left out may be essential
+        # on their own, so no pair is reported with them
+        unscreened = sorted(essential)[:3]
+        partial = {gene_id: growth for gene_id, growth in ko_growth.items()
+                   if gene_id not in unscreened}
+        lethal_pairs = pipeline.run_double_ko_screen(model, partial, fba_sol=fba_sol,
+                                                     fva_sol=fva_sol)
+        self.assertFalse(pipeline.double_ko_complete)
+        self.assertFalse({gene_id for pair in lethal_pairs for gene_id in pair[:2]}
+                         & set(unscreened))
+        self.assertEqual({frozenset(pair[:2]) for pair in lethal_pairs}, expected)
+
+    def test_time_budget(self):
+        # A budget spent before the run cuts FVA and the knockout screens
+        # short, leaving only what needs no LP
+        pipeline = self.pipeline(fva_type='FVA', is_single_ko=True, is_double_ko=True,
+                                 time_budget_seconds=1, budget_start=time.monotonic() - 100,
+                                 genome_ref='1/2/3')
+        model = self.model()
+        kbase_fba_obj, fva_sol, _, essential_genes = self.run_pipeline(pipeline, model)
+
+        self.assertFalse(pipeline.fva_complete)
+        unsolved = fva_sol.index[fva_sol.isna().any(axis=1)]
+        self.assertTrue(len(unsolved))
+        self.assertEqual({report.class_formater(rct_id, fva_sol, pipeline.blocked_reactions)
+                          for rct_id in unsolved}, {'unsolved'})
+        # Saved ranges of unsolved reactions are their bounds
+        variables = {var['modelreaction_ref'].split('/')[-1]: var
+                     for var in kbase_fba_obj['FBAReactionVariables']}
+        for rct_id in unsolved:
+            if rct_id in variables:
+                rct = model.reactions.get_by_id(rct_id)
+                self.assertEqual((variables[rct_id]['min'], variables[rct_id]['max']),
+                                 rct.bounds)
+
+        self.assertFalse(pipeline.ko_complete)
+        self.assertLess(len(pipeline.ko_growth), len(model.genes))
+        self.assertLessEqual({gene.id for gene in essential_genes}, set(pipeline.ko_growth))
+        self.assertFalse(pipeline.double_ko_complete)
+        self.assertEqual(pipeline.lethal_pairs, [])
+        self.assertEqual(kbase_fba_obj['FBADeletionResults'], [])
+
+    def test_apply_media(self):
+        model = self.model()
+        # Exchange ids as built by cobrakbase for compounds in e0
+        for rct in model.exchanges:
+            rct.id += '0'
+        model.repair()
+        media = KBaseBiochemMedia({'id': 'media', 'name': 'media', 'mediacompounds': [
+            {'compound_ref': f'489/6/1/compounds/id/{cpd_id}', 'minFlux': min_flux,
+             'maxFlux': max_flux}
+            for cpd_id, min_flux, max_flux in (('glc__D', -100, 5), ('o2', -100, 1000),
+                                               ('nh4', -100, 1000), ('pi', -100, 1000),
+                                               ('h2o', -100, 1000), ('h', -100, 1000),
+                                               ('co2', -20, 1000))]})
+        expected = {f'EX_{cpd_id}': bounds
+                    for cpd_id, bounds in media.get_media_constraints().items()}
+        self.assertEqual(expected['EX_glc__D_e0'], (-5, 100))
+
+        original = {rct.id: rct.bounds for rct in model.exchanges}
+        with model:
+            self.pipeline().apply_media(model, media)
+            for rct in model.exchanges:
+                self.assertEqual(rct.bounds, expected.get(rct.id, (0, original[rct.id][1])),
+                                 rct.id)
+            self.assertAlmostEqual(model.slim_optimize(), 0.4155977750928, delta=self.TOLERANCE)
+        self.assertEqual({rct.id: rct.bounds for rct in model.exchanges}, original)
+
+    def test_uptake_constraints(self):
+        media = KBaseBiochemMedia({'id': 'media', 'name': 'media', 'mediacompounds': []})
+        free = self.model().slim_optimize()
+        for max_uptakes, default_max_uptake in (({'C': 30., 'O': 40.}, 0.),
+                                                ({'C': 100., 'N': 5.}, 20.)):
+            # Reference built as a symbolic sum over the medium
+            expected = self.model()
+            pipeline = self.pipeline(default_max_uptake=default_max_uptake)
+            pipeline.max_uptakes.update(max_uptakes)
+            if default_max_uptake:
+                indices = pipeline.reaction_indices(expected, expected.medium)
+                upper = [expected.reactions[i].upper_bound for i in indices]
+                pipeline.set_bounds(expected, indices, -default_max_uptake, upper)
+            for atom, max_uptake in max_uptakes.items():
+                expression = 0
+                for rct_id in expected.medium:
+                    ex_rct = expected.reactions.get_by_id(rct_id)
+                    count = atom_count(next(iter(ex_rct.metabolites)).formula).get(atom)
+                    if count:
+                        expression += count * ex_rct.reverse_variable
+                expected.add_cons_vars(expected.problem.Constraint(
+                    expression, lb=0, ub=max_uptake, name=f'expected_{atom}'))
+
+            # Constraints are set in a model context, as run_many does
+            model = self.model()
+            with model:
+                pipeline.configure_media(model, media)
+                constraints = [model.constraints[UptakeConstraints.PREFIX + atom]
+                               for atom in max_uptakes]
+                for atom, constraint in zip(max_uptakes, constraints):
+                    coefs = constraint.get_linear_coefficients(
+                        [rct.reverse_variable for rct in model.exchanges])
+                    expected_coefs = expected.constraints[f'expected_{atom}'] \
+                        .get_linear_coefficients([rct.reverse_variable
+                                                  for rct in expected.exchanges])
+                    self.assertEqual({var.name: coef for var, coef in coefs.items() if coef},
+                                     {var.name: coef for var, coef in expected_coefs.items()
+                                      if coef})
+                self.assertAlmostEqual(model.slim_optimize(), expected.slim_optimize(),
+                                       delta=self.TOLERANCE)
+                # Some limit is binding
+                self.assertTrue(any(abs(constraint.primal - constraint.ub) < self.TOLERANCE
+                                    for constraint in constraints))
+
+            # Rolled back to free rows, which stay in the solver
+            for atom in max_uptakes:
+                constraint = model.constraints[UptakeConstraints.PREFIX + atom]
+                self.assertEqual((constraint.lb, constraint.ub), (None, None))
+            self.assertAlmostEqual(model.slim_optimize(), free, delta=self.TOLERANCE)
+
+    def test_stage_exit(self):
+        # A forked stage that dies without a result fails the run instead
+        # of leaving it waiting
+        stages = [fba_pipeline.Stage('forked', lambda model, results, deadline: os._exit(3),
+                                     lps=2),
+                  fba_pipeline.Stage('local', lambda model, results, deadline: 1)]
+        with self.assertRaisesRegex(RuntimeError, r'forked \(exit code 3\)'):
+            self.pipeline().run_stages(self.model(), stages)
+
+    def test_stage_threads(self):
+        # CBC in a concurrent stage uses the processors of the stage
+        model = self.model('coinor_cbc')
+        model.solver.configuration.threads = -1
+        stage = fba_pipeline.Stage('fva', lambda model, results, deadline:
+                                   model.solver.configuration.threads,
+                                   processes_attr='fva_processes')
+        pipeline = self.pipeline(fva_processes=None)
+        self.assertEqual(fba_pipeline._run_stage(pipeline, stage, model, {}, None, 2), 2)
+        self.assertEqual(model.solver.configuration.threads, -1)
+        self.assertIsNone(pipeline.fva_processes)
+
+    def test_nested_chunks(self):
+        model = self.model()
+        pipeline = self.pipeline(solver='highs')
+
+        def chunk(state, _):
+            # highs FVA maps its chunks over a HighsLP of the outer model
+            fba_sol = pipeline.run_fba(state.model)
+            pipeline.run_fva(state.model, fba_sol)
+            return state.model
+
+        self.assertEqual(list(fba_pipeline._map_chunks(model, chunk, [0, 1], 1)),
+                         [model, model])
+
+
+if __name__ == '__main__':
+    unittest.main()